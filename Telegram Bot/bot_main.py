@@ -1,15 +1,33 @@
 import os
 import logging
 import asyncio
-import requests
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton, InputFile
+from telegram.error import BadRequest, TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes, ConversationHandler
-import yt_dlp
-import ffmpeg
-import shutil
 import concurrent.futures
-import re
-import json
+import functools
+import sys
+import pathlib
+import secrets
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.media_cache import MediaCache
+from core.postprocess import ensure_mp4, probe
+from core.ffmpeg_service import FFmpegError, ffmpeg_service
+from core.info_cache import InfoCache
+from core.resolver import resolver
+from core import metrics, transfer
+from core.transfer import extractor_pool
+from core.ratelimit import classify, guard
+from core.batch import BATCH_CONCURRENCY, MAX_BATCH_ITEMS, collect, split_urls
+from core.clip import Clip, InvalidClip
+from core.broker import BROKER_URL, DOWNLOAD_QUEUE, from_url, result_store, wait_for
+from file_id_cache import FileIdCache
+from workspace import JobWorkspace, estimate_size, purge_stale_workspaces
+from webhook import WebhookApp
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO
@@ -22,16 +40,306 @@ WAITING_FOR_INSTAGRAM_LINK, WAITING_FOR_TIKTOK_LINK = range(2)
 TEMP_FOLDER = "temp_downloads"
 os.makedirs(TEMP_FOLDER, exist_ok=True)
 
+MAX_DOWNLOADS_PER_USER = int(os.environ.get("MAX_DOWNLOADS_PER_USER", "2"))
+DOWNLOAD_WORKERS = int(os.environ.get("BOT_DOWNLOAD_WORKERS", str((os.cpu_count() or 1) * 4)))
+CONCURRENT_UPDATES = int(os.environ.get("BOT_CONCURRENT_UPDATES", "64"))
+
+# A self-hosted Bot API server (https://github.com/tdlib/telegram-bot-api), e.g. "http://localhost:8081/bot"
+BOT_API_URL = os.environ.get("BOT_API_URL")
+BOT_API_FILE_URL = os.environ.get("BOT_API_FILE_URL")
+# The local server shares our filesystem: uploads are passed as paths and the 2000 MB limit applies
+BOT_API_LOCAL = os.environ.get("BOT_API_LOCAL", "0") == "1"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "telegram")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+
+MAX_UPLOAD_BYTES = int(os.environ.get("TELEGRAM_UPLOAD_LIMIT_MB", "2000" if BOT_API_LOCAL else "50")) * 1024 * 1024
+TARGET_SIZE_MB = MAX_UPLOAD_BYTES / (1024 * 1024) * 0.9
+MAX_CONCURRENT_ENCODES = int(os.environ.get("MAX_CONCURRENT_ENCODES", "2"))
+ENCODE_THREADS = max(1, (os.cpu_count() or 1) // MAX_CONCURRENT_ENCODES)
+COMPRESSION_MODE = os.environ.get("COMPRESSION_MODE", "twopass")
+COMPRESSION_CRF = int(os.environ.get("COMPRESSION_CRF", "23"))
+METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", "9101"))
+METRICS_HOST = os.environ.get("BOT_METRICS_HOST", "127.0.0.1")
+
 active_downloads = {}
+encode_slots = asyncio.Semaphore(MAX_CONCURRENT_ENCODES)
+download_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=DOWNLOAD_WORKERS,
+    thread_name_prefix='download'
+)
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+media_cache = MediaCache.from_env()
+info_cache = InfoCache.from_env(os.path.join(BOT_DIR, "info_cache"))
+file_id_cache = FileIdCache(
+    os.environ.get("FILE_ID_CACHE_PATH", os.path.join(BOT_DIR, "file_ids.sqlite3")),
+    ttl=float(os.environ.get("FILE_ID_CACHE_TTL", 30 * 24 * 3600))
+)
+FILE_ID_PURGE_INTERVAL = float(os.environ.get("FILE_ID_PURGE_INTERVAL", 6 * 3600))
+# With a broker, downloads run on the worker nodes (WebSite/backend/worker.py)
+broker = from_url(BROKER_URL) if BROKER_URL else None
+results = result_store() if broker else None
+
+metrics.registry.gauge('videodw_active_downloads', 'Downloads in progress').set_function(
+    lambda: sum(active_downloads.values())
+)
 
-def cleanup_temp_files(user_id):
-    user_folder = os.path.join(TEMP_FOLDER, str(user_id))
-    if os.path.exists(user_folder):
+def acquire_download_slot(user_id) -> bool:
+    if active_downloads.get(user_id, 0) >= MAX_DOWNLOADS_PER_USER:
+        return False
+    active_downloads[user_id] = active_downloads.get(user_id, 0) + 1
+    return True
+
+def release_download_slot(user_id):
+    remaining = active_downloads.get(user_id, 0) - 1
+    if remaining > 0:
+        active_downloads[user_id] = remaining
+    else:
+        active_downloads.pop(user_id, None)
+
+async def run_blocking(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(download_executor, functools.partial(func, *args))
+
+def extract_info(platform, link, ydl_opts):
+    with extractor_pool.acquire(platform, ydl_opts) as ydl, metrics.stage('extract_info', platform):
+        return info_cache.extract(ydl, link)
+
+def extract_video_info(link, ydl_opts):
+    opts = dict(ydl_opts, format='best/bestvideo+bestaudio')
+    return guard.call('instagram', extract_info, 'instagram', link, opts)
+
+def extract_tiktok_info(link, ydl_opts):
+    info = guard.call('tiktok', extract_info, 'tiktok', link, ydl_opts)
+    if info.get('duration', 0) == 0:
+        raise Exception("Це фото або GIF. Бот підтримує лише відео з TikTok.")
+    return info
+
+def find_video_file(output_folder, video_path):
+    if os.path.exists(video_path):
+        return video_path
+    mp4_files = [f for f in os.listdir(output_folder) if f.endswith('.mp4')]
+    if mp4_files:
+        return os.path.join(output_folder, mp4_files[0])
+    raise Exception("Не вдалося знайти завантажене відео")
+
+def download_video(info, ydl_opts, output_folder, video_path, cache_key, link, fallback_format=None):
+    cached_path = media_cache.get(cache_key)
+    if cached_path:
+        return cached_path
+
+    platform = (info.get('extractor_key') or '').lower()
+    started = time.perf_counter()
+    try:
+        result = guard.call(platform, transfer.download, ydl_opts, info, platform)
+    except Exception as e:
+        # Transient failures were already retried; only a format problem is worth a second selection
+        if not fallback_format or classify(e) != 'permanent':
+            raise
+        logger.error(f"First attempt failed: {str(e)}")
+        result = guard.call(platform, transfer.download, dict(ydl_opts, format=fallback_format), info, platform)
+    # The parallel merge is recorded as its own stage
+    metrics.STAGE_SECONDS.observe(
+        time.perf_counter() - started - result.get('merge_seconds', 0),
+        stage='download', platform=platform
+    )
+
+    downloaded = [d.get('filepath') for d in result.get('requested_downloads', [])]
+    if downloaded and downloaded[0] and os.path.exists(downloaded[0]):
+        with metrics.stage('postprocess', platform):
+            video_path, action = ensure_mp4(downloaded[0])
+        logger.info(f"Постобробка {cache_key[:12]}: {action}")
+    video_path = find_video_file(output_folder, video_path)
+    if os.path.getsize(video_path) == 0:
+        raise Exception("Завантажений файл порожній")
+    metrics.BYTES_TOTAL.inc(os.path.getsize(video_path), direction='downloaded', platform=platform)
+
+    return media_cache.put(cache_key, video_path, url=link)
+
+async def send_cached_video(context, chat_id, video_key, caption) -> bool:
+    file_id = file_id_cache.get(video_key)
+    if not file_id:
+        return False
+    try:
+        await context.bot.send_video(
+            chat_id=chat_id,
+            video=file_id,
+            caption=caption,
+            supports_streaming=True
+        )
+        return True
+    except BadRequest as e:
+        logger.warning(f"Telegram rejected cached file_id for {video_key}: {str(e)}")
+        file_id_cache.invalidate(video_key)
+        return False
+    except TelegramError as e:
+        # Network errors and timeouts say nothing about the file_id; keep it and upload this time
+        logger.warning(f"Sending cached file_id for {video_key} failed: {str(e)}")
+        return False
+
+async def upload_video(context, chat_id, video_key, video_path, caption):
+    platform = video_key.split(':')[0]
+    size = os.path.getsize(video_path)
+    handle = None
+    if BOT_API_LOCAL:
+        # The local server reads the file itself; in local mode a Path is sent as a file:// URI
+        video = pathlib.Path(os.path.abspath(video_path))
+    else:
+        # The HTTP client streams from the open file instead of holding it all in memory
+        handle = open(video_path, 'rb')
+        video = InputFile(handle, filename=os.path.basename(video_path), read_file_handle=False)
+    try:
+        with metrics.stage('upload', platform):
+            sent_message = await context.bot.send_video(
+                chat_id=chat_id,
+                video=video,
+                filename=os.path.basename(video_path),
+                caption=caption,
+                supports_streaming=True
+            )
+    finally:
+        if handle:
+            handle.close()
+    metrics.BYTES_TOTAL.inc(size, direction='uploaded', platform=platform)
+    media = sent_message.video or sent_message.animation or sent_message.document
+    if media:
+        file_id_cache.put(video_key, media.file_id)
+
+PLATFORM_LABELS = {'instagram': 'Instagram', 'tiktok': 'TikTok'}
+FALLBACK_FORMATS = {'instagram': 'best[ext=mp4]/best'}
+
+def ydl_options(platform):
+    if platform == 'instagram':
+        return {
+            'format': '(mp4)[width>=0][height>=0]',  
+            'quiet': False,
+            'no_warnings': False,
+            'merge_output_format': 'mp4', 
+            'extract_flat': False,
+            'nocheckcertificate': True,
+            'addheader': [
+                ('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'),
+                ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8'),
+                ('Accept-Language', 'en-US,en;q=0.5'),
+            ]
+        }
+    return {
+        'format': 'best',
+        'quiet': False,
+        'no_warnings': False,
+        'extract_flat': False,
+        'nocheckcertificate': True,
+        'addheader': [
+            ('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'),
+            ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8'),
+        ]
+    }
+
+async def fetch_from_workers(resolved, clip=None, message=None) -> str:
+    """Queue the web pipeline's mp4 download for the workers; returns a lease on the file in the result store"""
+    # Same payload and key as the API's jobs, so both front ends share one download
+    payload = {'task': 'download_media', 'args': [resolved.canonical_url, 'mp4', str(uuid.uuid4()), clip]}
+    message_id = await asyncio.to_thread(
+        broker.enqueue, DOWNLOAD_QUEUE, payload, 0, repr((resolved.key, 'mp4', clip))
+    )
+    last_update = 0
+
+    async def report(record):
+        nonlocal last_update
+        now = time.monotonic()
+        if message is None or now - last_update < 5:
+            return
+        last_update = now
+        if record['state'] == 'queued':
+            text = f"У черзі: {record['position']}"
+        else:
+            text = f"Завантаження... {(record['progress'] or {}).get('progress', 0)}%"
         try:
-            shutil.rmtree(user_folder)
-            logger.info(f"Очищено тимчасові файли користувача {user_id}")
-        except Exception as e:
-            logger.error(f"Помилка очищення тимчасових файлів: {str(e)}")
+            await message.edit_text(text)
+        except TelegramError:
+            pass
+
+    try:
+        record = await wait_for(broker, message_id, report)
+    except asyncio.CancelledError:
+        await asyncio.to_thread(broker.cancel, message_id)
+        raise
+    if record['state'] != 'done':
+        raise Exception(record['error'] or "Не вдалося завантажити відео")
+    # Leased so the result store keeps the file until we have sent it
+    lease = await asyncio.to_thread(results.lease, message_id)
+    if lease is None:
+        raise Exception("Результат завантаження не знайдено")
+    return lease
+
+async def deliver_video(context, chat_id, resolved, message=None, clip=None) -> str:
+    """Send one video (or a clip of it) from the file_id cache, the media cache or a fresh download.
+
+    The download runs on a worker node when a broker is configured.
+
+    Returns the job outcome.
+    """
+    platform = resolved.platform
+    quality = clip.label if clip else 'best'
+    video_key = f"{resolved.key}:{clip.label}" if clip else resolved.key
+    caption = f"Ось ваше {'відео' if clip is None else 'фрагмент відео'} з {PLATFORM_LABELS[platform]}!"
+    if await send_cached_video(context, chat_id, video_key, caption):
+        return 'cached'
+
+    ydl_opts = ydl_options(platform)
+    cache_key = MediaCache.make_key(platform, resolved.video_id, 'mp4', quality, ydl_opts['format'])
+    video_path = await asyncio.to_thread(media_cache.get, cache_key)
+    info = None
+    lease = None
+    if not video_path and broker:
+        lease = await fetch_from_workers(resolved, clip, message)
+        video_path = lease.path
+    try:
+        if not video_path:
+            extract = extract_video_info if platform == 'instagram' else extract_tiktok_info
+            info = await run_blocking(extract, resolved.canonical_url, ydl_opts)
+            if clip:
+                ydl_opts.update(clip.bounded(info.get('duration')).ydl_options())
+        async with JobWorkspace(TEMP_FOLDER, expected_size=info and estimate_size(info)) as workspace:
+            if not video_path:
+                ydl_opts['outtmpl'] = workspace.file(f'{platform}_video.%(ext)s')
+                video_path = await run_blocking(
+                    download_video, info, ydl_opts, workspace.path,
+                    workspace.file(f'{platform}_video.mp4'),
+                    cache_key, resolved.canonical_url, FALLBACK_FORMATS.get(platform)
+                )
+
+            if os.path.getsize(video_path) > MAX_UPLOAD_BYTES:
+                if message:
+                    await message.edit_text("Відео завелике, стискаємо...")
+                video_path = await fit_upload_limit(
+                    video_path, workspace, platform, resolved.video_id, message, f'telegram-{quality}'
+                )
+
+            if message:
+                await message.edit_text("Надсилання відео в чат...")
+            await upload_video(context, chat_id, video_key, video_path, caption)
+    finally:
+        if lease:
+            lease.release()
+    return 'done'
+
+async def send_done_message(context, chat_id):
+    keyboard = [
+        [InlineKeyboardButton("📸 Instagram", callback_data="instagram")],
+        [InlineKeyboardButton("🎵 TikTok", callback_data="tiktok")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await context.bot.send_message(
+        chat_id=chat_id,
+        text="Готово! Що бажаєте зробити далі?",
+        reply_markup=reply_markup
+    )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     start_keyboard = [[KeyboardButton("🔄 Головне меню")]] 
@@ -48,7 +356,9 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     inline_markup = InlineKeyboardMarkup(inline_keyboard)
 
     await update.message.reply_text(
-        "Привіт! Я допоможу вам завантажити відео з Instagram та TikTok.",
+        "Привіт! Я допоможу вам завантажити відео з Instagram та TikTok.\n"
+        "Кілька відео одразу: /batch <посилання> <посилання> ...\n"
+        "Лише фрагмент: /clip <посилання> 0:15 0:30",
         reply_markup=start_markup
     )
     await update.message.reply_text(
@@ -72,88 +382,36 @@ async def tiktok_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 async def process_instagram_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     instagram_link = update.message.text.strip()
     
-    if not re.match(r'https?://(?:www\.)?instagram\.com/(?:p|reel|share)/[\w-]+/?', instagram_link):
+    if resolver.match(instagram_link) != 'instagram':
         await update.message.reply_text("Це не схоже на коректне посилання Instagram. Спробуйте ще раз.")
         return WAITING_FOR_INSTAGRAM_LINK
 
+    user_id = update.effective_user.id
+    if not acquire_download_slot(user_id):
+        await update.message.reply_text("Зачекайте, поки завершиться попереднє завантаження.")
+        return WAITING_FOR_INSTAGRAM_LINK
+
     message = await update.message.reply_text("Завантаження розпочато... Будь ласка, зачекайте.")
     chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
-    output_folder = os.path.join(TEMP_FOLDER, str(user_id))
-    os.makedirs(output_folder, exist_ok=True)
 
     try:
-        ydl_opts = {
-            'format': '(mp4)[width>=0][height>=0]',  
-            'outtmpl': os.path.join(output_folder, 'instagram_video.%(ext)s'),
-            'quiet': False,
-            'no_warnings': False,
-            'merge_output_format': 'mp4', 
-            'postprocessors': [{
-                'key': 'FFmpegVideoConvertor',
-                'preferedformat': 'mp4',
-            }],
-            'extract_flat': False,
-            'nocheckcertificate': True,
-            'addheader': [
-                ('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'),
-                ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8'),
-                ('Accept-Language', 'en-US,en;q=0.5'),
-            ]
-        }
-
-        video_path = os.path.join(output_folder, 'instagram_video.mp4')
         await message.edit_text("Завантаження відео...")
 
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([instagram_link])
-        except Exception as e:
-            logger.error(f"First attempt failed: {str(e)}")
-            ydl_opts['format'] = 'best[ext=mp4]/best'
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([instagram_link])
-
-        if not os.path.exists(video_path):
-            mp4_files = [f for f in os.listdir(output_folder) if f.endswith('.mp4')]
-            if mp4_files:
-                video_path = os.path.join(output_folder, mp4_files[0])
-            else:
-                raise Exception("Не вдалося знайти завантажене відео")
-
-        file_size = os.path.getsize(video_path) / (1024 * 1024)
-        if file_size == 0:
-            raise Exception("Завантажений файл порожній")
-
-        await message.edit_text("Надсилання відео в чат...")
-        
-        with open(video_path, 'rb') as video_file:
-            await context.bot.send_video(
-                chat_id=chat_id,
-                video=video_file,
-                caption="Ось ваше відео з Instagram!",
-                supports_streaming=True
-            )
+        with metrics.stage('resolve', 'instagram'):
+            resolved = await run_blocking(resolver.resolve, instagram_link)
+        outcome = await deliver_video(context, chat_id, resolved, message)
 
-        keyboard = [
-            [InlineKeyboardButton("📸 Instagram", callback_data="instagram")],
-            [InlineKeyboardButton("🎵 TikTok", callback_data="tiktok")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Готово! Що бажаєте зробити далі?",
-            reply_markup=reply_markup
-        )
+        metrics.JOBS_TOTAL.inc(platform=resolved.platform, format='mp4', outcome=outcome)
+        await send_done_message(context, chat_id)
 
     except Exception as e:
+        metrics.JOBS_TOTAL.inc(platform='instagram', format='mp4', outcome='failed')
         error_message = f"Помилка: {str(e)}"
         logger.error(error_message)
         await context.bot.send_message(chat_id=chat_id, text=error_message)
 
     finally:
-        await asyncio.to_thread(cleanup_temp_files, user_id)
+        release_download_slot(user_id)
         try:
             await message.delete()
         except Exception:
@@ -164,76 +422,36 @@ async def process_instagram_link(update: Update, context: ContextTypes.DEFAULT_T
 async def process_tiktok_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     tiktok_link = update.message.text.strip()
     
-    if not re.match(r'https?://(?:www\.|vm\.)?tiktok\.com/', tiktok_link):
+    if resolver.match(tiktok_link) != 'tiktok':
         await update.message.reply_text("Це не схоже на коректне посилання TikTok. Спробуйте ще раз.")
         return WAITING_FOR_TIKTOK_LINK
 
+    user_id = update.effective_user.id
+    if not acquire_download_slot(user_id):
+        await update.message.reply_text("Зачекайте, поки завершиться попереднє завантаження.")
+        return WAITING_FOR_TIKTOK_LINK
+
     message = await update.message.reply_text("Завантаження розпочато... Будь ласка, зачекайте.")
     chat_id = update.effective_chat.id
-    user_id = update.effective_user.id
-    output_folder = os.path.join(TEMP_FOLDER, str(user_id))
-    os.makedirs(output_folder, exist_ok=True)
 
     try:
-        ydl_opts = {
-            'format': 'best',
-            'outtmpl': os.path.join(output_folder, 'tiktok_video.%(ext)s'),
-            'quiet': False,
-            'no_warnings': False,
-            'extract_flat': False,
-            'nocheckcertificate': True,
-            'addheader': [
-                ('User-Agent', 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'),
-                ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8'),
-            ]
-        }
-
-        video_path = os.path.join(output_folder, 'tiktok_video.mp4')
         await message.edit_text("Отримання відео без водяного знаку...")
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(tiktok_link, download=False)
-            if info.get('duration', 0) == 0:
-                raise Exception("Це фото або GIF. Бот підтримує лише відео з TikTok.")
-            
-            ydl.download([tiktok_link])
-
-        if not os.path.exists(video_path):
-            mp4_files = [f for f in os.listdir(output_folder) if f.endswith('.mp4')]
-            if mp4_files:
-                video_path = os.path.join(output_folder, mp4_files[0])
-            else:
-                raise Exception("Не вдалося знайти завантажене відео")
+        with metrics.stage('resolve', 'tiktok'):
+            resolved = await run_blocking(resolver.resolve, tiktok_link)
+        outcome = await deliver_video(context, chat_id, resolved, message)
 
-        await message.edit_text("Надсилання відео в чат...")
-        
-        with open(video_path, 'rb') as video_file:
-            await context.bot.send_video(
-                chat_id=chat_id,
-                video=video_file,
-                caption="Ось ваше відео з TikTok!",
-                supports_streaming=True
-            )
-
-        keyboard = [
-            [InlineKeyboardButton("📸 Instagram", callback_data="instagram")],
-            [InlineKeyboardButton("🎵 TikTok", callback_data="tiktok")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text="Готово! Що бажаєте зробити далі?",
-            reply_markup=reply_markup
-        )
+        metrics.JOBS_TOTAL.inc(platform=resolved.platform, format='mp4', outcome=outcome)
+        await send_done_message(context, chat_id)
 
     except Exception as e:
+        metrics.JOBS_TOTAL.inc(platform='tiktok', format='mp4', outcome='failed')
         error_message = f"Помилка: {str(e)}"
         logger.error(error_message)
         await context.bot.send_message(chat_id=chat_id, text=error_message)
 
     finally:
-        await asyncio.to_thread(cleanup_temp_files, user_id)
+        release_download_slot(user_id)
         try:
             await message.delete()
         except Exception:
@@ -241,55 +459,292 @@ async def process_tiktok_link(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     return ConversationHandler.END
 
-def compress_video_sync(input_file, output_file, width, height, video_bitrate, audio_bitrate='128k', crf=23, preset='medium'):
+async def batch_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/batch <links>: several Instagram/TikTok videos, BATCH_CONCURRENCY at a time"""
+    urls = split_urls(' '.join(context.args or []))
+    links = [url for url in urls if resolver.match(url) in PLATFORM_LABELS]
+    if not links:
+        await update.message.reply_text(
+            "Надішліть посилання на Instagram або TikTok після команди, наприклад:\n/batch <посилання> <посилання>"
+        )
+        return
+    if len(links) > MAX_BATCH_ITEMS:
+        await update.message.reply_text(f"Забагато посилань, максимум {MAX_BATCH_ITEMS} за раз.")
+        return
+
+    user_id = update.effective_user.id
+    if not acquire_download_slot(user_id):
+        await update.message.reply_text("Зачекайте, поки завершиться попереднє завантаження.")
+        return
+
+    chat_id = update.effective_chat.id
+    message = await update.message.reply_text(f"Пакет: 0 з {len(links)}...")
+    errors = [f"{url}: непідтримуване посилання" for url in urls if url not in links]
+    done = 0
+    last_update = 0
+
+    async def report(force=False):
+        nonlocal last_update
+        now = time.monotonic()
+        if not force and now - last_update < 3:
+            return
+        last_update = now
+        try:
+            await message.edit_text(f"Пакет: {done} з {len(links)} готово, помилок: {len(errors)}")
+        except TelegramError:
+            pass
+
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def deliver(resolved):
+        nonlocal done
+        async with slots:
+            try:
+                outcome = await deliver_video(context, chat_id, resolved)
+            except Exception as e:
+                metrics.JOBS_TOTAL.inc(platform=resolved.platform, format='mp4', outcome='failed')
+                logger.error(f"Batch item {resolved.key} failed: {str(e)}")
+                errors.append(f"{resolved.canonical_url}: {str(e)}")
+            else:
+                metrics.JOBS_TOTAL.inc(platform=resolved.platform, format='mp4', outcome=outcome)
+                done += 1
+            await report()
+
     try:
-        (
-            ffmpeg
-            .input(input_file)
-            .output(
-                output_file,
-                vf=f"scale={width}:{height}",
-                video_bitrate=video_bitrate,
-                audio_bitrate=audio_bitrate,
-                crf=crf,
-                preset=preset
+        with metrics.stage('resolve'):
+            resolved, failed = await run_blocking(collect, links)
+        errors += [f"{url}: {error}" for url, error in failed]
+        await asyncio.gather(*(deliver(item) for item in resolved))
+        await report(force=True)
+        if errors:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="Не вдалося завантажити:\n" + "\n".join(errors)[:3500]
             )
-            .run(quiet=True, overwrite_output=True)
+        await send_done_message(context, chat_id)
+    except Exception as e:
+        logger.error(f"Batch error: {str(e)}")
+        await context.bot.send_message(chat_id=chat_id, text=f"Помилка: {str(e)}")
+    finally:
+        release_download_slot(user_id)
+
+async def clip_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/clip <link> <start> [end]: only a fragment of an Instagram/TikTok video"""
+    args = context.args or []
+    if len(args) < 2 or resolver.match(args[0]) not in PLATFORM_LABELS:
+        await update.message.reply_text(
+            "Надішліть посилання і час фрагмента, наприклад:\n/clip <посилання> 0:15 0:30"
         )
-        return os.path.exists(output_file)
+        return
+    try:
+        clip = Clip.parse(args[1], args[2] if len(args) > 2 else None)
+    except InvalidClip as e:
+        await update.message.reply_text(str(e))
+        return
+
+    user_id = update.effective_user.id
+    if not acquire_download_slot(user_id):
+        await update.message.reply_text("Зачекайте, поки завершиться попереднє завантаження.")
+        return
+
+    message = await update.message.reply_text("Вирізаємо фрагмент... Будь ласка, зачекайте.")
+    chat_id = update.effective_chat.id
+    platform = resolver.match(args[0])
+    try:
+        with metrics.stage('resolve', platform):
+            resolved = await run_blocking(resolver.resolve, args[0])
+        outcome = await deliver_video(context, chat_id, resolved, message, clip)
+        metrics.JOBS_TOTAL.inc(platform=platform, format='mp4', outcome=outcome)
+        await send_done_message(context, chat_id)
     except Exception as e:
-        logger.error(f"Помилка компресії: {str(e)}")
-        return False
+        metrics.JOBS_TOTAL.inc(platform=platform, format='mp4', outcome='failed')
+        error_message = f"Помилка: {str(e)}"
+        logger.error(error_message)
+        await context.bot.send_message(chat_id=chat_id, text=error_message)
+    finally:
+        release_download_slot(user_id)
+        try:
+            await message.delete()
+        except Exception:
+            pass
 
-def calculate_optimal_bitrate(duration, target_size_mb=45):
-    target_size_bytes = target_size_mb * 1024 * 1024
-    audio_bitrate_bytes = 192 * 1024 / 8  
+RESOLUTION_LADDER = [
+    (1080, 3500 * 1000),
+    (720, 1800 * 1000),
+    (540, 1100 * 1000),
+    (480, 800 * 1000),
+    (360, 450 * 1000),
+    (240, 250 * 1000),
+]
+
+def probe_video(path):
+    info = probe(path)
+    video = next(s for s in info['streams'] if s.get('codec_type') == 'video')
+    duration = float(info['format'].get('duration') or video.get('duration') or 0)
+    return duration, int(video['width']), int(video['height'])
+
+async def compress_video(input_file, output_file, width, height, video_bitrate, audio_bitrate='128k', crf=None,
+                         preset='medium', threads=0, duration=None, on_progress=None):
+    """Encode to H.264/AAC at the given size: two-pass ABR, or capped CRF when crf is set"""
+    common = [
+        '-vf', f"scale={width}:{height}",
+        '-c:v', 'libx264',
+        '-preset', preset,
+        '-pix_fmt', 'yuv420p',
+        '-threads', str(threads),
+    ]
+
+    def stage_progress(start, share):
+        if on_progress is None:
+            return None
+        return lambda fraction, stats: on_progress(start + share * (fraction or 0))
+
+    if crf is None:
+        passlog = os.path.splitext(output_file)[0] + '-pass'
+        await ffmpeg_service.run(
+            ['-y', '-i', input_file, *common, '-b:v', str(video_bitrate),
+             '-pass', '1', '-passlogfile', passlog, '-an', '-f', 'null', os.devnull],
+            duration=duration, on_progress=stage_progress(0, 0.5)
+        )
+        rate_control = ['-b:v', str(video_bitrate), '-pass', '2', '-passlogfile', passlog]
+        progress = stage_progress(0.5, 0.5)
+    else:
+        rate_control = ['-crf', str(crf), '-maxrate', str(video_bitrate), '-bufsize', str(video_bitrate * 2)]
+        progress = stage_progress(0, 1)
+    await ffmpeg_service.run(
+        ['-y', '-i', input_file, *common, *rate_control,
+         '-c:a', 'aac', '-b:a', audio_bitrate, '-movflags', '+faststart', output_file],
+        duration=duration, on_progress=progress
+    )
+
+def calculate_optimal_bitrate(duration, target_size_mb=45, audio_bitrate_kbps=128):
+    # Leave ~3% for container overhead
+    target_size_bytes = target_size_mb * 1024 * 1024 * 0.97
+    audio_bitrate_bytes = audio_bitrate_kbps * 1000 / 8
     
     available_bytes = target_size_bytes - (duration * audio_bitrate_bytes)
     video_bitrate_bps = (available_bytes * 8) / duration
     
-    min_bitrate = 800 * 1024   
-    max_bitrate = 4000 * 1024  
+    min_bitrate = 100 * 1000
+    max_bitrate = 4000 * 1000
     
     video_bitrate_bps = max(min_bitrate, min(video_bitrate_bps, max_bitrate))
     return int(video_bitrate_bps)
 
 def get_optimal_resolution(original_width, original_height, target_bitrate):
-    return original_width, original_height
+    """Pick the highest ladder rung the bitrate can carry, never upscaling"""
+    short_side = min(original_width, original_height)
+    rung = RESOLUTION_LADDER[-1][0]
+    for height, min_bitrate in RESOLUTION_LADDER:
+        if height <= short_side and target_bitrate >= min_bitrate:
+            rung = height
+            break
+    if rung >= short_side:
+        return original_width - original_width % 2, original_height - original_height % 2
+
+    scale = rung / short_side
+    width = int(original_width * scale) // 2 * 2
+    height = int(original_height * scale) // 2 * 2
+    return width, height
+
+async def compress_for_telegram(input_path, output_path, target_size_mb, threads=0, on_progress=None):
+    """Probe, choose bitrate and resolution for the target size and encode"""
+    duration, width, height = await asyncio.to_thread(probe_video, input_path)
+    if not duration:
+        raise Exception("Не вдалося визначити тривалість відео")
+
+    audio_bitrate_kbps = 96 if duration > 600 else 128
+    video_bitrate = calculate_optimal_bitrate(duration, target_size_mb, audio_bitrate_kbps)
+    width, height = get_optimal_resolution(width, height, video_bitrate)
+    crf = COMPRESSION_CRF if COMPRESSION_MODE == 'crf' else None
+    logger.info(f"Стиснення {input_path}: {width}x{height}, {video_bitrate // 1000} kbps, режим {COMPRESSION_MODE}")
+
+    try:
+        await compress_video(input_path, output_path, width, height, video_bitrate,
+                             audio_bitrate=f"{audio_bitrate_kbps}k", crf=crf, threads=threads,
+                             duration=duration, on_progress=on_progress)
+    except FFmpegError as e:
+        logger.error(f"Помилка компресії: {str(e)}")
+        raise Exception("Не вдалося стиснути відео")
+    return output_path
+
+async def fit_upload_limit(video_path, workspace, platform, video_id, message=None, quality='telegram'):
+    """Return a path that fits Telegram's upload limit, compressing it if needed"""
+    if os.path.getsize(video_path) <= MAX_UPLOAD_BYTES:
+        return video_path
+
+    cache_key = MediaCache.make_key(platform, video_id, 'mp4', quality, f'telegram-{MAX_UPLOAD_BYTES}')
+    cached_path = await asyncio.to_thread(media_cache.get, cache_key)
+    if cached_path:
+        return cached_path
+
+    output_path = workspace.file('compressed.mp4')
+    last_update = 0
+
+    async def report(fraction):
+        nonlocal last_update
+        now = time.monotonic()
+        if message is None or now - last_update < 5:
+            return
+        last_update = now
+        try:
+            await message.edit_text(f"Відео завелике, стискаємо... {int(fraction * 100)}%")
+        except TelegramError:
+            pass
+
+    async with encode_slots:
+        with metrics.stage('compress', platform):
+            await compress_for_telegram(video_path, output_path, TARGET_SIZE_MB, ENCODE_THREADS, on_progress=report)
+    if os.path.getsize(output_path) > MAX_UPLOAD_BYTES:
+        raise Exception("Відео завелике для Telegram навіть після стиснення")
+    return await asyncio.to_thread(media_cache.put, cache_key, output_path)
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text('Операцію скасовано.')
     return ConversationHandler.END
 
+def purge_file_ids():
+    while True:
+        try:
+            removed = file_id_cache.purge_expired()
+            if removed:
+                logger.info(f"Видалено {removed} застарілих file_id")
+        except Exception as e:
+            logger.error(f"File id cache purge error: {str(e)}")
+        time.sleep(FILE_ID_PURGE_INTERVAL)
+
 def main() -> None:
+    removed = purge_stale_workspaces(TEMP_FOLDER)
+    if removed:
+        logger.info(f"Видалено {removed} залишених робочих папок")
+    threading.Thread(target=purge_file_ids, name='file-id-purge', daemon=True).start()
+    if METRICS_PORT:
+        metrics.serve(METRICS_PORT, METRICS_HOST)
+
     token = os.environ.get("TELEGRAM_BOT_TOKEN", "YOUR_TOKEN_HERE")
-    application = Application.builder().token(token).build()
+    builder = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(CONCURRENT_UPDATES)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL).base_file_url(
+            BOT_API_FILE_URL or BOT_API_URL.rstrip('/').rsplit('/', 1)[0] + '/file/bot'
+        )
+    if BOT_API_LOCAL:
+        builder = builder.local_mode(True)
+    if BOT_MODE == 'webhook':
+        # Updates are pushed to WebhookApp instead of being polled
+        builder = builder.updater(None)
+    application = builder.build()
     
     application.add_handler(MessageHandler(
         filters.Regex("^🔄 Головне меню$"),
         start,
         block=False
     ))
+    application.add_handler(CommandHandler("batch", batch_command, block=False))
+    application.add_handler(CommandHandler("clip", clip_command, block=False))
     
     conv_handler = ConversationHandler(
         entry_points=[
@@ -309,7 +764,21 @@ def main() -> None:
     application.add_handler(CallbackQueryHandler(instagram_button, pattern="^instagram$"))
     application.add_handler(CallbackQueryHandler(tiktok_button, pattern="^tiktok$"))
     
-    application.run_polling()
+    if BOT_MODE != 'webhook':
+        application.run_polling()
+        return
+
+    import uvicorn
+
+    if not WEBHOOK_URL:
+        raise SystemExit("WEBHOOK_URL is required in webhook mode")
+    webhook = WebhookApp(
+        application,
+        f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH.strip('/')}",
+        secret=WEBHOOK_SECRET,
+        path=WEBHOOK_PATH
+    )
+    uvicorn.run(webhook, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT, lifespan='on')
 
 if __name__ == "__main__":
     main()
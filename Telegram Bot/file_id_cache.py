@@ -0,0 +1,52 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class FileIdCache:
+    """Persistent mapping of canonical video keys to Telegram file_ids.
+
+    A file_id returned by Telegram after the first upload can be re-sent
+    without transferring the file again. Entries expire after ttl seconds
+    and are dropped as soon as Telegram rejects them.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                "video_key TEXT PRIMARY KEY, "
+                "file_id TEXT NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+
+    def get(self, video_key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id FROM file_ids WHERE video_key = ? AND created_at > ?",
+                (video_key, time.time() - self.ttl)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, video_key: str, file_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO file_ids (video_key, file_id, created_at) VALUES (?, ?, ?)",
+                (video_key, file_id, time.time())
+            )
+
+    def invalidate(self, video_key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM file_ids WHERE video_key = ?", (video_key,))
+
+    def purge_expired(self) -> int:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM file_ids WHERE created_at <= ?",
+                (time.time() - self.ttl,)
+            )
+        return cursor.rowcount
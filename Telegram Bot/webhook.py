@@ -0,0 +1,105 @@
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class WebhookApp:
+    """ASGI app that feeds Telegram webhook updates into a python-telegram-bot Application.
+
+    Run it on its own under uvicorn (lifespan events start the bot and
+    register the webhook) or mount it into another ASGI app, e.g.
+    FastAPI's app.mount("/telegram", webhook), and call start()/stop()
+    from the host's startup/shutdown hooks. The Application must be built
+    with .updater(None): updates arrive here instead of via polling.
+    """
+
+    def __init__(self, application, webhook_url: str, secret: str = None, path: str = '/'):
+        self.application = application
+        self.webhook_url = webhook_url
+        self.secret = secret
+        self.path = '/' + path.strip('/')
+
+    async def start(self):
+        await self.application.initialize()
+        await self.application.start()
+        await self.application.bot.set_webhook(
+            self.webhook_url,
+            secret_token=self.secret,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info(f"Webhook registered at {self.webhook_url}")
+
+    async def stop(self):
+        await self.application.stop()
+        await self.application.shutdown()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.start()
+                except Exception as e:
+                    logger.error(f"Webhook startup error: {str(e)}")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _respond(send, status: int, body: bytes = b''):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'text/plain'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        # When mounted, the prefix may or may not have been stripped from the path
+        if not scope['path'].rstrip('/').endswith(self.path.rstrip('/')):
+            await self._respond(send, 404, b'Not found')
+            return
+        if scope['method'] != 'POST':
+            await self._respond(send, 405, b'Method not allowed')
+            return
+        if self.secret:
+            headers = dict(scope['headers'])
+            # Raw bytes: compare_digest rejects non-ASCII str with TypeError instead of returning False
+            token = headers.get(b'x-telegram-bot-api-secret-token', b'')
+            if not hmac.compare_digest(token, self.secret.encode()):
+                await self._respond(send, 403, b'Forbidden')
+                return
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if len(body) > MAX_BODY_BYTES:
+                await self._respond(send, 413, b'Too large')
+                return
+            if not message.get('more_body'):
+                break
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Rejected webhook payload: {str(e)}")
+            await self._respond(send, 400, b'Bad update')
+            return
+        await self.application.update_queue.put(update)
+        await self._respond(send, 200, b'OK')
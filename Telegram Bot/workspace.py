@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_PREFIX = "videodw-job-"
+SHM_DIR = os.environ.get("WORKSPACE_SHM_DIR", "/dev/shm")
+SHM_MAX_BYTES = int(os.environ.get("WORKSPACE_SHM_MAX_BYTES", 64 * 1024 * 1024))
+
+
+def estimate_size(info: dict) -> Optional[int]:
+    """Best guess of the downloaded size in bytes from a yt-dlp info dict"""
+    size = info.get('filesize') or info.get('filesize_approx')
+    if size:
+        return int(size)
+    duration, tbr = info.get('duration'), info.get('tbr')
+    if duration and tbr:
+        return int(duration * tbr * 1000 / 8)
+    return None
+
+
+class JobWorkspace:
+    """Private working directory of a single download job.
+
+    Every job gets a fresh directory, so concurrent jobs of the same user
+    never share file names. Clips known to be small are placed on tmpfs
+    (WORKSPACE_SHM_DIR) when it has room. The directory is removed when
+    the context exits, whatever the outcome.
+    """
+
+    def __init__(self, base_dir: str, expected_size: Optional[int] = None):
+        self.base_dir = base_dir
+        self.expected_size = expected_size
+        self.path = None
+
+    def _choose_base(self) -> str:
+        if self.expected_size and self.expected_size <= SHM_MAX_BYTES and os.path.isdir(SHM_DIR):
+            try:
+                # Room for the download plus a postprocessed copy
+                if shutil.disk_usage(SHM_DIR).free > self.expected_size * 3:
+                    return SHM_DIR
+            except OSError:
+                pass
+        os.makedirs(self.base_dir, exist_ok=True)
+        return self.base_dir
+
+    @property
+    def in_memory(self) -> bool:
+        return bool(self.path) and self.path.startswith(SHM_DIR + os.sep)
+
+    def create(self) -> 'JobWorkspace':
+        self.path = tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=self._choose_base())
+        return self
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def cleanup(self):
+        if self.path and os.path.exists(self.path):
+            shutil.rmtree(self.path, ignore_errors=True)
+            logger.info(f"Очищено робочу папку {self.path}")
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup()
+
+    async def __aenter__(self):
+        return await asyncio.to_thread(self.create)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await asyncio.to_thread(self.cleanup)
+
+
+def purge_stale_workspaces(base_dir: str, max_age: float = 3600) -> int:
+    """Remove workspaces left behind by a crashed process"""
+    removed = 0
+    now = time.time()
+    for root in (base_dir, SHM_DIR):
+        if not os.path.isdir(root):
+            continue
+        for entry in os.scandir(root):
+            if not entry.name.startswith(WORKSPACE_PREFIX) or not entry.is_dir():
+                continue
+            try:
+                if now - entry.stat().st_mtime > max_age:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue
+    return removed
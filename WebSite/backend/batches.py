@@ -0,0 +1,127 @@
+import asyncio
+import time
+import uuid
+
+from core.batch import BATCH_CONCURRENCY
+
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+
+class BatchItem:
+    def __init__(self, url: str, resolved=None, error: str = None):
+        self.download_id = str(uuid.uuid4())
+        self.url = url
+        self.resolved = resolved
+        self.state = 'failed' if error else 'queued'
+        self.progress = 0
+        self.status = None
+        self.filename = None
+        self.path = None
+        self.error = error
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def as_dict(self) -> dict:
+        return {
+            "download_id": self.download_id,
+            "url": self.url,
+            "platform": self.resolved.platform if self.resolved else None,
+            "state": self.state,
+            "progress": self.progress,
+            "status": self.status,
+            "filename": self.filename,
+            "error": self.error,
+        }
+
+
+class Batch:
+    """Many downloads tracked together, with at most `concurrency` of them in the engine at once.
+
+    Every change bumps `version`; wait(version) lets SSE and ZIP streams sleep
+    until something happens instead of polling.
+    """
+
+    def __init__(self, items: list, format: str, concurrency: int = BATCH_CONCURRENCY):
+        self.id = str(uuid.uuid4())
+        self.items = items
+        self.format = format
+        self.created_at = time.time()
+        self.finished_at = None
+        self.version = 0
+        self.task = None
+        self._slots = asyncio.Semaphore(concurrency)
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return all(item.finished for item in self.items)
+
+    @property
+    def progress(self) -> int:
+        if not self.items:
+            return 100
+        return int(sum(100 if item.finished else item.progress for item in self.items) / len(self.items))
+
+    def counts(self) -> dict:
+        counts = {state: 0 for state in ('queued', 'running', *FINISHED_STATES)}
+        for item in self.items:
+            counts[item.state] += 1
+        return counts
+
+    def update(self, item: BatchItem, **fields):
+        for name, value in fields.items():
+            setattr(item, name, value)
+        self._touch()
+
+    def _touch(self):
+        self.version += 1
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait(self, version: int, timeout: float):
+        """Return once the batch changed after `version`, or after timeout"""
+        if self.version != version:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, download):
+        """Run `await download(batch, item) -> (filename, path)` for every queued item"""
+
+        async def run_item(item):
+            async with self._slots:
+                self.update(item, state='running')
+                try:
+                    filename, path = await download(self, item)
+                except asyncio.CancelledError:
+                    self.update(item, state='cancelled', error="Завантаження скасовано")
+                    raise
+                except Exception as e:
+                    self.update(item, state='failed', error=str(e))
+                else:
+                    self.update(item, state='done', progress=100, filename=filename, path=path)
+
+        try:
+            await asyncio.gather(*(run_item(item) for item in self.items if item.state == 'queued'))
+        finally:
+            for item in self.items:
+                if not item.finished:
+                    self.update(item, state='cancelled', error="Завантаження скасовано")
+            self.finished_at = time.time()
+            self._touch()
+
+    def as_dict(self) -> dict:
+        return {
+            "batch_id": self.id,
+            "format": self.format,
+            "progress": self.progress,
+            "finished": self.finished,
+            "counts": self.counts(),
+            "items": [item.as_dict() for item in self.items],
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
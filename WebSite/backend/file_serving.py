@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import mimetypes
+import os
+import shutil
+import time
+import urllib.parse
+from email.utils import formatdate
+from typing import Optional
+
+import anyio
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+FILE_TTL = float(os.environ.get("FILE_TTL", "600"))
+FILE_RELEASE_GRACE = float(os.environ.get("FILE_RELEASE_GRACE", "30"))
+# e.g. "/protected-downloads/" to let nginx serve files with sendfile via X-Accel-Redirect
+ACCEL_REDIRECT_PREFIX = os.environ.get("ACCEL_REDIRECT_PREFIX")
+
+mimetypes.add_type('video/mp4', '.mp4')
+mimetypes.add_type('audio/mpeg', '.mp3')
+mimetypes.add_type('audio/mp4', '.m4a')
+mimetypes.add_type('audio/ogg', '.opus')
+
+
+def parse_range(value: str, size: int) -> Optional[tuple[int, int]]:
+    """Parse a single-range "bytes=" header into inclusive (start, end), None if unsatisfiable"""
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        raise ValueError("Unsupported range")
+    start, _, end = spec.strip().partition('-')
+    if not start:
+        length = int(end)
+        if length <= 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+class RangeFileResponse(Response):
+    """File response with Range/If-Range/ETag support and zero-copy sending when the server offers it.
+
+    on_close(complete) is called once the response is over; complete is True
+    when the last byte of the file was delivered.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(self, path: str, request_headers, filename: str, method: str = 'GET',
+                 inline: bool = False, on_close=None, accel_path: Optional[str] = None):
+        stat = os.stat(path)
+        self.path = path
+        self.file_size = stat.st_size
+        self.send_body = method != 'HEAD'
+        self.on_close = on_close
+        self.accel_path = accel_path
+        self.bytes_sent = 0
+        self.background = None
+        self.media_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.start, self.end = 0, self.file_size - 1
+
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        disposition = 'inline' if inline else 'attachment'
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'ETag': etag,
+            'Last-Modified': last_modified,
+            'Content-Disposition': f"{disposition}; filename*=UTF-8''{urllib.parse.quote(filename)}",
+            'Access-Control-Expose-Headers': 'Content-Disposition, Content-Range, Accept-Ranges, ETag',
+        }
+
+        self.status_code = 200
+        range_header = request_headers.get('range')
+        if_range = request_headers.get('if-range')
+        if request_headers.get('if-none-match') == etag:
+            self.status_code = 304
+            self.send_body = False
+        elif range_header and (not if_range or if_range in (etag, last_modified)):
+            try:
+                byte_range = parse_range(range_header, self.file_size)
+            except ValueError:
+                byte_range = (0, self.file_size - 1)
+            else:
+                if byte_range is None:
+                    self.status_code = 416
+                    self.send_body = False
+                    headers['Content-Range'] = f"bytes */{self.file_size}"
+                else:
+                    self.start, self.end = byte_range
+                    self.status_code = 206
+                    headers['Content-Range'] = f"bytes {self.start}-{self.end}/{self.file_size}"
+
+        if self.status_code in (200, 206):
+            headers['Content-Length'] = str(self.end - self.start + 1)
+        elif self.status_code == 416:
+            headers['Content-Length'] = '0'
+        if accel_path and self.status_code in (200, 206):
+            # nginx handles the range itself from the original request headers
+            headers['X-Accel-Redirect'] = accel_path
+            headers.pop('Content-Length')
+            headers.pop('Content-Range', None)
+            self.status_code = 200
+            self.send_body = False
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        complete = False
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            })
+            if not self.send_body:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+
+            count = self.end - self.start + 1
+            if "http.response.zerocopysend" in scope.get("extensions", {}):
+                with open(self.path, 'rb') as f:
+                    await send({
+                        "type": "http.response.zerocopysend",
+                        "file": f,
+                        "offset": self.start,
+                        "count": count,
+                        "more_body": False,
+                    })
+                self.bytes_sent = count
+            else:
+                remaining = count
+                async with await anyio.open_file(self.path, mode='rb') as f:
+                    await f.seek(self.start)
+                    while remaining > 0:
+                        chunk = await f.read(min(self.chunk_size, remaining))
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                        await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                        self.bytes_sent += len(chunk)
+                if remaining > 0:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+                    return
+            complete = self.end == self.file_size - 1
+        finally:
+            if self.on_close:
+                self.on_close(complete)
+
+
+class Lease:
+    def __init__(self, path: str):
+        self.path = path
+        self.readers = 0
+        self.completed = False
+        self.expired = False
+        self.created = time.time()
+        self.removal = None
+        self.expiry = None
+
+
+class LeaseManager:
+    """Keeps finished downloads on disk while clients may still read them.
+
+    A download is removed FILE_RELEASE_GRACE seconds after the last reader
+    that received the final byte has finished (so retries right after a
+    drop still work), or once FILE_TTL has passed and nobody is reading it.
+    """
+
+    def __init__(self, ttl: float = FILE_TTL, grace: float = FILE_RELEASE_GRACE):
+        self.ttl = ttl
+        self.grace = grace
+        self._leases = {}
+
+    def register(self, download_id: str, path: str):
+        if download_id in self._leases:
+            return
+        lease = Lease(path)
+        lease.expiry = asyncio.get_running_loop().call_later(self.ttl, self._expire, download_id)
+        self._leases[download_id] = lease
+
+    def acquire(self, download_id: str, path: str):
+        self.register(download_id, path)
+        lease = self._leases[download_id]
+        lease.readers += 1
+        if lease.removal:
+            lease.removal.cancel()
+            lease.removal = None
+
+    def release(self, download_id: str, complete: bool):
+        lease = self._leases.get(download_id)
+        if lease is None:
+            return
+        lease.readers -= 1
+        lease.completed = lease.completed or complete
+        if lease.readers > 0:
+            return
+        if lease.expired:
+            self._remove(download_id)
+        elif lease.completed:
+            lease.removal = asyncio.get_running_loop().call_later(self.grace, self._remove, download_id)
+
+    def forget(self, download_id: str):
+        lease = self._leases.pop(download_id, None)
+        if lease:
+            for handle in (lease.removal, lease.expiry):
+                if handle:
+                    handle.cancel()
+
+    def is_active(self, download_id: str) -> bool:
+        return download_id in self._leases
+
+    def in_use(self) -> set:
+        """Downloads somebody is reading right now"""
+        return {download_id for download_id, lease in self._leases.items() if lease.readers > 0}
+
+    def _expire(self, download_id: str):
+        lease = self._leases.get(download_id)
+        if lease is None:
+            return
+        lease.expired = True
+        if lease.readers == 0:
+            self._remove(download_id)
+
+    def _remove(self, download_id: str):
+        lease = self._leases.get(download_id)
+        if lease is None or lease.readers > 0:
+            return
+        self.forget(download_id)
+        asyncio.get_running_loop().run_in_executor(None, shutil.rmtree, lease.path, True)
+        logger.info(f"Cleaned up folder: {lease.path}")
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+JANITOR_INTERVAL = float(os.environ.get("JANITOR_INTERVAL", "60"))
+JANITOR_MAX_AGE = float(os.environ.get("JANITOR_MAX_AGE", "3600"))
+JANITOR_MAX_BYTES = int(os.environ.get("JANITOR_MAX_BYTES", 10 * 1024 ** 3))
+JANITOR_MIN_FREE_BYTES = int(os.environ.get("JANITOR_MIN_FREE_BYTES", 2 * 1024 ** 3))
+
+
+def entry_usage(path: str) -> tuple[int, int, float]:
+    """(bytes, files, newest mtime) of a file or directory tree"""
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return stat.st_size, 1, stat.st_mtime
+    size, files, newest = 0, 0, os.stat(path).st_mtime
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += stat.st_size
+            files += 1
+            newest = max(newest, stat.st_mtime)
+    return size, files, newest
+
+
+class Janitor:
+    """Periodically trims a scratch folder by age and total size.
+
+    Entries (the top-level files and folders of root) older than max_age are
+    removed; if the rest still exceeds max_bytes the oldest go first until it
+    fits. Names returned by protected() are never touched. on_remove(name) is
+    called on the event loop for every entry that was removed.
+    """
+
+    def __init__(self, root: str, max_age: float = JANITOR_MAX_AGE, max_bytes: int = JANITOR_MAX_BYTES,
+                 min_free_bytes: int = JANITOR_MIN_FREE_BYTES, interval: float = JANITOR_INTERVAL,
+                 protected=None, on_remove=None):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.interval = interval
+        self.protected = protected or (lambda: set())
+        self.on_remove = on_remove
+        self.used_bytes = 0
+        self.used_files = 0
+        self.reclaimed_bytes = 0
+        self.reclaimed_files = 0
+        self.removed_entries = 0
+        self.sweeps = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._wakeup = None
+        self._task = None
+
+    def sweep(self, protected=frozenset()) -> list:
+        """One pass over root; returns the names that were removed"""
+        now = time.time()
+        entries = []
+        total_bytes = total_files = 0
+        for entry in os.scandir(self.root):
+            try:
+                size, files, newest = entry_usage(entry.path)
+            except OSError:
+                continue
+            total_bytes += size
+            total_files += files
+            if entry.name not in protected:
+                entries.append((newest, entry.name, entry.path, size, files))
+
+        removed = []
+        entries.sort()
+        for newest, name, path, size, files in entries:
+            if now - newest <= self.max_age and total_bytes <= self.max_bytes:
+                break
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+            total_bytes -= size
+            total_files -= files
+            removed.append(name)
+            with self._lock:
+                self.reclaimed_bytes += size
+                self.reclaimed_files += files
+                self.removed_entries += 1
+
+        with self._lock:
+            self.used_bytes = total_bytes
+            self.used_files = total_files
+            self.sweeps += 1
+        if removed:
+            logger.info(f"Janitor removed {len(removed)} entries from {self.root}, {total_bytes} bytes left")
+        return removed
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.root).free
+
+    def has_room(self) -> bool:
+        """Admission check for new jobs; wakes the janitor up when space runs short"""
+        try:
+            free = self.free_bytes()
+        except OSError:
+            return True
+        if free >= self.min_free_bytes and self.used_bytes < self.max_bytes:
+            return True
+        with self._lock:
+            self.rejected += 1
+        if self._wakeup:
+            self._wakeup.set()
+        return False
+
+    async def run_once(self):
+        removed = await asyncio.to_thread(self.sweep, frozenset(self.protected()))
+        if self.on_remove:
+            for name in removed:
+                self.on_remove(name)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Janitor error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def stats(self) -> dict:
+        try:
+            free = self.free_bytes()
+        except OSError:
+            free = None
+        with self._lock:
+            return {
+                'used_bytes': self.used_bytes,
+                'used_files': self.used_files,
+                'free_bytes': free,
+                'reclaimed_bytes': self.reclaimed_bytes,
+                'reclaimed_files': self.reclaimed_files,
+                'removed_entries': self.removed_entries,
+                'rejected_jobs': self.rejected,
+                'sweeps': self.sweeps,
+            }
@@ -0,0 +1,148 @@
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+ACTIVE_STATES = ('queued', 'running')
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+COLUMNS = (
+    'id', 'url', 'format', 'platform', 'state', 'progress', 'status', 'filename',
+    'path', 'size', 'error', 'work_dir', 'owner', 'attempts',
+    'created_at', 'started_at', 'updated_at', 'finished_at', 'clip_start', 'clip_end'
+)
+
+# Columns added after the table was first released; older databases get them on open
+ADDED_COLUMNS = (('clip_start', 'REAL'), ('clip_end', 'REAL'))
+
+
+class JobStore:
+    """SQLite table of download jobs shared by every server process.
+
+    Each process registers itself in the workers table and refreshes its
+    heartbeat; queued or running jobs whose owner stopped heartbeating are
+    orphans that another process (or the same one after a restart) claims
+    with claim_orphans() and either resumes or fails.
+    """
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "url TEXT NOT NULL, "
+                "format TEXT NOT NULL, "
+                "platform TEXT, "
+                "state TEXT NOT NULL, "
+                "progress INTEGER NOT NULL DEFAULT 0, "
+                "status TEXT, "
+                "filename TEXT, "
+                "path TEXT, "
+                "size INTEGER, "
+                "error TEXT, "
+                "work_dir TEXT, "
+                "owner TEXT, "
+                "attempts INTEGER NOT NULL DEFAULT 1, "
+                "created_at REAL NOT NULL, "
+                "started_at REAL, "
+                "updated_at REAL NOT NULL, "
+                "finished_at REAL, "
+                "clip_start REAL, "
+                "clip_end REAL)"
+            )
+            existing = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for name, kind in ADDED_COLUMNS:
+                if name in existing:
+                    continue
+                try:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+                except sqlite3.OperationalError as e:
+                    # Another process may have added it first
+                    if 'duplicate column' not in str(e):
+                        raise
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, updated_at)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "id TEXT PRIMARY KEY, "
+                "heartbeat REAL NOT NULL)"
+            )
+
+    def create(self, job_id: str, url: str, format: str, platform: str, owner: str, work_dir: str,
+               clip_start: float = None, clip_end: float = None):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, url, format, platform, state, owner, work_dir, created_at, updated_at, "
+                "clip_start, clip_end) VALUES (?, ?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, url, format, platform, owner, work_dir, now, now, clip_start, clip_end)
+            )
+
+    def update(self, job_id: str, **fields):
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown job fields: {', '.join(sorted(unknown))}")
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def delete(self, job_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def heartbeat(self, worker_id: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO workers (id, heartbeat) VALUES (?, ?)",
+                (worker_id, time.time())
+            )
+
+    def remove_worker(self, worker_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def claim_orphans(self, worker_id: str, stale_after: float) -> list:
+        """Take over active jobs whose owner is gone; returns the claimed rows"""
+        deadline = time.time() - stale_after
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two processes never claim the same job
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM workers WHERE heartbeat < ?", (deadline,))
+                rows = self._conn.execute(
+                    f"SELECT * FROM jobs WHERE state IN ({', '.join('?' * len(ACTIVE_STATES))}) "
+                    "AND (owner IS NULL OR owner NOT IN (SELECT id FROM workers))",
+                    ACTIVE_STATES
+                ).fetchall()
+                now = time.time()
+                for row in rows:
+                    self._conn.execute(
+                        "UPDATE jobs SET owner = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                        (worker_id, now, row['id'])
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return [dict(row, owner=worker_id, attempts=row['attempts'] + 1) for row in rows]
+
+    def finished_before(self, timestamp: float) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM jobs WHERE state IN ({', '.join('?' * len(FINISHED_STATES))}) "
+                "AND updated_at < ?",
+                (*FINISHED_STATES, timestamp)
+            ).fetchall()
+        return [dict(row) for row in rows]
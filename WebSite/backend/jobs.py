@@ -0,0 +1,281 @@
+import asyncio
+import concurrent.futures
+import functools
+import heapq
+import itertools
+import logging
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+def parse_limits(value: str) -> dict:
+    """Parse "youtube=4,tiktok=2" into {'youtube': 4, 'tiktok': 2}"""
+    limits = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        name, limit = item.split('=', 1)
+        limits[name.strip()] = int(limit)
+    return limits
+
+MAX_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "8"))
+MAX_QUEUE_SIZE = int(os.environ.get("DOWNLOAD_QUEUE_SIZE", "100"))
+PLATFORM_LIMITS = parse_limits(os.environ.get("PLATFORM_CONCURRENCY", "youtube=4,instagram=3,tiktok=3"))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class ProgressChannel:
+    """Fans progress events out from worker threads to asyncio subscribers"""
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._subscribers = set()
+        self.last = None
+        self.closed = False
+
+    def publish(self, event: dict):
+        self._loop.call_soon_threadsafe(self._dispatch, event)
+
+    def close(self):
+        self._loop.call_soon_threadsafe(self._dispatch, None)
+
+    def _dispatch(self, event):
+        if event is None:
+            self.closed = True
+        else:
+            self.last = event
+        for queue in self._subscribers:
+            queue.put_nowait(event)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        if self.last is not None:
+            queue.put_nowait(self.last)
+        if self.closed:
+            queue.put_nowait(None)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+
+class ProgressReporter:
+    """Callable handed to job functions: publishes progress and exposes cancellation"""
+
+    def __init__(self, job):
+        self._job = job
+
+    def __call__(self, event: dict):
+        self._job.progress.publish(event)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._job.cancelled
+
+
+class Job:
+    def __init__(self, func, args, platform=None, priority=0, key=None, on_finalize=None):
+        self.id = str(uuid.uuid4())
+        self.func = func
+        self.args = args
+        self.platform = platform
+        self.priority = priority
+        self.key = key
+        self.state = 'queued'
+        self.refs = 1
+        self.cancelled = False
+        self.future = asyncio.get_running_loop().create_future()
+        self.progress = ProgressChannel()
+        self._on_finalize = on_finalize
+        self._finalized = False
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ('done', 'failed', 'cancelled')
+
+    def finalize(self):
+        """Run the cleanup hook once nobody holds the job and it has stopped"""
+        if self._finalized or self.refs > 0 or not self.finished:
+            return
+        self._finalized = True
+        if self._on_finalize:
+            try:
+                self._on_finalize()
+            except Exception as e:
+                logger.error(f"Job {self.id} cleanup error: {str(e)}")
+
+
+class DownloadEngine:
+    """Runs blocking download jobs in a bounded thread pool fed by per-platform priority queues.
+
+    Job functions are called as func(*args, progress=ProgressReporter); the
+    reporter is thread-safe and forwards event dicts to the job's channel.
+    Jobs submitted with the same key while one is in flight are coalesced
+    into a single reference-counted job. A worker always takes the most
+    urgent job of a platform that is below its concurrency limit, so a
+    saturated platform never holds up the others.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, max_queue_size=MAX_QUEUE_SIZE, platform_limits=None):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.platform_limits = PLATFORM_LIMITS if platform_limits is None else platform_limits
+        self._changed = None
+        self._executor = None
+        self._workers = []
+        self._pending = {}
+        self._running = {}
+        self._waiting = {}
+        self._inflight = {}
+        self._counter = itertools.count()
+        self._closing = False
+        self.active = 0
+
+    async def start(self):
+        self._changed = asyncio.Event()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='download'
+        )
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_workers)]
+        logger.info(f"Download engine started: {self.max_workers} workers, queue size {self.max_queue_size}")
+
+    async def stop(self, timeout=None):
+        """Stop accepting jobs, let queued ones finish and shut the pool down"""
+        self._closing = True
+        self._changed.set()
+        try:
+            await asyncio.wait_for(asyncio.gather(*self._workers), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Download engine stopped before the queue was drained")
+            for worker in self._workers:
+                worker.cancel()
+        await asyncio.to_thread(self._executor.shutdown, True)
+        logger.info("Download engine stopped")
+
+    def submit(self, func, *args, platform=None, priority=0, key=None, on_finalize=None) -> Job:
+        """Queue a job, or attach to the in-flight job with the same key.
+
+        Every returned job holds a reference that must be given back with release().
+        """
+        if self._closing:
+            raise QueueFullError("Сервер перезапускається, спробуйте пізніше")
+        if key is not None and key in self._inflight:
+            job = self._inflight[key]
+            job.refs += 1
+            return job
+
+        if len(self._waiting) >= self.max_queue_size:
+            raise QueueFullError("Черга завантажень заповнена, спробуйте пізніше")
+
+        job = Job(func, args, platform=platform, priority=priority, key=key, on_finalize=on_finalize)
+        order = (priority, next(self._counter))
+        heapq.heappush(self._pending.setdefault(platform, []), (*order, job))
+        self._waiting[job] = order
+        if key is not None:
+            self._inflight[key] = job
+        self._changed.set()
+        return job
+
+    def release(self, job: Job):
+        """Drop one reference; the last one cancels an unfinished job"""
+        job.refs -= 1
+        if job.refs > 0:
+            return
+        if not job.finished:
+            job.cancelled = True
+            self._forget(job)
+            if job.state == 'queued':
+                self._waiting.pop(job, None)
+                self._finish(job, 'cancelled', exception=JobCancelled("Завантаження скасовано"))
+                self._changed.set()
+            logger.info(f"Job {job.id} cancelled: no clients left")
+        job.finalize()
+
+    def _forget(self, job: Job):
+        if job.key is not None and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+
+    def _finish(self, job: Job, state: str, result=None, exception=None):
+        job.state = state
+        self._forget(job)
+        if not job.future.done():
+            if exception is not None:
+                job.future.set_exception(exception)
+                if state == 'cancelled':
+                    job.future.exception()
+            else:
+                job.future.set_result(result)
+        job.progress.close()
+
+    def position(self, job: Job) -> int:
+        """1-based place of a job in the queue, 0 once it has started"""
+        key = self._waiting.get(job)
+        if key is None:
+            return 0
+        return sum(1 for other in self._waiting.values() if other < key) + 1
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiting)
+
+    def _take(self):
+        """Pop the most urgent queued job whose platform has a free slot, None if there is none"""
+        best = None
+        for platform, heap in self._pending.items():
+            # Jobs cancelled while queued are left in the heap until they reach its top
+            while heap and heap[0][2].cancelled:
+                heapq.heappop(heap)
+            if not heap or self._running.get(platform, 0) >= self.platform_limits.get(platform, self.max_workers):
+                continue
+            if best is None or heap[0][:2] < self._pending[best][0][:2]:
+                best = platform
+        if best is None:
+            return None
+        _, _, job = heapq.heappop(self._pending[best])
+        self._waiting.pop(job, None)
+        self._running[best] = self._running.get(best, 0) + 1
+        return job
+
+    async def _worker(self):
+        while True:
+            # Clearing before the check is safe: nothing can change in between without an await
+            self._changed.clear()
+            job = self._take()
+            if job is None:
+                if self._closing and not self._waiting:
+                    return
+                await self._changed.wait()
+                continue
+            try:
+                await self._run(job)
+            finally:
+                self._running[job.platform] -= 1
+                self._changed.set()
+
+    async def _run(self, job: Job):
+        if job.cancelled:
+            return
+        loop = asyncio.get_running_loop()
+        job.state = 'running'
+        func = functools.partial(job.func, *job.args, progress=ProgressReporter(job))
+        self.active += 1
+        try:
+            result = await loop.run_in_executor(self._executor, func)
+        except Exception as e:
+            self._finish(job, 'cancelled' if job.cancelled else 'failed', exception=e)
+        else:
+            self._finish(job, 'done', result=result)
+        finally:
+            self.active -= 1
+        job.finalize()
@@ -1,18 +1,41 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, validator
 import yt_dlp
 import os
 import shutil
 import logging
-from typing import Optional
+from typing import Optional, Union
 import uuid
 import asyncio
 from urllib.parse import unquote
 import re
 import urllib.parse
 import json
+import sys
+import time
+import socket
+from jobs import DownloadEngine, QueueFullError
+from remote_jobs import RemoteEngine
+from job_store import JobStore
+from janitor import Janitor
+from batches import Batch, BatchItem
+from file_serving import ACCEL_REDIRECT_PREFIX, LeaseManager, RangeFileResponse
+from pipeline import BACKEND_DIR, PROGRESS_INTERVAL, TEMP_FOLDER, download_media, extract_info, info_cache, media_cache
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from core.media_cache import link_or_copy
+from core.postprocess import AUDIO_CODECS
+from core.resolver import UnsupportedURL, resolver
+from core import metrics
+from core.broker import BROKER_URL, from_url, result_store
+from core.transfer import extractor_pool
+from core.ratelimit import BREAKER_COOLDOWN, guard
+from core.batch import MAX_BATCH_ITEMS, ZipStream, archive_name, collect
+from core.clip import Clip, InvalidClip
+from core.ffmpeg_service import ffmpeg_service
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,28 +50,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
-TEMP_FOLDER = os.path.join(BACKEND_DIR, "downloads")
-os.makedirs(TEMP_FOLDER, exist_ok=True)
+SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", "15"))
 
-URL_PATTERNS = {
-    'youtube': re.compile(r'^(https?:\/\/)?(www\.)?(youtube\.com\/watch\?v=|youtu\.be\/)[\w-]+'),
-    'instagram': re.compile(r'https?:\/\/(?:www\.)?instagram\.com\/(?:p|reel|share)\/[\w-]+\/?'),
-    'tiktok': re.compile(r'https?:\/\/(?:www\.|vm\.)?tiktok\.com\/')
-}
+JOB_STORE_PATH = os.environ.get("JOB_STORE_PATH", os.path.join(BACKEND_DIR, "jobs.sqlite3"))
+JOB_HEARTBEAT = float(os.environ.get("JOB_HEARTBEAT", "10"))
+JOB_STALE_AFTER = float(os.environ.get("JOB_STALE_AFTER", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", "3600"))
+JOB_STORE_INTERVAL = float(os.environ.get("JOB_STORE_INTERVAL", "1"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+BATCH_TTL = float(os.environ.get("BATCH_TTL", "1800"))
+# Batch items queue behind single downloads
+BATCH_PRIORITY = 1
+
+DOWNLOAD_FORMATS = ('mp4', *AUDIO_CODECS)
+
+def check_format(v: str) -> str:
+    if v in DOWNLOAD_FORMATS:
+        return v
+    raise ValueError(f"Unsupported format. Use one of: {', '.join(DOWNLOAD_FORMATS)}")
 
 class DownloadRequest(BaseModel):
     url: str
     format: str
+    # Optional clip bounds: seconds or "MM:SS" / "HH:MM:SS"
+    start: Optional[Union[float, str]] = None
+    end: Optional[Union[float, str]] = None
+
+    @validator('format')
+    def validate_format(cls, v):
+        return check_format(v)
+
+    @validator('end', always=True)
+    def validate_clip(cls, v, values):
+        Clip.parse(values.get('start'), v)
+        return v
+
+    @property
+    def clip(self) -> Optional[Clip]:
+        return Clip.parse(self.start, self.end)
 
     @validator('url')
     def validate_url(cls, v):
         v = v.strip()
-        for platform, pattern in URL_PATTERNS.items():
-            if pattern.match(v):
-                return v
+        if resolver.match(v):
+            return v
         raise ValueError('Invalid URL. Only YouTube, Instagram and TikTok URLs are supported')
 
+class BatchRequest(BaseModel):
+    urls: list[str]
+    format: str = 'mp4'
+
+    @validator('urls')
+    def validate_urls(cls, v):
+        urls = [url.strip() for url in v if url.strip()]
+        if not urls:
+            raise ValueError('No URLs given')
+        if len(urls) > MAX_BATCH_ITEMS:
+            raise ValueError(f'Too many URLs, the limit is {MAX_BATCH_ITEMS}')
+        invalid = [url for url in urls if not (resolver.match(url) or resolver.match_playlist(url))]
+        if invalid:
+            raise ValueError(f"Unsupported URLs: {', '.join(invalid[:5])}")
+        return urls
+
+    @validator('format')
+    def validate_format(cls, v):
+        return check_format(v)
+
 def sanitize_filename(title: str, platform: str = None) -> str:
     """Sanitize filename based on platform and remove unnecessary text"""
     import unicodedata
@@ -64,189 +132,667 @@ def sanitize_filename(title: str, platform: str = None) -> str:
     title = "".join([c for c in title if c.isalnum() or c in ' .-_']).strip()
     return title or 'video' 
 
-class ProgressCallback:
-    def __init__(self):
-        self.current = 0
-        self.total = 0
-        self.status = ""
-
-    def __call__(self, d):
-        if d['status'] == 'downloading':
-            self.total = d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
-            self.current = d.get('downloaded_bytes', 0)
-            if self.total:
-                progress = int(self.current * 100 / self.total)
-                return json.dumps({
-                    "progress": progress,
-                    "status": f"Завантаження: {d.get('filename', '')}"
-                }) + "\n"
-        elif d['status'] == 'finished':
-            return json.dumps({
-                "progress": 100,
-                "status": "Обробка завершена"
-            }) + "\n"
-
-FFMPEG_VIDEO_OPTIONS = {
-    'key': 'FFmpegVideoConvertor',
-    'preferedformat': 'mp4'
-}
-
-VIDEO_FORMAT_OPTS = {
-    'youtube': 'bestvideo[vcodec^=avc1][ext=mp4]+bestaudio[ext=m4a]/best[vcodec^=avc1][ext=mp4]/best[ext=mp4]',
-    'instagram': 'best[vcodec^=avc1][ext=mp4]/best[ext=mp4]',
-    'tiktok': 'best[vcodec^=avc1][ext=mp4]/best[ext=mp4]'
-}
-
-def download_media(url: str, format: str, download_id: str) -> tuple[str, str]:
-    output_folder = os.path.join(TEMP_FOLDER, download_id)
-    os.makedirs(output_folder, exist_ok=True)
-
-    common_headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-    }
-
-    platform = None
-    if 'tiktok.com' in url:
-        platform = 'tiktok'
-    
-    base_opts = {
-        'format_sort': [
-            'vcodec:h264',  
-            'ext:mp4',     
-            'acodec:aac',   
-            'quality'       
-        ],
-        'merge_output_format': 'mp4',
-        'outtmpl': os.path.join(
-            output_folder, 
-            '%(title)s.%(ext)s' if platform != 'tiktok' else 'tiktok_video_%(id)s.%(ext)s'
-        ),
-        'postprocessors': [FFMPEG_VIDEO_OPTIONS],
-        'format': VIDEO_FORMAT_OPTS['youtube'],  
-        'http_headers': common_headers,
-    }
-
-    if format == 'mp3':
-        base_opts.update({
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '320',
-            }],
-        })
+# With a broker the API only queues jobs; worker.py processes run them
+broker = from_url(BROKER_URL) if BROKER_URL else None
+engine = RemoteEngine(broker, result_store()) if broker else DownloadEngine()
+leases = LeaseManager()
+job_store = JobStore(JOB_STORE_PATH)
+trackers = {}
+batches = {}
+active_work_folders = set()
+janitor = Janitor(
+    TEMP_FOLDER,
+    protected=lambda: set(trackers) | active_work_folders | leases.in_use(),
+    on_remove=leases.forget
+)
 
-    if 'instagram.com' in url:
-        url = url.split('?')[0]
-        url = url.replace('/reels/', '/reel/')
-        base_opts.update({
-            'format': VIDEO_FORMAT_OPTS['instagram'],
-            'extract_flat': False,
-            'add_header': [
-                ('User-Agent', 'Instagram 219.0.0.12.117 Android'),
-                ('Origin', 'https://www.instagram.com'),
-            ],
-        })
-    elif 'tiktok.com' in url:
-        base_opts.update({
-            'format': VIDEO_FORMAT_OPTS['tiktok'],
-            'nocheckcertificate': True,
-        })
-    else:  
-        if format == 'mp3':
-            base_opts.update({
-                'format': 'bestaudio/best',
-            })
-        else:
-            base_opts.update({
-                'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                'merge_output_format': 'mp4',
-            })
+metrics.registry.gauge('videodw_queue_depth', 'Jobs waiting for a worker').set_function(lambda: engine.queue_depth)
+metrics.registry.gauge('videodw_active_workers', 'Jobs being processed').set_function(lambda: engine.active)
+metrics.registry.gauge('videodw_downloads_bytes', 'Bytes held in the downloads folder').set_function(
+    lambda: janitor.used_bytes
+)
 
-    progress_callback = ProgressCallback()
-    base_opts.update({
-        'progress_hooks': [progress_callback],
-        'quiet': False
-    })
+def sse_event(data: dict) -> str:
+    return f"data: {json.dumps(data)}\n\n"
 
+async def track_job(download_id: str, job, format: str):
+    """Mirror an engine job into the job store and publish its result under download_id"""
+    events = job.progress.subscribe()
+    last_write = 0
+    started = False
     try:
-        with yt_dlp.YoutubeDL(base_opts) as ydl:
-            print(json.dumps({
-                "progress": 0,
-                "status": "Початок завантаження"
-            }))
-            
-            info = ydl.extract_info(url, download=True)
-            
-            print(json.dumps({
-                "progress": 95,
-                "status": "Фінальна обробка"
-            }))
-
-            import glob
-            pattern = '*.mp3' if format == 'mp3' else '*.mp4'
-            files = glob.glob(os.path.join(output_folder, pattern))
-            
-            if not files and format == 'mp3':
-                files = glob.glob(os.path.join(output_folder, '*.[mM][pP]3'))
-                if not files:
-                    video_files = glob.glob(os.path.join(output_folder, '*.[mM][pP]4'))
-                    if (video_files):
-                        video_path = video_files[0]
-                        audio_path = os.path.splitext(video_path)[0] + '.mp3'
-                        os.system(f'ffmpeg -i "{video_path}" -q:a 0 -map a "{audio_path}" -y')
-                        files = [audio_path] if os.path.exists(audio_path) else []
-
-            if not files:
-                raise Exception("File not found after download")
-                
-            filepath = files[0]
-            filename = os.path.basename(filepath)
-            
-            if os.path.getsize(filepath) == 0:
-                raise Exception("Downloaded file is empty")
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            now = time.monotonic()
+            if not started or now - last_write >= JOB_STORE_INTERVAL:
+                fields = {'state': 'running', 'progress': event.get('progress', 0), 'status': event.get('status')}
+                if not started:
+                    fields['started_at'] = time.time()
+                    started = True
+                last_write = now
+                await asyncio.to_thread(job_store.update, download_id, **fields)
 
-            return filename, filepath
+        try:
+            filename, filepath = job.future.result()
+        except Exception as e:
+            metrics.JOBS_TOTAL.inc(
+                platform=job.platform, format=format, outcome='cancelled' if job.cancelled else 'failed'
+            )
+            await asyncio.to_thread(
+                job_store.update, download_id,
+                state='cancelled' if job.cancelled else 'failed',
+                error=str(e), finished_at=time.time()
+            )
+            raise
+
+        metrics.JOBS_TOTAL.inc(platform=job.platform, format=format, outcome='done')
+        download_dir = os.path.join(TEMP_FOLDER, download_id)
+        path = await asyncio.to_thread(link_or_copy, filepath, download_dir)
+        leases.register(download_id, download_dir)
+        await asyncio.to_thread(
+            job_store.update, download_id,
+            state='done', progress=100, status="Завантаження завершено", filename=filename,
+            path=path, size=os.path.getsize(path), finished_at=time.time()
+        )
+        return filename
+    except asyncio.CancelledError:
+        await asyncio.to_thread(
+            job_store.update, download_id,
+            state='cancelled', error="Завантаження скасовано", finished_at=time.time()
+        )
+        raise
+    finally:
+        job.progress.unsubscribe(events)
+        engine.release(job)
+
+def start_job(download_id: str, resolved, format: str, priority: int = 0, clip: Clip = None):
+    work_id = str(uuid.uuid4())
+    work_folder = os.path.join(TEMP_FOLDER, work_id)
+
+    def finalize():
+        shutil.rmtree(work_folder, ignore_errors=True)
+        active_work_folders.discard(work_id)
+
+    job = engine.submit(
+        download_media, resolved.canonical_url, format, work_id, clip,
+        platform=resolved.platform,
+        priority=priority,
+        key=(resolved.key, format, clip),
+        on_finalize=finalize
+    )
+    # A coalesced submission joins a job with its own folder and drops our finalize; ours is never used
+    job_work_id = job.args[2]
+    active_work_folders.add(job_work_id)
+    task = asyncio.create_task(track_job(download_id, job, format))
+    # The outcome is kept in the job store; don't log it as an unretrieved exception
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    task.add_done_callback(lambda t: trackers.pop(download_id, None))
+    trackers[download_id] = task
+    return job, task, os.path.join(TEMP_FOLDER, job_work_id)
+
+async def recover_jobs():
+    """Resume jobs left behind by a dead process and drop old finished ones"""
+    for record in await asyncio.to_thread(job_store.claim_orphans, WORKER_ID, JOB_STALE_AFTER):
+        download_id = record['id']
+        if record['work_dir']:
+            await asyncio.to_thread(shutil.rmtree, record['work_dir'], True)
+        if record['attempts'] > JOB_MAX_ATTEMPTS:
+            await asyncio.to_thread(
+                job_store.update, download_id,
+                state='failed', error="Завантаження перервано", finished_at=time.time()
+            )
+            continue
+        await asyncio.to_thread(
+            job_store.update, download_id,
+            state='queued', progress=0, status=None, started_at=None
+        )
+        clip = None
+        if record['clip_start'] is not None:
+            clip = Clip(record['clip_start'], record['clip_end'])
+        try:
+            resolved = resolver.resolve(record['url'])
+            _, _, work_folder = start_job(download_id, resolved, record['format'], clip=clip)
+        except (UnsupportedURL, QueueFullError) as e:
+            await asyncio.to_thread(
+                job_store.update, download_id,
+                state='failed', error=str(e), finished_at=time.time()
+            )
+            continue
+        await asyncio.to_thread(job_store.update, download_id, work_dir=work_folder)
+        logger.info(f"Resumed orphaned job {download_id} (attempt {record['attempts']})")
+
+    for record in await asyncio.to_thread(job_store.finished_before, time.time() - JOB_RETENTION):
+        if leases.is_active(record['id']):
+            continue
+        await asyncio.to_thread(shutil.rmtree, os.path.join(TEMP_FOLDER, record['id']), True)
+        await asyncio.to_thread(job_store.delete, record['id'])
+
+async def run_batch_item(batch: Batch, item: BatchItem) -> tuple[str, str]:
+    """Download one batch item as a regular job and keep its file leased for the batch"""
+    resolved = item.resolved
+    await asyncio.to_thread(
+        job_store.create, item.download_id, resolved.canonical_url, batch.format,
+        resolved.platform, WORKER_ID, None
+    )
+    try:
+        job, task, work_folder = start_job(item.download_id, resolved, batch.format, priority=BATCH_PRIORITY)
+    except QueueFullError:
+        await asyncio.to_thread(job_store.delete, item.download_id)
+        raise
+    await asyncio.to_thread(job_store.update, item.download_id, work_dir=work_folder)
 
-    except Exception as e:
-        shutil.rmtree(output_folder, ignore_errors=True)
-        logger.error(f"Download error: {str(e)}")
-        raise Exception(f"Помилка завантаження: {str(e)}")
+    events = job.progress.subscribe()
+    try:
+        while True:
+            event = await events.get()
+            if event is None:
+                break
+            batch.update(item, progress=event.get('progress', 0), status=event.get('status'))
+        filename = await asyncio.shield(task)
+    finally:
+        job.progress.unsubscribe(events)
+        if not task.done():
+            task.cancel()
+    download_dir = os.path.join(TEMP_FOLDER, item.download_id)
+    leases.acquire(item.download_id, download_dir)
+    return filename, os.path.join(download_dir, filename)
+
+def drop_batch(batch: Batch):
+    """Stop a batch and give up the leases on its files"""
+    batches.pop(batch.id, None)
+    if batch.task and not batch.task.done():
+        batch.task.cancel()
+    for item in batch.items:
+        if item.state == 'done':
+            leases.release(item.download_id, True)
+
+def expire_batches():
+    now = time.time()
+    for batch in list(batches.values()):
+        if batch.finished_at and now - batch.finished_at > BATCH_TTL:
+            drop_batch(batch)
+
+async def job_heartbeat():
+    while True:
+        try:
+            expire_batches()
+            await asyncio.to_thread(job_store.heartbeat, WORKER_ID)
+            await recover_jobs()
+        except Exception as e:
+            logger.error(f"Job store maintenance error: {str(e)}")
+        await asyncio.sleep(JOB_HEARTBEAT)
+
+async def keep_registered():
+    """Heartbeat only, without taking over orphans, while this process shuts down"""
+    while True:
+        try:
+            await asyncio.to_thread(job_store.heartbeat, WORKER_ID)
+        except Exception as e:
+            logger.error(f"Job store heartbeat error: {str(e)}")
+        await asyncio.sleep(JOB_HEARTBEAT)
+
+@app.on_event("startup")
+async def start_engine():
+    await engine.start()
+    app.state.heartbeat = asyncio.create_task(job_heartbeat())
+    janitor.start()
+
+@app.on_event("shutdown")
+async def stop_engine():
+    app.state.heartbeat.cancel()
+    janitor.stop()
+    # Stay registered while draining, or other processes would claim and rerun the jobs still running here
+    keepalive = asyncio.create_task(keep_registered())
+    try:
+        await engine.stop()
+    finally:
+        keepalive.cancel()
+    # Whatever is still queued/running in the store is resumed by the next owner
+    await asyncio.to_thread(job_store.remove_worker, WORKER_ID)
+    extractor_pool.close()
 
 @app.post("/api/download")
-async def create_download(request: DownloadRequest):
+async def create_download(request: DownloadRequest, http_request: Request):
     try:
         download_id = str(uuid.uuid4())
-        
+        try:
+            with metrics.stage('resolve') as timer:
+                resolved = await asyncio.to_thread(resolver.resolve, request.url)
+                timer.labels['platform'] = resolved.platform
+        except UnsupportedURL as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        try:
+            clip = request.clip
+        except InvalidClip as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if guard.is_open(resolved.platform):
+            raise HTTPException(
+                status_code=503,
+                detail="Платформа тимчасово недоступна, спробуйте пізніше",
+                headers={"Retry-After": str(int(BREAKER_COOLDOWN))}
+            )
+        if not janitor.has_room():
+            raise HTTPException(
+                status_code=503,
+                detail="Недостатньо місця на сервері, спробуйте пізніше",
+                headers={"Retry-After": "60"}
+            )
+        await asyncio.to_thread(
+            job_store.create, download_id, resolved.canonical_url, request.format,
+            resolved.platform, WORKER_ID, None,
+            clip.start if clip else None, clip.end if clip else None
+        )
+        try:
+            job, task, work_folder = start_job(download_id, resolved, request.format, clip=clip)
+        except QueueFullError as e:
+            await asyncio.to_thread(job_store.delete, download_id)
+            raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "10"})
+        await asyncio.to_thread(job_store.update, download_id, work_dir=work_folder)
+
+        # Prefer: respond-async detaches the job from this connection; poll /api/jobs/{id}
+        if 'respond-async' in http_request.headers.get('prefer', ''):
+            return JSONResponse(
+                status_code=202,
+                content={"job_id": download_id, "status_url": f"/api/jobs/{download_id}"},
+                headers={"Location": f"/api/jobs/{download_id}"}
+            )
+
         async def download_generator():
+            events = job.progress.subscribe()
+            last_sent = time.monotonic()
+            last_position = engine.position(job)
             try:
-                filename, filepath = download_media(request.url, request.format, download_id)
-                yield json.dumps({
-                    "success": True,
-                    "download_id": download_id,
-                    "filename": filename,
-                    "progress": 100,
-                    "status": "Завантаження завершено"
-                })
-            except Exception as e:
-                yield json.dumps({
-                    "error": str(e),
-                    "progress": 0,
-                    "status": "Помилка завантаження"
-                })
+                if last_position:
+                    yield sse_event({
+                        "progress": 0,
+                        "queue_position": last_position,
+                        "status": f"У черзі: {last_position}"
+                    })
+                while True:
+                    try:
+                        event = await asyncio.wait_for(events.get(), timeout=1)
+                    except asyncio.TimeoutError:
+                        position = engine.position(job)
+                        if position and position != last_position:
+                            last_position = position
+                            last_sent = time.monotonic()
+                            yield sse_event({
+                                "progress": 0,
+                                "queue_position": position,
+                                "status": f"У черзі: {position}"
+                            })
+                        elif time.monotonic() - last_sent >= SSE_HEARTBEAT:
+                            last_sent = time.monotonic()
+                            yield ": heartbeat\n\n"
+                        continue
+                    if event is None:
+                        break
+                    last_sent = time.monotonic()
+                    yield sse_event(event)
+
+                try:
+                    filename = await asyncio.shield(task)
+                    yield sse_event({
+                        "success": True,
+                        "download_id": download_id,
+                        "filename": filename,
+                        "progress": 100,
+                        "status": "Завантаження завершено"
+                    })
+                except Exception as e:
+                    yield sse_event({
+                        "error": str(e),
+                        "progress": 0,
+                        "status": "Помилка завантаження"
+                    })
+            finally:
+                job.progress.unsubscribe(events)
+                if not task.done():
+                    # The client went away: stop the download unless others share it
+                    task.cancel()
 
         return StreamingResponse(
             download_generator(), 
-            media_type="text/event-stream"
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no"
+            }
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Download error: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.get("/api/download/{download_id}")
-async def get_file(download_id: str, background_tasks: BackgroundTasks):
+@app.get("/api/jobs/{download_id}")
+async def get_job(download_id: str):
+    record = await asyncio.to_thread(job_store.get, download_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    result = {
+        "job_id": record['id'],
+        "state": record['state'],
+        "progress": record['progress'],
+        "status": record['status'],
+        "platform": record['platform'],
+        "format": record['format'],
+        "clip_start": record['clip_start'],
+        "clip_end": record['clip_end'],
+        "filename": record['filename'],
+        "size": record['size'],
+        "error": record['error'],
+        "attempts": record['attempts'],
+        "created_at": record['created_at'],
+        "started_at": record['started_at'],
+        "finished_at": record['finished_at'],
+    }
+    if record['state'] == 'done':
+        result["download_url"] = f"/api/download/{download_id}"
+    return result
+
+def get_batch_or_404(batch_id: str) -> Batch:
+    batch = batches.get(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
+
+@app.post("/api/batch")
+async def create_batch(request: BatchRequest):
+    """Start downloading many links or playlists; progress and results live under /api/batch/{id}"""
+    if not janitor.has_room():
+        raise HTTPException(
+            status_code=503,
+            detail="Недостатньо місця на сервері, спробуйте пізніше",
+            headers={"Retry-After": "60"}
+        )
+    with metrics.stage('resolve'):
+        resolved, failed = await asyncio.to_thread(collect, request.urls)
+    if not resolved:
+        raise HTTPException(status_code=400, detail=failed[0][1] if failed else "No videos found")
+
+    items = [BatchItem(item.canonical_url, item) for item in resolved]
+    items += [BatchItem(url, error=error) for url, error in failed]
+    batch = Batch(items, request.format)
+    batches[batch.id] = batch
+    batch.task = asyncio.create_task(batch.run(run_batch_item))
+    batch.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return JSONResponse(
+        status_code=202,
+        content=dict(
+            batch.as_dict(),
+            status_url=f"/api/batch/{batch.id}",
+            events_url=f"/api/batch/{batch.id}/events",
+            zip_url=f"/api/batch/{batch.id}/zip"
+        ),
+        headers={"Location": f"/api/batch/{batch.id}"}
+    )
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch(batch_id: str):
+    return get_batch_or_404(batch_id).as_dict()
+
+@app.get("/api/batch/{batch_id}/events")
+async def batch_events(batch_id: str):
+    """SSE with the aggregate progress of a batch until every item has finished"""
+    batch = get_batch_or_404(batch_id)
+
+    async def event_generator():
+        while True:
+            version = batch.version
+            counts = batch.counts()
+            yield sse_event({
+                "progress": batch.progress,
+                "counts": counts,
+                "status": f"Готово {counts['done']} з {len(batch.items)}",
+            })
+            if batch.finished:
+                yield sse_event(dict(batch.as_dict(), success=True))
+                return
+            await batch.wait(version, SSE_HEARTBEAT)
+            # Progress events arrive in bursts; one update per interval is plenty
+            await asyncio.sleep(PROGRESS_INTERVAL)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+@app.get("/api/batch/{batch_id}/zip")
+async def get_batch_zip(batch_id: str):
+    """ZIP of the batch, streamed while it is built: each file is added as soon as its download finishes"""
+    batch = get_batch_or_404(batch_id)
+
+    async def zip_generator():
+        archive = ZipStream()
+        written = set()
+        started = time.perf_counter()
+        sent = 0
+        while True:
+            version = batch.version
+            ready = [
+                (index, item) for index, item in enumerate(batch.items, 1)
+                if item.state == 'done' and item.download_id not in written
+            ]
+            if not ready:
+                if batch.finished:
+                    break
+                await batch.wait(version, SSE_HEARTBEAT)
+                continue
+            for index, item in ready:
+                written.add(item.download_id)
+                chunks = archive.add_file(archive_name(index, item.filename), item.path)
+                while True:
+                    chunk = await asyncio.to_thread(next, chunks, None)
+                    if chunk is None:
+                        break
+                    sent += len(chunk)
+                    yield chunk
+
+        failures = [item for item in batch.items if item.state != 'done']
+        if failures:
+            report = ''.join(f"{item.url}\t{item.error or item.state}\n" for item in failures)
+            chunk = archive.add_bytes('errors.txt', report.encode('utf-8'))
+            sent += len(chunk)
+            yield chunk
+        chunk = archive.close()
+        sent += len(chunk)
+        yield chunk
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='serve', platform='')
+        metrics.BYTES_TOTAL.inc(sent, direction='served', platform='')
+
+    return StreamingResponse(
+        zip_generator(),
+        media_type="application/zip",
+        headers={
+            'Content-Disposition': f'attachment; filename="batch-{batch.id[:8]}.zip"',
+            'Access-Control-Expose-Headers': 'Content-Disposition',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+@app.delete("/api/batch/{batch_id}")
+async def delete_batch(batch_id: str):
+    batch = get_batch_or_404(batch_id)
+    drop_batch(batch)
+    for item in batch.items:
+        leases.forget(item.download_id)
+        await asyncio.to_thread(shutil.rmtree, os.path.join(TEMP_FOLDER, item.download_id), True)
+        await asyncio.to_thread(job_store.delete, item.download_id)
+    return {"status": "success"}
+
+def summarize_formats(info: dict) -> list:
+    duration = info.get('duration') or 0
+    formats = []
+    for f in info.get('formats') or []:
+        vcodec, acodec = f.get('vcodec') or 'none', f.get('acodec') or 'none'
+        if vcodec == 'none' and acodec == 'none':
+            continue
+        size = f.get('filesize') or f.get('filesize_approx')
+        if not size and f.get('tbr') and duration:
+            size = int(f['tbr'] * 1000 / 8 * duration)
+        formats.append({
+            "format_id": f.get('format_id'),
+            "ext": f.get('ext'),
+            "width": f.get('width'),
+            "height": f.get('height'),
+            "fps": f.get('fps'),
+            "vcodec": vcodec,
+            "acodec": acodec,
+            "protocol": f.get('protocol'),
+            "estimated_size": size,
+        })
+    return formats
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/stats")
+async def get_stats():
+    return {
+        "queue_depth": engine.queue_depth,
+        "active": engine.active,
+        "workers": await asyncio.to_thread(broker.workers) if broker else engine.max_workers,
+        "downloads": janitor.stats(),
+        "media_cache": media_cache.stats(),
+        "info_cache": info_cache.stats(),
+    }
+
+@app.get("/api/info")
+async def get_info(url: str):
+    """Metadata and available formats without starting a download"""
+    try:
+        resolved = await asyncio.to_thread(resolver.resolve, url)
+    except UnsupportedURL as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        info = await asyncio.to_thread(extract_info, resolved.canonical_url, resolved.platform)
+    except Exception as e:
+        logger.error(f"Info extraction error: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "id": resolved.video_id,
+        "platform": resolved.platform,
+        "canonical_url": resolved.canonical_url,
+        "title": info.get('title'),
+        "duration": info.get('duration'),
+        "thumbnail": info.get('thumbnail'),
+        "uploader": info.get('uploader'),
+        "formats": summarize_formats(info),
+    }
+
+STREAM_FORMAT_OPTS = {
+    'mp4': (
+        'best[vcodec^=avc1][acodec^=mp4a][protocol!*=dash]'
+        '/bestvideo[vcodec^=avc1][protocol!*=dash]+bestaudio[acodec^=mp4a][protocol!*=dash]'
+    ),
+    'mp3': 'bestaudio[protocol!*=dash]/best[protocol!*=dash]',
+}
+
+def extract_stream_info(url: str, format: str, platform: str) -> dict:
+    opts = {
+        'format': STREAM_FORMAT_OPTS[format],
+        'quiet': True,
+        'noplaylist': True,
+    }
+    info = extract_info(url, platform)
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.process_ie_result(info, download=False)
+
+def build_stream_args(info: dict, format: str) -> list:
+    """FFmpeg arguments that copy the selected remote streams to stdout"""
+    streams = info.get('requested_formats') or [info]
+    args = []
+    for stream in streams:
+        headers = ''.join(f"{k}: {v}\r\n" for k, v in (stream.get('http_headers') or {}).items())
+        if headers:
+            args += ['-headers', headers]
+        args += ['-i', stream['url']]
+
+    if format == 'mp3':
+        args += ['-vn', '-c:a', 'libmp3lame', '-b:a', '320k', '-f', 'mp3', 'pipe:1']
+        return args
+
+    if len(streams) > 1:
+        args += ['-map', '0:v:0', '-map', '1:a:0']
+    # Fragmented MP4 can be written without seeking back to patch the moov atom
+    args += ['-c', 'copy', '-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4', 'pipe:1']
+    return args
+
+MAX_STREAMS = int(os.environ.get("MAX_STREAMS", "16"))
+active_streams = 0
+
+def take_stream_slot():
+    """Claim a stream slot without waiting; returns its idempotent release function, None when all are taken"""
+    global active_streams
+    # No await between the check and the claim, so concurrent requests cannot both pass
+    if active_streams >= MAX_STREAMS:
+        return None
+    active_streams += 1
+    released = False
+
+    def release():
+        global active_streams
+        nonlocal released
+        if not released:
+            released = True
+            active_streams -= 1
+
+    return release
+
+@app.get("/api/stream")
+async def stream_media(url: str, format: str = 'mp4'):
+    """Relay media to the client while it is still being fetched from the origin"""
+    if format not in STREAM_FORMAT_OPTS:
+        raise HTTPException(status_code=400, detail="Unsupported format")
+    try:
+        resolved = await asyncio.to_thread(resolver.resolve, url)
+    except UnsupportedURL as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    release_slot = take_stream_slot()
+    if release_slot is None:
+        raise HTTPException(status_code=503, detail="Забагато одночасних трансляцій", headers={"Retry-After": "10"})
+
+    try:
+        info = await asyncio.to_thread(extract_stream_info, resolved.canonical_url, format, resolved.platform)
+    except Exception as e:
+        release_slot()
+        logger.error(f"Stream extraction error: {str(e)}")
+        raise HTTPException(status_code=409, detail="Цей запис не можна транслювати, скористайтеся звичайним завантаженням")
+
+    async def stream_generator():
+        # The process is started lazily so nothing leaks if the client never reads;
+        # it takes one of the FFmpeg service's slots and runs under its limits
+        try:
+            async for chunk in ffmpeg_service.stream(build_stream_args(info, format)):
+                yield chunk
+        finally:
+            release_slot()
+
+    ext = 'mp3' if format == 'mp3' else 'mp4'
+    filename = f"{sanitize_filename(info.get('title') or 'video', resolved.platform)}.{ext}"
+    headers = {
+        'Content-Disposition': f"attachment; filename*=UTF-8''{urllib.parse.quote(filename)}",
+        'Access-Control-Expose-Headers': 'Content-Disposition'
+    }
+    return StreamingResponse(
+        stream_generator(),
+        media_type='audio/mpeg' if ext == 'mp3' else 'video/mp4',
+        headers=headers,
+        # Also frees the slot when the body was never started
+        background=BackgroundTask(release_slot)
+    )
+
+@app.api_route("/api/download/{download_id}", methods=["GET", "HEAD"])
+async def get_file(download_id: str, request: Request, inline: bool = False):
     try:
         try:
             uuid.UUID(download_id)
@@ -270,34 +816,36 @@ async def get_file(download_id: str, background_tasks: BackgroundTasks):
         if os.path.getsize(filepath) == 0:
             raise HTTPException(status_code=400, detail="File is empty")
 
-        async def cleanup_folder(path: str):
-            try:
-                await asyncio.sleep(5)  
-                if os.path.exists(path):
-                    shutil.rmtree(path)
-                    logger.info(f"Cleaned up folder: {path}")
-            except Exception as e:
-                logger.error(f"Cleanup error: {str(e)}")
-
-        encoded_filename = urllib.parse.quote(filename)
-        
-        headers = {
-            'Content-Disposition': f"attachment; filename*=UTF-8''{encoded_filename}",
-            'Access-Control-Expose-Headers': 'Content-Disposition'
-        }
+        accel_path = None
+        if ACCEL_REDIRECT_PREFIX:
+            accel_path = f"{ACCEL_REDIRECT_PREFIX.rstrip('/')}/{download_id}/{urllib.parse.quote(filename)}"
 
-        background_tasks.add_task(cleanup_folder, download_dir)
+        started = time.perf_counter()
 
-        return FileResponse(
-            filepath,
-            headers=headers,
-            media_type='application/octet-stream',
-            filename=filename
-        )
+        def on_close(complete):
+            leases.release(download_id, complete)
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='serve', platform='')
+            metrics.BYTES_TOTAL.inc(response.bytes_sent, direction='served', platform='')
 
+        leases.acquire(download_id, download_dir)
+        try:
+            response = RangeFileResponse(
+                filepath,
+                request.headers,
+                filename,
+                method=request.method,
+                inline=inline,
+                on_close=on_close,
+                accel_path=accel_path
+            )
+            return response
+        except Exception:
+            leases.release(download_id, False)
+            raise
+
+    except HTTPException:
+        raise
     except Exception as e:
-        if os.path.exists(download_dir):
-            shutil.rmtree(download_dir)
         logger.error(f"Error serving file: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -305,8 +853,13 @@ async def get_file(download_id: str, background_tasks: BackgroundTasks):
 async def cleanup_download(download_id: str):
     try:
         download_dir = os.path.join(TEMP_FOLDER, download_id)
+        task = trackers.get(download_id)
+        if task:
+            task.cancel()
+        leases.forget(download_id)
         if os.path.exists(download_dir):
             shutil.rmtree(download_dir)
+        await asyncio.to_thread(job_store.delete, download_id)
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Cleanup error: {str(e)}")
@@ -0,0 +1,274 @@
+import glob
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+
+import yt_dlp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from core.media_cache import MediaCache, link_or_copy
+from core.postprocess import AUDIO_CODECS, ensure_audio, ensure_mp4
+from core.info_cache import InfoCache
+from core.resolver import resolver
+from core import metrics, transfer
+from core.transfer import extractor_pool
+from core.ratelimit import guard
+from core.clip import Clip
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMP_FOLDER = os.path.join(BACKEND_DIR, "downloads")
+os.makedirs(TEMP_FOLDER, exist_ok=True)
+
+media_cache = MediaCache.from_env()
+info_cache = InfoCache.from_env(os.path.join(BACKEND_DIR, "info_cache"))
+
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "0.25"))
+
+class ProgressCallback:
+    """yt-dlp progress/postprocessor hook that forwards throttled events to a job channel"""
+
+    def __init__(self, publish=None, interval=PROGRESS_INTERVAL, platform=''):
+        self.publish = publish or (lambda event: None)
+        self.interval = interval
+        self.platform = platform
+        self.current = 0
+        self.total = 0
+        self.status = ""
+        self.postprocess_seconds = 0.0
+        self._postprocess_started = None
+        self._last_progress = -1
+        self._last_time = 0.0
+        # Video and audio may download at the same time; progress covers both files
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def emit(self, progress: int, status: str, force: bool = False, **extra):
+        with self._lock:
+            now = time.monotonic()
+            if not force and progress < self._last_progress + 1 and now - self._last_time < self.interval:
+                return
+            self._last_progress = progress
+            self._last_time = now
+            self.status = status
+        self.publish({"progress": progress, "status": status, **extra})
+
+    def __call__(self, d):
+        if getattr(self.publish, 'cancelled', False):
+            raise yt_dlp.utils.DownloadCancelled("Завантаження скасовано")
+        if d['status'] == 'downloading':
+            with self._lock:
+                self._files[d.get('filename', '')] = (
+                    d.get('downloaded_bytes', 0),
+                    d.get('total_bytes', 0) or d.get('total_bytes_estimate', 0)
+                )
+                self.current = sum(done for done, _ in self._files.values())
+                self.total = sum(total for _, total in self._files.values())
+            if self.total:
+                progress = int(self.current * 90 / self.total)
+                self.emit(
+                    progress,
+                    f"Завантаження: {os.path.basename(d.get('filename', ''))}",
+                    downloaded_bytes=self.current,
+                    total_bytes=self.total,
+                    speed=d.get('speed'),
+                    eta=d.get('eta'),
+                )
+        elif d['status'] == 'finished':
+            self.emit(90, "Завантаження завершено, обробка...", force=True)
+
+    def ffmpeg_progress(self, start: int, end: int, status: str):
+        """on_progress callback for ffmpeg_service mapping its progress onto [start, end]"""
+        def on_progress(fraction, stats):
+            if getattr(self.publish, 'cancelled', False):
+                raise yt_dlp.utils.DownloadCancelled("Завантаження скасовано")
+            if fraction is not None:
+                self.emit(start + int((end - start) * fraction), status)
+        return on_progress
+
+    def postprocessor_hook(self, d):
+        if getattr(self.publish, 'cancelled', False):
+            raise yt_dlp.utils.DownloadCancelled("Завантаження скасовано")
+        if d['status'] == 'started':
+            self._postprocess_started = time.perf_counter()
+            self.emit(95, f"Обробка: {d.get('postprocessor', '')}", force=True)
+        elif d['status'] == 'finished':
+            if self._postprocess_started is not None:
+                elapsed = time.perf_counter() - self._postprocess_started
+                self._postprocess_started = None
+                self.postprocess_seconds += elapsed
+                stage = 'merge' if d.get('postprocessor') == 'Merger' else 'postprocess'
+                metrics.STAGE_SECONDS.observe(elapsed, stage=stage, platform=self.platform)
+            self.emit(99, "Обробка завершена", force=True)
+
+VIDEO_FORMAT_OPTS = {
+    'youtube': 'bestvideo[vcodec^=avc1][ext=mp4]+bestaudio[ext=m4a]/best[vcodec^=avc1][ext=mp4]/best[ext=mp4]',
+    'instagram': 'best[vcodec^=avc1][ext=mp4]/best[ext=mp4]',
+    'tiktok': 'best[vcodec^=avc1][ext=mp4]/best[ext=mp4]'
+}
+
+# Audio-only formats first; the combined file is the fallback for posts that have no separate audio
+AUDIO_FORMAT_OPTS = {
+    'mp3': 'bestaudio/best',
+    'm4a': 'bestaudio[acodec^=mp4a]/bestaudio/best',
+    'opus': 'bestaudio[acodec=opus]/bestaudio/best',
+}
+AUDIO_FORMAT_SORT = {
+    'mp3': ['abr'],
+    'm4a': ['acodec:aac', 'abr'],
+    'opus': ['acodec:opus', 'abr'],
+}
+
+COMMON_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+}
+
+def extract_info(url: str, platform: str) -> dict:
+    """Cached metadata extraction on a pooled per-platform YoutubeDL"""
+    params = {
+        'quiet': True,
+        'noplaylist': True,
+        'http_headers': COMMON_HEADERS,
+        'nocheckcertificate': platform == 'tiktok',
+    }
+
+    def extract():
+        with extractor_pool.acquire(platform, params) as ydl, metrics.stage('extract_info', platform):
+            return info_cache.extract(ydl, url)
+
+    return guard.call(platform, extract)
+
+def download_media(url: str, format: str, download_id: str, clip: Clip = None, progress=None) -> tuple[str, str]:
+    output_folder = os.path.join(TEMP_FOLDER, download_id)
+    os.makedirs(output_folder, exist_ok=True)
+
+    resolved = resolver.resolve(url)
+    url = resolved.canonical_url
+    platform = resolved.platform
+    name = '%(title)s' if platform != 'tiktok' else 'tiktok_video_%(id)s'
+    if clip:
+        name += ' [%(section_start)d-%(section_end)d]'
+
+    base_opts = {
+        'format_sort': [
+            'vcodec:h264',  
+            'ext:mp4',     
+            'acodec:aac',   
+            'quality'       
+        ],
+        'merge_output_format': 'mp4',
+        'outtmpl': os.path.join(output_folder, f'{name}.%(ext)s'),
+        'postprocessors': [],
+        'format': VIDEO_FORMAT_OPTS['youtube'],  
+        'http_headers': COMMON_HEADERS,
+    }
+
+    if platform == 'instagram':
+        base_opts.update({
+            'format': VIDEO_FORMAT_OPTS['instagram'],
+            'extract_flat': False,
+            'add_header': [
+                ('User-Agent', 'Instagram 219.0.0.12.117 Android'),
+                ('Origin', 'https://www.instagram.com'),
+            ],
+        })
+    elif platform == 'tiktok':
+        base_opts.update({
+            'format': VIDEO_FORMAT_OPTS['tiktok'],
+            'nocheckcertificate': True,
+        })
+    else:  
+        base_opts.update({
+            'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+            'merge_output_format': 'mp4',
+        })
+
+    if format in AUDIO_CODECS:
+        # Only the audio is fetched; ensure_audio stream-copies it when the codec already fits
+        base_opts.update({
+            'format': AUDIO_FORMAT_OPTS[format],
+            'format_sort': AUDIO_FORMAT_SORT[format],
+        })
+
+    progress_callback = ProgressCallback(progress, platform=platform)
+    base_opts.update({
+        'progress_hooks': [progress_callback],
+        'postprocessor_hooks': [progress_callback.postprocessor_hook],
+        'quiet': False
+    })
+
+    try:
+        cache_key = MediaCache.make_key(
+            platform, resolved.video_id, format, clip.label if clip else 'best', base_opts['format']
+        )
+        cached_path = media_cache.get(cache_key)
+        if cached_path:
+            filepath = link_or_copy(cached_path, output_folder)
+            progress_callback.emit(99, "Знайдено в кеші", force=True)
+            return os.path.basename(filepath), filepath
+
+        progress_callback.emit(0, "Початок завантаження", force=True)
+        
+        info = extract_info(url, platform)
+        if clip:
+            # Only the fragments of the range are fetched; ffmpeg seeks on the stream URLs
+            base_opts.update(clip.bounded(info.get('duration')).ydl_options())
+        started = time.perf_counter()
+        info = guard.call(
+            platform, transfer.download, base_opts, info, platform,
+            cancelled=lambda: getattr(progress, 'cancelled', False)
+        )
+        # yt-dlp's postprocessors are timed by the hook and the parallel merge by transfer; neither is download time
+        metrics.STAGE_SECONDS.observe(
+            time.perf_counter() - started - progress_callback.postprocess_seconds - info.get('merge_seconds', 0),
+            stage='download', platform=platform
+        )
+        
+        progress_callback.emit(99, "Фінальна обробка", force=True)
+
+        downloaded = [d.get('filepath') for d in info.get('requested_downloads', [])]
+        files = [path for path in downloaded if path and os.path.exists(path)][:1]
+        if not files:
+            files = glob.glob(os.path.join(output_folder, f'*.{format}'))
+
+        if files:
+            with metrics.stage('postprocess', platform):
+                if format in AUDIO_CODECS:
+                    files[0], action = ensure_audio(
+                        files[0], format,
+                        on_progress=progress_callback.ffmpeg_progress(90, 99, "Конвертація аудіо")
+                    )
+                else:
+                    files[0], action = ensure_mp4(
+                        files[0],
+                        on_progress=progress_callback.ffmpeg_progress(90, 99, "Конвертація відео")
+                    )
+            progress_callback.emit(99, "Фінальна обробка", force=True, postprocess=action)
+
+        if not files:
+            raise Exception("File not found after download")
+            
+        filepath = files[0]
+        filename = os.path.basename(filepath)
+        
+        if os.path.getsize(filepath) == 0:
+            raise Exception("Downloaded file is empty")
+        metrics.BYTES_TOTAL.inc(os.path.getsize(filepath), direction='downloaded', platform=platform)
+
+        try:
+            media_cache.put(cache_key, filepath, url=url, title=info.get('title'))
+        except OSError as e:
+            logger.error(f"Cache store error: {str(e)}")
+
+        return filename, filepath
+
+    except Exception as e:
+        shutil.rmtree(output_folder, ignore_errors=True)
+        logger.error(f"Download error: {str(e)}")
+        raise Exception(f"Помилка завантаження: {str(e)}")
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+
+from jobs import MAX_QUEUE_SIZE, Job, JobCancelled, QueueFullError
+
+from core.broker import BROKER_POLL_INTERVAL, DOWNLOAD_QUEUE
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteEngine:
+    """DownloadEngine counterpart that hands jobs to worker processes through a broker.
+
+    submit(func, *args) queues {"task": func.__name__, "args": args} and one
+    poll loop mirrors the broker's state, progress and queue position into
+    local Job objects, so callers use both engines the same way. A finished
+    job's result is (filename, path) with the file in the shared result
+    store, leased until the job is finalized. Same-key jobs are coalesced locally and, through the key, by the
+    broker across front ends.
+    """
+
+    def __init__(self, broker, results, queue=DOWNLOAD_QUEUE, max_queue_size=MAX_QUEUE_SIZE,
+                 poll_interval=BROKER_POLL_INTERVAL):
+        self.broker = broker
+        self.results = results
+        self.queue = queue
+        self.max_queue_size = max_queue_size
+        self.poll_interval = poll_interval
+        self._jobs = set()
+        self._inflight = {}
+        self._poller = None
+        self._closing = False
+        self._counts = {'queued': 0, 'reserved': 0}
+
+    async def start(self):
+        self._poller = asyncio.create_task(self._poll())
+        logger.info(f"Remote download engine started on queue {self.queue}")
+
+    async def stop(self, timeout=None):
+        """Stop polling; queued and running messages stay with the broker and its workers"""
+        self._closing = True
+        self._poller.cancel()
+        logger.info("Remote download engine stopped")
+
+    def submit(self, func, *args, platform=None, priority=0, key=None, on_finalize=None) -> Job:
+        """Queue a job, or attach to the local job with the same key; release() every returned job"""
+        if self._closing:
+            raise QueueFullError("Сервер перезапускається, спробуйте пізніше")
+        if key is not None and key in self._inflight:
+            job = self._inflight[key]
+            job.refs += 1
+            return job
+        if self.queue_depth >= self.max_queue_size:
+            raise QueueFullError("Черга завантажень заповнена, спробуйте пізніше")
+
+        job = Job(func, args, platform=platform, priority=priority, key=key,
+                  on_finalize=lambda: self._finalize(job, on_finalize))
+        job.message_id = None
+        job.position = 0
+        job.lease = None
+        self._jobs.add(job)
+        if key is not None:
+            self._inflight[key] = job
+        payload = {'task': func.__name__, 'args': list(args)}
+        asyncio.create_task(self._enqueue(job, payload, None if key is None else repr(key)))
+        return job
+
+    async def _enqueue(self, job: Job, payload: dict, key):
+        try:
+            job.message_id = await asyncio.to_thread(self.broker.enqueue, self.queue, payload, job.priority, key)
+        except Exception as e:
+            logger.error(f"Broker enqueue error: {str(e)}")
+            self._finish(job, 'failed', exception=Exception(f"Помилка черги завантажень: {str(e)}"))
+            return
+        if job.cancelled:
+            await asyncio.to_thread(self.broker.cancel, job.message_id)
+
+    def release(self, job: Job):
+        """Drop one reference; the last one cancels an unfinished job (and its broker reference)"""
+        job.refs -= 1
+        if job.refs > 0:
+            return
+        if not job.finished:
+            job.cancelled = True
+            if job.message_id:
+                asyncio.create_task(asyncio.to_thread(self.broker.cancel, job.message_id))
+            self._finish(job, 'cancelled', exception=JobCancelled("Завантаження скасовано"))
+            logger.info(f"Job {job.id} cancelled: no clients left")
+        job.finalize()
+
+    @staticmethod
+    def _finalize(job: Job, on_finalize):
+        # Every client has taken its copy of the result
+        if job.lease is not None:
+            job.lease.release()
+        if on_finalize:
+            on_finalize()
+
+    def _finish(self, job: Job, state: str, result=None, exception=None):
+        if job.finished:
+            return
+        job.state = state
+        self._jobs.discard(job)
+        if job.key is not None and self._inflight.get(job.key) is job:
+            del self._inflight[job.key]
+        if not job.future.done():
+            if exception is not None:
+                job.future.set_exception(exception)
+                if state == 'cancelled':
+                    job.future.exception()
+            else:
+                job.future.set_result(result)
+        job.progress.close()
+        job.finalize()
+
+    def position(self, job: Job) -> int:
+        """1-based place of a job in the broker queue, 0 once a worker has it"""
+        return job.position if job.state == 'queued' else 0
+
+    @property
+    def queue_depth(self) -> int:
+        return self._counts['queued']
+
+    @property
+    def active(self) -> int:
+        return self._counts['reserved']
+
+    async def _poll(self):
+        while True:
+            jobs = [job for job in self._jobs if job.message_id]
+            try:
+                records = await asyncio.to_thread(self.broker.statuses, [job.message_id for job in jobs])
+                self._counts = await asyncio.to_thread(self.broker.counts, self.queue)
+            except Exception as e:
+                logger.error(f"Broker poll error: {str(e)}")
+            else:
+                for job in jobs:
+                    if not job.finished:
+                        await self._apply(job, records.get(job.message_id))
+            await asyncio.sleep(self.poll_interval)
+
+    async def _apply(self, job: Job, record):
+        if record is None:
+            self._finish(job, 'failed', exception=Exception("Завдання втрачено брокером"))
+            return
+        job.position = record['position']
+        if record['state'] == 'reserved':
+            job.state = 'running'
+        if record['progress'] and record['progress'] != job.progress.last:
+            job.progress.publish(record['progress'])
+
+        if record['state'] == 'done':
+            lease = await asyncio.to_thread(self.results.lease, record['id'])
+            if job.finished:
+                # Cancelled while the lease was taken
+                if lease is not None:
+                    lease.release()
+                return
+            job.lease = lease
+            if lease is None:
+                self._finish(job, 'failed', exception=Exception("Результат завантаження не знайдено"))
+            else:
+                self._finish(job, 'done', result=(record['result']['filename'], job.lease.path))
+        elif record['state'] == 'failed':
+            self._finish(job, 'failed', exception=Exception(record['error']))
+        elif record['state'] == 'cancelled':
+            self._finish(job, 'cancelled', exception=JobCancelled(record['error'] or "Завантаження скасовано"))
@@ -0,0 +1,185 @@
+"""Download worker: takes jobs from the broker and runs the download pipeline.
+
+    BROKER_URL=sqlite:////srv/videodw/broker.sqlite3 RESULT_STORE_DIR=/srv/videodw/results \\
+        python WebSite/backend/worker.py
+
+Run as many as the nodes have room for; the API and the bot only queue
+jobs when BROKER_URL is set. Finished files go to the shared result store
+under the message id. A worker keeps its jobs reserved with heartbeats;
+if it dies they are delivered to another one once the visibility timeout
+runs out. SIGTERM stops taking new jobs and lets running ones finish.
+"""
+import logging
+import os
+import shutil
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from pipeline import PROGRESS_INTERVAL, TEMP_FOLDER, download_media
+
+from core import metrics
+from core.broker import BROKER_URL, BROKER_VISIBILITY_TIMEOUT, DOWNLOAD_QUEUE, from_url, result_store
+from core.clip import Clip
+from core.transfer import extractor_pool
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", "4"))
+WORKER_HEARTBEAT = float(os.environ.get("WORKER_HEARTBEAT", str(BROKER_VISIBILITY_TIMEOUT / 4)))
+WORKER_IDLE_WAIT = float(os.environ.get("WORKER_IDLE_WAIT", "1"))
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))
+
+
+class BrokerReporter:
+    """progress callable for download_media that stores throttled events with the broker.
+
+    cancelled turns true once the worker no longer holds the message:
+    every client gave up on it or it was redelivered after a missed heartbeat.
+    """
+
+    def __init__(self, broker, message_id: str, worker_id: str, interval: float = PROGRESS_INTERVAL * 4):
+        self.broker = broker
+        self.message_id = message_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.cancelled = False
+        self._last = 0.0
+
+    def __call__(self, event: dict):
+        now = time.monotonic()
+        # Cache hits and the final stages jump straight to 99; always pass those on
+        if now - self._last < self.interval and event.get('progress', 0) < 99:
+            return
+        self._last = now
+        try:
+            if not self.broker.progress(self.message_id, self.worker_id, event):
+                self.cancelled = True
+        except Exception as e:
+            logger.error(f"Broker progress error: {str(e)}")
+
+
+class Worker:
+    def __init__(self, broker, results, concurrency: int = WORKER_CONCURRENCY, queue: str = DOWNLOAD_QUEUE):
+        self.id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.broker = broker
+        self.results = results
+        self.concurrency = concurrency
+        self.queue = queue
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        """Work until stop() and every running job is finished"""
+        heartbeat = threading.Thread(target=self._heartbeat, name='heartbeat', daemon=True)
+        heartbeat.start()
+        loops = [
+            threading.Thread(target=self._loop, name=f'worker-{index}')
+            for index in range(self.concurrency)
+        ]
+        for loop in loops:
+            loop.start()
+        logger.info(f"Worker {self.id} started: {self.concurrency} slots on queue {self.queue}")
+        for loop in loops:
+            loop.join()
+        self._stopped.set()
+        heartbeat.join()
+        self.broker.remove_worker(self.id)
+        logger.info(f"Worker {self.id} stopped")
+
+    def stop(self):
+        self._stopping.set()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                message = self.broker.reserve(self.queue, self.id)
+            except Exception as e:
+                logger.error(f"Broker reserve error: {str(e)}")
+                self._stopping.wait(WORKER_IDLE_WAIT)
+                continue
+            if message is None:
+                self._stopping.wait(WORKER_IDLE_WAIT)
+                continue
+            try:
+                self._handle(message)
+            except Exception as e:
+                # The reservation runs out and the message goes to another worker
+                logger.error(f"Broker error for message {message.id}: {str(e)}")
+
+    def _handle(self, message):
+        reporter = BrokerReporter(self.broker, message.id, self.id)
+        with self._lock:
+            self._running[message.id] = reporter
+        logger.info(f"Message {message.id} taken (attempt {message.attempts})")
+        try:
+            result = self.process(message, reporter)
+        except Exception as e:
+            if reporter.cancelled:
+                logger.info(f"Message {message.id} given up: no longer held by this worker")
+            else:
+                self.broker.fail(message.id, self.id, str(e))
+        else:
+            if not self.broker.complete(message.id, self.id, result):
+                logger.info(f"Message {message.id} finished after it was taken over")
+        finally:
+            with self._lock:
+                self._running.pop(message.id, None)
+
+    def process(self, message, reporter) -> dict:
+        payload = message.payload
+        if payload.get('task') != 'download_media':
+            raise ValueError(f"Unknown task: {payload.get('task')}")
+        url, format, download_id, clip = payload['args']
+        clip = Clip(*clip) if clip else None
+        filename, filepath = download_media(url, format, download_id, clip, progress=reporter)
+        try:
+            self.results.put(message.id, filepath, url=url)
+        finally:
+            shutil.rmtree(os.path.join(TEMP_FOLDER, download_id), ignore_errors=True)
+        return {'filename': filename}
+
+    def _heartbeat(self):
+        while True:
+            with self._lock:
+                running = dict(self._running)
+            try:
+                lost = self.broker.heartbeat(self.id, list(running))
+                self.broker.purge()
+            except Exception as e:
+                logger.error(f"Broker heartbeat error: {str(e)}")
+                lost = ()
+            for message_id in lost:
+                running[message_id].cancelled = True
+            if self._stopped.wait(WORKER_HEARTBEAT):
+                return
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if not BROKER_URL:
+        raise SystemExit("Set BROKER_URL, e.g. sqlite:////srv/videodw/broker.sqlite3 or redis://localhost:6379/0")
+    if WORKER_METRICS_PORT:
+        metrics.serve(WORKER_METRICS_PORT)
+    worker = Worker(from_url(BROKER_URL), result_store())
+
+    def shutdown(signum, frame):
+        logger.info("Stopping: finishing running jobs, send the signal again to quit now")
+        worker.stop()
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    try:
+        worker.run()
+    finally:
+        extractor_pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -38,9 +38,9 @@ document.addEventListener('DOMContentLoaded', () => {
 const API_URL = 'http://localhost:8000/api';
 
 const URL_PATTERNS = {
-    youtube: /^(https?:\/\/)?(www\.)?(youtube\.com\/watch\?v=|youtu\.be\/)[\w-]+/,
-    instagram: /https?:\/\/(?:www\.)?instagram\.com\/(?:p|reel|share)\/[\w-]+\/?/,
-    tiktok: /https?:\/\/(?:www\.|vm\.)?tiktok\.com\//
+    youtube: /^(https?:\/\/)?((www|m|music)\.)?(youtube\.com\/(watch\?|shorts\/|embed\/|live\/)|youtu\.be\/)[\w-]+/,
+    instagram: /^(https?:\/\/)?(www\.)?instagram\.com\/([\w.]+\/)?(p|reels?|tv|share)\/[\w-]+/,
+    tiktok: /^(https?:\/\/)?((www|m|vm|vt)\.)?tiktok\.com\//
 };
 
 const translations = {
@@ -49,8 +49,12 @@ const translations = {
         telegramText: 'Спробуйте також наш',
         telegramBot: 'Telegram бот',
         urlPlaceholder: 'Вставте YouTube, Instagram, або Tiktok URL',
+        clipStartPlaceholder: 'Початок фрагмента (0:15)',
+        clipEndPlaceholder: 'Кінець фрагмента (0:30)',
         videoOption: 'MP4 (Відео)',
         audioOption: 'MP3 (Аудіо)',
+        m4aOption: 'M4A (Аудіо, без перекодування)',
+        opusOption: 'Opus (Аудіо, без перекодування)',
         downloadButton: 'Завантажити',
         preparing: 'Підготовка до завантаження...',
         downloading: 'Завантаження...',
@@ -62,8 +66,12 @@ const translations = {
         telegramText: 'Also try our',
         telegramBot: 'Telegram bot',
         urlPlaceholder: 'Paste YouTube, Instagram, or TikTok URL',
+        clipStartPlaceholder: 'Clip start (0:15)',
+        clipEndPlaceholder: 'Clip end (0:30)',
         videoOption: 'MP4 (Video)',
         audioOption: 'MP3 (Audio)',
+        m4aOption: 'M4A (Audio, no re-encoding)',
+        opusOption: 'Opus (Audio, no re-encoding)',
         downloadButton: 'Download',
         preparing: 'Preparing to download...',
         downloading: 'Downloading...',
@@ -81,8 +89,12 @@ function updatePageLanguage(lang) {
     document.querySelector('.telegram-banner').innerHTML = 
         `${t.telegramText} <a href="https://t.me/zcollage_bot" target="_blank">${t.telegramBot}</a> 🤖`;
     document.querySelector('#url').placeholder = t.urlPlaceholder;
+    document.querySelector('#clipStart').placeholder = t.clipStartPlaceholder;
+    document.querySelector('#clipEnd').placeholder = t.clipEndPlaceholder;
     document.querySelector('select option[value="mp4"]').textContent = t.videoOption + ' 🎞️';
     document.querySelector('select option[value="mp3"]').textContent = t.audioOption + ' 🔈';
+    document.querySelector('select option[value="m4a"]').textContent = t.m4aOption + ' 🔈';
+    document.querySelector('select option[value="opus"]').textContent = t.opusOption + ' 🔈';
     document.querySelector('#downloadBtn').textContent = t.downloadButton;
 
     const statusDiv = document.getElementById('status');
@@ -101,6 +113,14 @@ function updatePageLanguage(lang) {
     updateVideoSources(device);
 }
 
+// Validation errors (422) carry detail as a list of {loc, msg, type}
+function errorDetail(detail) {
+    if (Array.isArray(detail)) {
+        return detail.map(item => item.msg || String(item)).join('; ');
+    }
+    return typeof detail === 'string' ? detail : '';
+}
+
 async function startDownload() {
     const urlInput = document.getElementById('url');
     const formatSelect = document.getElementById('format');
@@ -144,58 +164,76 @@ async function startDownload() {
             },
             body: JSON.stringify({
                 url: urlInput.value,
-                format: formatSelect.value
+                format: formatSelect.value,
+                start: document.getElementById('clipStart').value.trim() || null,
+                end: document.getElementById('clipEnd').value.trim() || null
             })
         });
 
+        if (!response.ok) {
+            const body = await response.json().catch(() => ({}));
+            throw new Error(errorDetail(body.detail) || response.statusText);
+        }
+
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
+        let buffer = '';
 
         while (true) {
             const { value, done } = await reader.read();
             if (done) break;
 
-            const text = decoder.decode(value);
-            const lines = text.split('\n').filter(line => line.trim());
-            
-            for (const line of lines) {
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+
+            for (const event of events) {
+                const payload = event
+                    .split('\n')
+                    .filter(line => line.startsWith('data:'))
+                    .map(line => line.slice(5).trim())
+                    .join('\n');
+                if (!payload) continue;
+
+                let data;
                 try {
-                    const data = JSON.parse(line);
-                    if (data.error) {
-                        throw new Error(data.error);
-                    }
-                    if (data.progress !== undefined) {
-                        progressFill.style.width = `${data.progress}%`;
-                        statusDiv.textContent = `${data.status} (${data.progress}%)`;
-                    }
-                    if (data.download_id) {
-                        const downloadUrl = `${API_URL}/download/${data.download_id}`;
-                        const downloadResponse = await fetch(downloadUrl);
-                        if (!downloadResponse.ok) throw new Error('Download failed');
-                        const blob = await downloadResponse.blob();
-
-                        const url = window.URL.createObjectURL(blob);
-                        const a = document.createElement('a');
-                        a.href = url;
-                        a.download = data.filename;
-                        document.body.appendChild(a);
-                        a.click();
-                        window.URL.revokeObjectURL(url);
-                        a.remove();
-
-                        statusDiv.textContent = t.completed;
-                        statusDiv.className = 'status success';
-                        urlInput.classList.add('unhook-animation');
-                        setTimeout(() => {
-                            urlInput.classList.add('fade-out');
-                            setTimeout(() => {
-                                urlInput.value = '';
-                                urlInput.classList.remove('unhook-animation', 'fade-out');
-                            }, 300);
-                        }, 500);
-                    }
+                    data = JSON.parse(payload);
                 } catch (e) {
                     console.error('Error parsing progress:', e);
+                    continue;
+                }
+                if (data.error) {
+                    throw new Error(data.error);
+                }
+                if (data.progress !== undefined) {
+                    progressFill.style.width = `${data.progress}%`;
+                    statusDiv.textContent = `${data.status} (${data.progress}%)`;
+                }
+                if (data.download_id) {
+                    const downloadUrl = `${API_URL}/download/${data.download_id}`;
+                    const downloadResponse = await fetch(downloadUrl);
+                    if (!downloadResponse.ok) throw new Error('Download failed');
+                    const blob = await downloadResponse.blob();
+
+                    const url = window.URL.createObjectURL(blob);
+                    const a = document.createElement('a');
+                    a.href = url;
+                    a.download = data.filename;
+                    document.body.appendChild(a);
+                    a.click();
+                    window.URL.revokeObjectURL(url);
+                    a.remove();
+
+                    statusDiv.textContent = t.completed;
+                    statusDiv.className = 'status success';
+                    urlInput.classList.add('unhook-animation');
+                    setTimeout(() => {
+                        urlInput.classList.add('fade-out');
+                        setTimeout(() => {
+                            urlInput.value = '';
+                            urlInput.classList.remove('unhook-animation', 'fade-out');
+                        }, 300);
+                    }, 500);
                 }
             }
         }
@@ -0,0 +1,230 @@
+"""Local stand-in for the Telegram Bot API.
+
+Answers the methods the bot uses with plausible objects and records every
+call, so the bot can run end to end without Telegram:
+
+    python benchmarks/bot_api_stub.py --port 8081
+    BOT_API_URL=http://127.0.0.1:8081/bot BOT_API_LOCAL=1 TELEGRAM_BOT_TOKEN=123:stub \\
+        python "Telegram Bot/bot_main.py"
+
+Updates reach the bot through getUpdates (queue them with POST
+/stub/updates) or, in webhook mode, by posting them to the bot's webhook:
+
+    python benchmarks/bot_api_stub.py --webhook http://127.0.0.1:8443/telegram --secret $WEBHOOK_SECRET \\
+        --send "/clip https://www.tiktok.com/@_/video/123 0:01 0:05"
+
+GET /stub/calls returns the recorded calls as JSON.
+"""
+import argparse
+import email.parser
+import http.server
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+USER = {'id': 1000, 'is_bot': False, 'first_name': 'Tester'}
+_ids = itertools.count(1)
+
+
+def chat(chat_id) -> dict:
+    return {'id': int(chat_id), 'type': 'private', 'first_name': USER['first_name']}
+
+
+def make_update(text: str, chat_id: int = USER['id']) -> dict:
+    """A private-chat text message update; commands get their bot_command entity"""
+    message = {
+        'message_id': next(_ids),
+        'date': int(time.time()),
+        'chat': chat(chat_id),
+        'from': USER,
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': next(_ids), 'message': message}
+
+
+def parse_params(content_type: str, body: bytes) -> dict:
+    """Parameters of a Bot API call sent as JSON, a urlencoded form or multipart"""
+    if not body:
+        return {}
+    if content_type.startswith('application/json'):
+        return json.loads(body)
+    params = {}
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser().parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+        )
+        for part in message.get_payload():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            if part.get_filename():
+                params[name] = {'filename': part.get_filename(), 'size': len(payload)}
+            else:
+                params[name] = payload.decode('utf-8', 'replace')
+    else:
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(body.decode('utf-8')).items()}
+    for key, value in params.items():
+        if isinstance(value, str):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                pass
+    return params
+
+
+class BotAPIHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    calls = []
+    updates = []
+    _lock = threading.Lock()
+
+    def _reply(self, status: int, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _message(self, params: dict, **fields) -> dict:
+        return dict({
+            'message_id': next(_ids),
+            'date': int(time.time()),
+            'chat': chat(params.get('chat_id', USER['id'])),
+            'from': BOT_USER,
+        }, **fields)
+
+    def _send_video(self, params: dict) -> dict:
+        video = params.get('video')
+        if isinstance(video, str) and video.startswith('file://'):
+            # Local mode: the bot passes a path instead of uploading the bytes
+            path = urllib.parse.unquote(urllib.parse.urlsplit(video).path)
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+        elif isinstance(video, dict):
+            size = video['size']
+        else:
+            size = 0
+        file_id = f"stub-video-{next(_ids)}"
+        return self._message(params, caption=params.get('caption'), video={
+            'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 720,
+            'duration': 1, 'file_size': size,
+        })
+
+    def _call(self, method: str, params: dict):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            deadline = time.monotonic() + min(float(params.get('timeout') or 0), 1.0)
+            offset = int(params.get('offset') or 0)
+            while True:
+                with self._lock:
+                    pending = [u for u in BotAPIHandler.updates if u['update_id'] >= offset]
+                    BotAPIHandler.updates = pending
+                if pending or time.monotonic() >= deadline:
+                    return pending
+                time.sleep(0.1)
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(params, text=params.get('text'))
+        if method == 'sendVideo':
+            return self._send_video(params)
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        # setWebhook, deleteWebhook, deleteMessage, answerCallbackQuery, ...
+        return True
+
+    def do_GET(self):
+        if self.path.startswith('/stub/calls'):
+            with self._lock:
+                self._reply(200, BotAPIHandler.calls)
+            return
+        self._handle()
+
+    def do_POST(self):
+        if self.path.startswith('/stub/updates'):
+            length = int(self.headers.get('Content-Length') or 0)
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            update = make_update(payload.get('text', ''), payload.get('chat_id', USER['id']))
+            with self._lock:
+                BotAPIHandler.updates.append(update)
+            self._reply(200, update)
+            return
+        self._handle()
+
+    def _handle(self):
+        # /bot<token>/<method>
+        parts = urllib.parse.urlsplit(self.path).path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+            return
+        method = parts[1]
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            params = parse_params(self.headers.get('Content-Type', ''), body)
+        except ValueError as e:
+            self._reply(400, {'ok': False, 'error_code': 400, 'description': str(e)})
+            return
+        with self._lock:
+            BotAPIHandler.calls.append({'method': method, 'params': params, 'time': time.time()})
+        self._reply(200, {'ok': True, 'result': self._call(method, params)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(port: int = 0, host: str = '127.0.0.1') -> http.server.ThreadingHTTPServer:
+    """Start the stub on a background thread; port 0 picks a free one (see server.server_address)"""
+    server = http.server.ThreadingHTTPServer((host, port), BotAPIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='bot-api-stub', daemon=True).start()
+    return server
+
+
+def post_update(webhook_url: str, update: dict, secret: str = None) -> int:
+    """Deliver an update to a bot's webhook the way Telegram does; returns the HTTP status"""
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+    request = urllib.request.Request(webhook_url, json.dumps(update).encode('utf-8'), headers)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return response.status
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--webhook', help="bot webhook URL that --send messages are posted to")
+    parser.add_argument('--secret', help="the bot's WEBHOOK_SECRET")
+    parser.add_argument('--send', action='append', default=[], help="message text to deliver, repeatable")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = start_stub(args.port, args.host)
+    host, port = server.server_address[:2]
+    logger.info(f"Bot API stub on http://{host}:{port}/bot<token>/<method>")
+    for text in args.send:
+        update = make_update(text)
+        if args.webhook:
+            status = post_update(args.webhook, update, args.secret)
+            logger.info(f"Posted update {update['update_id']} to the webhook: {status}")
+        else:
+            BotAPIHandler.updates.append(update)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Local media origin for benchmarks.
+
+Serves synthetic clips rendered once with ffmpeg, so load tests never touch
+YouTube/Instagram/TikTok:
+
+    /video/<name>.mp4   H.264/AAC MP4 with faststart
+    /audio/<name>.m4a   AAC audio
+
+<name> is ignored, so every request can use its own URL to bypass the
+backend caches. yt-dlp's generic extractor handles these links directly;
+start the backend with serve_backend.py --origin http://127.0.0.1:<port> to accept them.
+
+    python benchmarks/fake_origin.py --port 8090 --duration 30 --latency 0.05 --rate 20
+"""
+import argparse
+import http.server
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def render_media(folder: str, duration: float, size: str, video_bitrate: str) -> dict:
+    """Render the synthetic clips into folder; returns {extension: bytes}"""
+    video_path = os.path.join(folder, 'clip.mp4')
+    audio_path = os.path.join(folder, 'clip.m4a')
+    if not os.path.exists(video_path):
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=30',
+            '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100',
+            '-t', str(duration),
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', video_bitrate, '-pix_fmt', 'yuv420p',
+            '-c:a', 'aac', '-b:a', '128k',
+            '-movflags', '+faststart', video_path
+        ], check=True)
+    if not os.path.exists(audio_path):
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-y', '-i', video_path, '-vn', '-c:a', 'copy', audio_path
+        ], check=True)
+    media = {}
+    for ext, path in (('mp4', video_path), ('m4a', audio_path)):
+        with open(path, 'rb') as f:
+            media[ext] = f.read()
+    return media
+
+
+class OriginHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    media = {}
+    latency = 0.0
+    rate = 0
+    requests_served = 0
+    bytes_served = 0
+    _lock = threading.Lock()
+
+    def _resolve(self):
+        path = self.path.split('?')[0]
+        if path.startswith('/video/') and path.endswith('.mp4'):
+            return self.media['mp4'], 'video/mp4'
+        if path.startswith('/audio/') and path.endswith('.m4a'):
+            return self.media['m4a'], 'audio/mp4'
+        return None, None
+
+    def _serve(self, send_body: bool):
+        body, content_type = self._resolve()
+        if body is None:
+            self.send_error(404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+
+        start, end = 0, len(body) - 1
+        range_header = self.headers.get('Range')
+        if range_header and range_header.startswith('bytes='):
+            first, _, last = range_header[6:].partition('-')
+            if first:
+                start = int(first)
+                end = min(int(last), end) if last else end
+            elif last:
+                start = max(len(body) - int(last), 0)
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not send_body:
+            return
+
+        sent = 0
+        started = time.monotonic()
+        for offset in range(start, end + 1, CHUNK_SIZE):
+            chunk = body[offset:min(offset + CHUNK_SIZE, end + 1)]
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                break
+            sent += len(chunk)
+            if self.rate:
+                # Keep the connection at --rate MB/s
+                delay = sent / (self.rate * 1024 * 1024) - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+        with self._lock:
+            OriginHandler.requests_served += 1
+            OriginHandler.bytes_served += sent
+
+    def do_GET(self):
+        self._serve(True)
+
+    def do_HEAD(self):
+        self._serve(False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_origin(port: int = 0, host: str = '127.0.0.1', duration: float = 30, size: str = '1280x720',
+                 video_bitrate: str = '2M', latency: float = 0.0, rate: float = 0,
+                 media_dir: str = None) -> http.server.ThreadingHTTPServer:
+    """Start the origin on a background thread; port 0 picks a free one (see server.server_address)"""
+    media_dir = media_dir or tempfile.mkdtemp(prefix='videodw-origin-')
+    OriginHandler.media = render_media(media_dir, duration, size, video_bitrate)
+    OriginHandler.latency = latency
+    OriginHandler.rate = rate
+    server = http.server.ThreadingHTTPServer((host, port), OriginHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-origin', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake media origin for load tests")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--duration', type=float, default=30, help="clip length in seconds")
+    parser.add_argument('--size', default='1280x720', help="video frame size")
+    parser.add_argument('--video-bitrate', default='2M')
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before every response")
+    parser.add_argument('--rate', type=float, default=0, help="per-connection MB/s cap, 0 = unlimited")
+    parser.add_argument('--media-dir', help="where to keep the rendered clips between runs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = start_origin(
+        args.port, args.host, args.duration, args.size, args.video_bitrate,
+        args.latency, args.rate, args.media_dir
+    )
+    host, port = server.server_address[:2]
+    logger.info(f"Fake origin on http://{host}:{port}/video/<name>.mp4 and /audio/<name>.m4a")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
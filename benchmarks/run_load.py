@@ -0,0 +1,320 @@
+"""Load generator for the web backend.
+
+Drives --concurrency parallel POST /api/download -> GET /api/download/{id}
+cycles against links on the fake origin and reports latency percentiles,
+jobs/sec, server CPU and peak disk use. Results are written as JSON and
+can be compared with an earlier run:
+
+    python benchmarks/serve_backend.py --origin http://127.0.0.1:8090
+    python benchmarks/run_load.py --start-origin --jobs 200 --concurrency 16 \\
+        --server-pid $(pgrep -f serve_backend.py) --watch-dir WebSite/backend/downloads \\
+        --output benchmarks/results/run.json --baseline benchmarks/results/baseline.json
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+import requests
+
+from fake_origin import start_origin
+
+# (metric path, True when higher is better)
+COMPARED_METRICS = [
+    (('jobs_per_second',), True),
+    (('latency', 'total', 'p50'), False),
+    (('latency', 'total', 'p95'), False),
+    (('latency', 'total', 'p99'), False),
+    (('latency', 'ready', 'p95'), False),
+    (('server_cpu_seconds',), False),
+    (('peak_disk_bytes',), False),
+]
+
+
+def percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        'p50': rank(50),
+        'p95': rank(95),
+        'p99': rank(99),
+        'mean': sum(ordered) / len(ordered),
+        'max': ordered[-1],
+    }
+
+
+def read_sse(response):
+    """Yield the JSON payloads of a text/event-stream response"""
+    data = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if data:
+                yield json.loads('\n'.join(data))
+                data = []
+        elif line.startswith('data:'):
+            data.append(line[5:].lstrip())
+    if data:
+        yield json.loads('\n'.join(data))
+
+
+def run_cycle(session, backend: str, url: str, format: str, keep: bool) -> dict:
+    result = {'ok': False, 'status': None, 'error': None, 'bytes': 0}
+    started = time.perf_counter()
+    try:
+        with session.post(f"{backend}/api/download", json={'url': url, 'format': format}, stream=True,
+                          timeout=600) as response:
+            result['status'] = response.status_code
+            if response.status_code != 200:
+                result['error'] = response.text[:200]
+                return result
+            download_id = None
+            for event in read_sse(response):
+                if 'first_event' not in result:
+                    result['first_event'] = time.perf_counter() - started
+                if event.get('error'):
+                    result['error'] = event['error']
+                    return result
+                if event.get('success'):
+                    download_id = event['download_id']
+                    break
+        if not download_id:
+            result['error'] = "stream ended without a result"
+            return result
+        result['ready'] = time.perf_counter() - started
+
+        fetch_started = time.perf_counter()
+        with session.get(f"{backend}/api/download/{download_id}", stream=True, timeout=600) as response:
+            result['status'] = response.status_code
+            if response.status_code != 200:
+                result['error'] = response.text[:200]
+                return result
+            for chunk in response.iter_content(256 * 1024):
+                result['bytes'] += len(chunk)
+        result['fetch'] = time.perf_counter() - fetch_started
+        result['total'] = time.perf_counter() - started
+        result['ok'] = True
+        if not keep:
+            session.delete(f"{backend}/api/cleanup/{download_id}", timeout=30)
+    except (requests.RequestException, ValueError) as e:
+        result['error'] = str(e)
+    return result
+
+
+def directory_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """utime + stime of a process from /proc (Linux only)"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class ResourceSampler(threading.Thread):
+    def __init__(self, watch_dir=None, pid=None, interval=0.5):
+        super().__init__(daemon=True)
+        self.watch_dir = watch_dir
+        self.pid = pid
+        self.interval = interval
+        self.peak_disk = 0
+        self.cpu_start = self.cpu_end = None
+        self._stop_event = threading.Event()
+
+    def _cpu(self):
+        if not self.pid:
+            return None
+        try:
+            return process_cpu_seconds(self.pid)
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def run(self):
+        self.cpu_start = self._cpu()
+        while not self._stop_event.is_set():
+            if self.watch_dir and os.path.isdir(self.watch_dir):
+                self.peak_disk = max(self.peak_disk, directory_size(self.watch_dir))
+            self._stop_event.wait(self.interval)
+        self.cpu_end = self._cpu()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    @property
+    def cpu_seconds(self):
+        if self.cpu_start is None or self.cpu_end is None:
+            return None
+        return self.cpu_end - self.cpu_start
+
+
+def scrape_stages(backend: str) -> dict:
+    """{stage: (sum, count)} from the backend's /metrics, summed over platforms"""
+    stages = {}
+    try:
+        text = requests.get(f"{backend}/metrics", timeout=10).text
+    except requests.RequestException:
+        return stages
+    for line in text.splitlines():
+        for suffix, index in (('_sum', 0), ('_count', 1)):
+            prefix = f'videodw_stage_seconds{suffix}{{'
+            if line.startswith(prefix):
+                labels, value = line[len(prefix):].rsplit('} ', 1)
+                stage = labels.split('stage="', 1)[1].split('"', 1)[0]
+                totals = stages.setdefault(stage, [0.0, 0])
+                totals[index] += float(value)
+    return stages
+
+
+def stage_means(before: dict, after: dict) -> dict:
+    means = {}
+    for stage, (total, count) in after.items():
+        previous_total, previous_count = before.get(stage, (0.0, 0))
+        if count > previous_count:
+            means[stage] = (total - previous_total) / (count - previous_count)
+    return means
+
+
+def lookup(data: dict, path: tuple):
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> bool:
+    """Print the change against a baseline; False if any metric got worse than allowed"""
+    ok = True
+    print(f"\n{'metric':<28}{'baseline':>14}{'current':>14}{'change':>10}")
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = lookup(baseline, path), lookup(current, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > max_regression:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"{'.'.join(path):<28}{old:>14.3f}{new:>14.3f}{change:>+10.1%}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test POST /api/download + GET /api/download/{id}")
+    parser.add_argument('--backend', default='http://127.0.0.1:8000')
+    parser.add_argument('--origin', default='http://127.0.0.1:8090')
+    parser.add_argument('--start-origin', action='store_true', help="run the fake origin in this process")
+    parser.add_argument('--origin-latency', type=float, default=0.0)
+    parser.add_argument('--origin-rate', type=float, default=0)
+    parser.add_argument('--jobs', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--format', default='mp4', choices=['mp4', 'mp3', 'm4a', 'opus'])
+    parser.add_argument('--shared', action='store_true',
+                        help="reuse one URL for every job (measures cache and single-flight hits)")
+    parser.add_argument('--keep', action='store_true', help="don't call /api/cleanup after each job")
+    parser.add_argument('--server-pid', type=int, help="backend process to sample CPU time from")
+    parser.add_argument('--watch-dir', help="folder whose peak size is reported, e.g. the downloads folder")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--max-regression', type=float, default=0.10)
+    args = parser.parse_args()
+
+    origin = args.origin
+    if args.start_origin:
+        port = urllib.parse.urlsplit(args.origin).port or 8090
+        server = start_origin(port, latency=args.origin_latency, rate=args.origin_rate)
+        origin = f"http://127.0.0.1:{server.server_address[1]}"
+
+    path = 'video' if args.format == 'mp4' else 'audio'
+    ext = 'mp4' if args.format == 'mp4' else 'm4a'
+    shared_name = uuid.uuid4().hex
+    urls = [
+        f"{origin}/{path}/{shared_name if args.shared else uuid.uuid4().hex}.{ext}"
+        for _ in range(args.jobs)
+    ]
+
+    stages_before = scrape_stages(args.backend)
+    sampler = ResourceSampler(args.watch_dir, args.server_pid)
+    sampler.start()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=args.concurrency, pool_maxsize=args.concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda url: run_cycle(session, args.backend, url, args.format, args.keep), urls))
+    wall = time.perf_counter() - started
+    sampler.stop()
+    stages_after = scrape_stages(args.backend)
+
+    ok = [r for r in results if r['ok']]
+    statuses = {}
+    for r in results:
+        if not r['ok']:
+            statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+    fetched = sum(r['bytes'] for r in ok)
+    cpu = sampler.cpu_seconds
+    summary = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {
+            'jobs': args.jobs,
+            'concurrency': args.concurrency,
+            'format': args.format,
+            'shared': args.shared,
+            'origin_latency': args.origin_latency,
+            'origin_rate': args.origin_rate,
+        },
+        'ok': len(ok),
+        'failed': len(results) - len(ok),
+        'failures_by_status': statuses,
+        'errors': sorted({r['error'] for r in results if r['error']})[:10],
+        'wall_seconds': wall,
+        'jobs_per_second': len(ok) / wall if wall else 0.0,
+        'latency': {
+            name: percentiles([r[name] for r in ok if name in r])
+            for name in ('first_event', 'ready', 'fetch', 'total')
+        },
+        'bytes_fetched': fetched,
+        'throughput_mb_s': fetched / wall / (1024 * 1024) if wall else 0.0,
+        'server_cpu_seconds': cpu,
+        'server_cpu_percent': cpu / wall * 100 if cpu is not None and wall else None,
+        'peak_disk_bytes': sampler.peak_disk if args.watch_dir else None,
+        'stage_mean_seconds': stage_means(stages_before, stages_after),
+    }
+
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(summary, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
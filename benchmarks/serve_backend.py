@@ -0,0 +1,46 @@
+"""Run the web backend for load tests, accepting links on the fake origin.
+
+The production resolver only knows the real platforms; this launcher
+registers the origin's links on it before the app starts, so nothing in
+the shipped code accepts arbitrary hosts:
+
+    python benchmarks/serve_backend.py --origin http://127.0.0.1:8090 --port 8000
+
+Links resolve to the 'generic' platform and are fetched by yt-dlp's generic
+extractor. With BROKER_URL set the workers resolve links themselves, so run
+the benchmark without a broker.
+"""
+import argparse
+import os
+import re
+import sys
+import urllib.parse
+
+import uvicorn
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'WebSite', 'backend'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Web backend that accepts fake origin links")
+    parser.add_argument('--origin', default='http://127.0.0.1:8090')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    from main import app
+    from core.resolver import resolver
+
+    origin = urllib.parse.urlsplit(args.origin)
+    base = f"{origin.scheme}://{origin.netloc}"
+    resolver.register(
+        'generic',
+        rf'^{re.escape(base)}/(?P<id>(?:video|audio)/[\w.-]+)',
+        base + '/{id}'
+    )
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
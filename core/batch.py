@@ -0,0 +1,134 @@
+import logging
+import os
+import re
+import zipfile
+from typing import Optional
+
+from core import metrics
+from core.ratelimit import guard
+from core.resolver import CANONICAL_URLS, UnsupportedURL, resolver
+from core.transfer import extractor_pool
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "50"))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "3"))
+ZIP_CHUNK_SIZE = int(os.environ.get("ZIP_CHUNK_SIZE", 1024 * 1024))
+
+
+def split_urls(text: str) -> list:
+    """Links from free text separated by whitespace or commas"""
+    return [part for part in re.split(r'[\s,]+', text) if part]
+
+
+def expand_playlist(url: str, platform: str, limit: int = MAX_BATCH_ITEMS) -> list:
+    """Video links of a playlist, read with a flat extraction (no per-video requests)"""
+    params = {
+        'quiet': True,
+        'extract_flat': 'in_playlist',
+        'playlistend': limit,
+    }
+
+    def extract():
+        with extractor_pool.acquire(platform, params) as ydl, metrics.stage('extract_info', platform):
+            return ydl.extract_info(url, download=False)
+
+    info = guard.call(platform, extract)
+    urls = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        link = entry.get('webpage_url') or entry.get('url')
+        if (not link or '://' not in link) and entry.get('id') and platform in CANONICAL_URLS:
+            link = CANONICAL_URLS[platform].format(id=entry['id'])
+        if link:
+            urls.append(link)
+    return urls[:limit]
+
+
+def collect(urls: list, limit: int = MAX_BATCH_ITEMS) -> tuple[list, list]:
+    """Expand playlists and resolve links for a batch; blocks on network I/O.
+
+    Returns ([Resolved], [(url, error)]) with duplicates dropped and at most
+    limit videos kept.
+    """
+    resolved, failed, seen = [], [], set()
+    for url in urls:
+        if len(resolved) >= limit:
+            break
+        platform = resolver.match_playlist(url)
+        try:
+            links = expand_playlist(url, platform, limit - len(resolved)) if platform else [url]
+        except Exception as e:
+            logger.error(f"Playlist expansion failed for {url}: {str(e)}")
+            failed.append((url, f"Не вдалося отримати плейлист: {str(e)}"))
+            continue
+        for link in links:
+            try:
+                item = resolver.resolve(link)
+            except UnsupportedURL as e:
+                failed.append((link, str(e)))
+                continue
+            if item.key not in seen and len(resolved) < limit:
+                seen.add(item.key)
+                resolved.append(item)
+    return resolved, failed
+
+
+class _Sink:
+    """Write-only file object collecting what ZipFile writes until it is taken"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+class ZipStream:
+    """ZIP archive produced piece by piece, for sending while it is being built.
+
+    The output has no tell/seek, so zipfile writes data descriptors after
+    every entry and nothing is buffered beyond one chunk. Media is already
+    compressed, so entries are stored as-is.
+    """
+
+    def __init__(self, chunk_size: int = ZIP_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True)
+
+    def add_file(self, name: str, path: str):
+        """Yield the archive bytes for one file as it is read"""
+        info = zipfile.ZipInfo.from_file(path, name)
+        info.compress_type = zipfile.ZIP_STORED
+        with open(path, 'rb') as src, self._zip.open(info, 'w') as dest:
+            while True:
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+                dest.write(chunk)
+                yield self._sink.take()
+        yield self._sink.take()
+
+    def add_bytes(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(name, data)
+        return self._sink.take()
+
+    def close(self) -> bytes:
+        """The central directory; the archive is complete after this"""
+        self._zip.close()
+        return self._sink.take()
+
+
+def archive_name(index: int, filename: Optional[str]) -> str:
+    """Entry name keeping the batch order and unique even when titles repeat"""
+    return f"{index:03d} - {filename or 'video'}"
@@ -0,0 +1,522 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import NamedTuple, Optional
+
+from core.media_cache import MediaCache
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Unset: every front end downloads in its own process
+BROKER_URL = os.environ.get("BROKER_URL", "")
+BROKER_VISIBILITY_TIMEOUT = float(os.environ.get("BROKER_VISIBILITY_TIMEOUT", "60"))
+BROKER_MAX_DELIVERIES = int(os.environ.get("BROKER_MAX_DELIVERIES", "3"))
+BROKER_POLL_INTERVAL = float(os.environ.get("BROKER_POLL_INTERVAL", "0.5"))
+BROKER_RETENTION = float(os.environ.get("BROKER_RETENTION", "3600"))
+RESULT_STORE_DIR = os.environ.get("RESULT_STORE_DIR", os.path.join(REPO_DIR, "results"))
+RESULT_STORE_MAX_BYTES = int(os.environ.get("RESULT_STORE_MAX_BYTES", 10 * 1024 ** 3))
+RESULT_TTL = float(os.environ.get("RESULT_TTL", "3600"))
+
+DOWNLOAD_QUEUE = 'downloads'
+ACTIVE_STATES = ('queued', 'reserved')
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+EXPIRED_ERROR = "Завантаження перервано"
+
+
+class BrokerError(Exception):
+    pass
+
+
+class Message(NamedTuple):
+    id: str
+    queue: str
+    payload: dict
+    attempts: int
+
+
+def result_store() -> MediaCache:
+    """Where workers publish finished files, keyed by message id; must be shared with the front ends"""
+    return MediaCache(RESULT_STORE_DIR, max_bytes=RESULT_STORE_MAX_BYTES, max_age=RESULT_TTL)
+
+
+def from_url(url: str = BROKER_URL):
+    """sqlite:///relative/path, sqlite:////absolute/path or redis://host:port/db"""
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker(url)
+    raise BrokerError(f"Unsupported broker URL: {url}")
+
+
+async def wait_for(broker, message_id: str, on_progress=None, interval: float = BROKER_POLL_INTERVAL) -> dict:
+    """Poll a message until it finishes; on_progress(record) is awaited whenever it changes"""
+    last = None
+    while True:
+        record = await asyncio.to_thread(broker.status, message_id)
+        if record is None:
+            raise BrokerError("Завдання не знайдено")
+        if record['state'] in FINISHED_STATES:
+            return record
+        if on_progress and (record['state'], record['position'], record['progress']) != last:
+            last = (record['state'], record['position'], record['progress'])
+            await on_progress(record)
+        await asyncio.sleep(interval)
+
+
+class SQLiteBroker:
+    """Work queue in a SQLite file, for one host or a shared volume with working file locks.
+
+    A worker reserve()s a message for visibility_timeout seconds and extends
+    the reservation with heartbeat() while it works on it. A reservation that
+    runs out (the worker died or hung) makes the message deliverable again;
+    after max_deliveries attempts it fails instead. Messages enqueued with a
+    key that is already queued or reserved are coalesced: the existing one
+    gains a reference and cancel() only stops it once every reference is gone.
+    """
+
+    def __init__(self, path: str, visibility_timeout: float = BROKER_VISIBILITY_TIMEOUT,
+                 max_deliveries: int = BROKER_MAX_DELIVERIES):
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "id TEXT NOT NULL UNIQUE, "
+                "queue TEXT NOT NULL, "
+                "key TEXT, "
+                "priority INTEGER NOT NULL DEFAULT 0, "
+                "payload TEXT NOT NULL, "
+                "state TEXT NOT NULL, "
+                "refs INTEGER NOT NULL DEFAULT 1, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "owner TEXT, "
+                "visible_at REAL, "
+                "progress TEXT, "
+                "result TEXT, "
+                "error TEXT, "
+                "created_at REAL NOT NULL, "
+                "updated_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_ready ON messages (queue, state, priority, seq)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS messages_key ON messages (queue, key, state)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "id TEXT PRIMARY KEY, "
+                "heartbeat REAL NOT NULL)"
+            )
+
+    def _immediate(self, work):
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two processes never claim the same message
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    def enqueue(self, queue: str, payload: dict, priority: int = 0, key: str = None) -> str:
+        """Queue a message, or join the active one with the same key; returns the message id"""
+        data = json.dumps(payload)
+
+        def work():
+            if key is not None:
+                row = self._conn.execute(
+                    "SELECT id FROM messages WHERE queue = ? AND key = ? AND state IN (?, ?)",
+                    (queue, key, *ACTIVE_STATES)
+                ).fetchone()
+                if row:
+                    self._conn.execute("UPDATE messages SET refs = refs + 1 WHERE id = ?", (row['id'],))
+                    return row['id']
+            message_id = uuid.uuid4().hex
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO messages (id, queue, key, priority, payload, state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (message_id, queue, key, priority, data, now, now)
+            )
+            return message_id
+
+        return self._immediate(work)
+
+    def reserve(self, queue: str, worker_id: str) -> Optional[Message]:
+        """Take the next deliverable message for visibility_timeout seconds, None if there is none"""
+
+        def work():
+            while True:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT * FROM messages WHERE queue = ? "
+                    "AND (state = 'queued' OR (state = 'reserved' AND visible_at <= ?)) "
+                    "ORDER BY priority, seq LIMIT 1",
+                    (queue, now)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row['attempts'] >= self.max_deliveries:
+                    logger.warning(f"Message {row['id']} failed after {row['attempts']} deliveries")
+                    self._conn.execute(
+                        "UPDATE messages SET state = 'failed', error = ?, owner = NULL, updated_at = ? WHERE id = ?",
+                        (EXPIRED_ERROR, now, row['id'])
+                    )
+                    continue
+                if row['state'] == 'reserved':
+                    logger.info(f"Redelivering message {row['id']}: {row['owner']} stopped heartbeating")
+                self._conn.execute(
+                    "UPDATE messages SET state = 'reserved', owner = ?, attempts = attempts + 1, "
+                    "visible_at = ?, updated_at = ? WHERE id = ?",
+                    (worker_id, now + self.visibility_timeout, now, row['id'])
+                )
+                return Message(row['id'], row['queue'], json.loads(row['payload']), row['attempts'] + 1)
+
+        return self._immediate(work)
+
+    def heartbeat(self, worker_id: str, message_ids: list) -> set:
+        """Extend the worker's reservations; returns the ids it no longer holds (cancelled or redelivered)"""
+        now = time.time()
+        lost = set()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO workers (id, heartbeat) VALUES (?, ?)",
+                (worker_id, now)
+            )
+            for message_id in message_ids:
+                updated = self._conn.execute(
+                    "UPDATE messages SET visible_at = ? WHERE id = ? AND owner = ? AND state = 'reserved'",
+                    (now + self.visibility_timeout, message_id, worker_id)
+                ).rowcount
+                if not updated:
+                    lost.add(message_id)
+        return lost
+
+    def remove_worker(self, worker_id: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def _update_owned(self, message_id: str, worker_id: str, **fields) -> bool:
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            return self._conn.execute(
+                f"UPDATE messages SET {assignments} WHERE id = ? AND owner = ? AND state = 'reserved'",
+                (*fields.values(), message_id, worker_id)
+            ).rowcount > 0
+
+    def progress(self, message_id: str, worker_id: str, event: dict) -> bool:
+        """Store the latest progress event; False once the worker no longer holds the message"""
+        return self._update_owned(message_id, worker_id, progress=json.dumps(event))
+
+    def complete(self, message_id: str, worker_id: str, result: dict) -> bool:
+        return self._update_owned(message_id, worker_id, state='done', result=json.dumps(result))
+
+    def fail(self, message_id: str, worker_id: str, error: str) -> bool:
+        return self._update_owned(message_id, worker_id, state='failed', error=error)
+
+    def cancel(self, message_id: str) -> bool:
+        """Drop one reference; the last one cancels a message that has not finished"""
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE messages SET refs = refs - 1 WHERE id = ?", (message_id,))
+            return self._conn.execute(
+                "UPDATE messages SET state = 'cancelled', error = 'Завантаження скасовано', updated_at = ? "
+                "WHERE id = ? AND refs <= 0 AND state IN (?, ?)",
+                (time.time(), message_id, *ACTIVE_STATES)
+            ).rowcount > 0
+
+    def statuses(self, message_ids: list) -> dict:
+        """{id: record} for the messages that exist; queued ones carry their 1-based queue position"""
+        records = {}
+        with self._lock:
+            for message_id in message_ids:
+                row = self._conn.execute("SELECT * FROM messages WHERE id = ?", (message_id,)).fetchone()
+                if row is None:
+                    continue
+                position = 0
+                if row['state'] == 'queued':
+                    position = self._conn.execute(
+                        "SELECT COUNT(*) FROM messages WHERE queue = ? AND state = 'queued' "
+                        "AND (priority < ? OR (priority = ? AND seq <= ?))",
+                        (row['queue'], row['priority'], row['priority'], row['seq'])
+                    ).fetchone()[0]
+                records[message_id] = {
+                    'id': message_id,
+                    'state': row['state'],
+                    'position': position,
+                    'progress': json.loads(row['progress']) if row['progress'] else None,
+                    'result': json.loads(row['result']) if row['result'] else None,
+                    'error': row['error'],
+                    'attempts': row['attempts'],
+                    'owner': row['owner'],
+                }
+        return records
+
+    def status(self, message_id: str) -> Optional[dict]:
+        return self.statuses([message_id]).get(message_id)
+
+    def counts(self, queue: str) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) AS n FROM messages WHERE queue = ? AND state IN (?, ?) GROUP BY state",
+                (queue, *ACTIVE_STATES)
+            ).fetchall()
+        counts = dict.fromkeys(ACTIVE_STATES, 0)
+        counts.update({row['state']: row['n'] for row in rows})
+        return counts
+
+    def workers(self, stale_after: float = BROKER_VISIBILITY_TIMEOUT) -> int:
+        """Workers that sent a heartbeat within stale_after seconds"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat >= ?", (time.time() - stale_after,)
+            ).fetchone()[0]
+
+    def purge(self, retention: float = BROKER_RETENTION) -> int:
+        """Delete finished messages and silent workers older than retention seconds"""
+        deadline = time.time() - retention
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM workers WHERE heartbeat < ?", (deadline,))
+            return self._conn.execute(
+                f"DELETE FROM messages WHERE state IN ({', '.join('?' * len(FINISHED_STATES))}) AND updated_at < ?",
+                (*FINISHED_STATES, deadline)
+            ).rowcount
+
+
+# Each message is a hash m:<id>; ready ids sit in the q:<queue> sorted set by
+# priority and arrival, reserved ones in r:<queue> scored by their deadline.
+# k:<queue>:<key> points at the active message for a coalescing key.
+_REDIS_ENQUEUE = """
+local prefix, queue, key, id = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+if key ~= '' then
+  local existing = redis.call('GET', prefix .. 'k:' .. queue .. ':' .. key)
+  if existing then
+    redis.call('HINCRBY', prefix .. 'm:' .. existing, 'refs', 1)
+    return existing
+  end
+  redis.call('SET', prefix .. 'k:' .. queue .. ':' .. key, id)
+end
+redis.call('HSET', prefix .. 'm:' .. id, 'queue', queue, 'key', key, 'score', ARGV[6], 'payload', ARGV[5],
+  'state', 'queued', 'refs', 1, 'attempts', 0, 'created_at', ARGV[7], 'updated_at', ARGV[7])
+redis.call('ZADD', prefix .. 'q:' .. queue, ARGV[6], id)
+return id
+"""
+
+_REDIS_FINISH = """
+local function finish(prefix, id, state, error, now, ttl)
+  local m = prefix .. 'm:' .. id
+  local queue, key = redis.call('HGET', m, 'queue'), redis.call('HGET', m, 'key')
+  redis.call('HSET', m, 'state', state, 'updated_at', now)
+  if error ~= '' then redis.call('HSET', m, 'error', error) end
+  redis.call('ZREM', prefix .. 'q:' .. queue, id)
+  redis.call('ZREM', prefix .. 'r:' .. queue, id)
+  if key and key ~= '' and redis.call('GET', prefix .. 'k:' .. queue .. ':' .. key) == id then
+    redis.call('DEL', prefix .. 'k:' .. queue .. ':' .. key)
+  end
+  redis.call('EXPIRE', m, ttl)
+end
+"""
+
+_REDIS_RESERVE = _REDIS_FINISH + """
+local prefix, queue, worker, now = ARGV[1], ARGV[2], ARGV[3], tonumber(ARGV[4])
+local visibility, max_deliveries, ttl = tonumber(ARGV[5]), tonumber(ARGV[6]), ARGV[7]
+local q, r = prefix .. 'q:' .. queue, prefix .. 'r:' .. queue
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', r, '-inf', now)) do
+  redis.call('ZREM', r, id)
+  local m = prefix .. 'm:' .. id
+  if redis.call('HGET', m, 'state') == 'reserved' then
+    redis.call('HSET', m, 'state', 'queued', 'owner', '')
+    redis.call('ZADD', q, redis.call('HGET', m, 'score'), id)
+  end
+end
+while true do
+  local head = redis.call('ZRANGE', q, 0, 0)
+  if #head == 0 then return false end
+  local id = head[1]
+  local m = prefix .. 'm:' .. id
+  local attempts = tonumber(redis.call('HGET', m, 'attempts') or '0')
+  if attempts >= max_deliveries then
+    finish(prefix, id, 'failed', ARGV[8], now, ttl)
+  else
+    redis.call('ZREM', q, id)
+    redis.call('HSET', m, 'state', 'reserved', 'owner', worker, 'attempts', attempts + 1, 'updated_at', now)
+    redis.call('ZADD', r, now + visibility, id)
+    return {id, redis.call('HGET', m, 'payload'), attempts + 1}
+  end
+end
+"""
+
+_REDIS_UPDATE_OWNED = _REDIS_FINISH + """
+local prefix, id, worker, now, field, value, ttl = ARGV[1], ARGV[2], ARGV[3], ARGV[4], ARGV[5], ARGV[6], ARGV[7]
+local m = prefix .. 'm:' .. id
+if redis.call('HGET', m, 'state') ~= 'reserved' or redis.call('HGET', m, 'owner') ~= worker then
+  return 0
+end
+if field == 'progress' then
+  redis.call('HSET', m, 'progress', value, 'updated_at', now)
+elseif field == 'result' then
+  redis.call('HSET', m, 'result', value)
+  finish(prefix, id, 'done', '', now, ttl)
+else
+  finish(prefix, id, 'failed', value, now, ttl)
+end
+return 1
+"""
+
+_REDIS_HEARTBEAT = """
+local prefix, worker, deadline = ARGV[1], ARGV[2], ARGV[3]
+local lost = {}
+for i = 4, #ARGV do
+  local m = prefix .. 'm:' .. ARGV[i]
+  if redis.call('HGET', m, 'state') == 'reserved' and redis.call('HGET', m, 'owner') == worker then
+    redis.call('ZADD', prefix .. 'r:' .. redis.call('HGET', m, 'queue'), 'XX', deadline, ARGV[i])
+  else
+    table.insert(lost, ARGV[i])
+  end
+end
+return lost
+"""
+
+_REDIS_CANCEL = _REDIS_FINISH + """
+local prefix, id, now, ttl = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local m = prefix .. 'm:' .. id
+if redis.call('EXISTS', m) == 0 then return 0 end
+local refs = redis.call('HINCRBY', m, 'refs', -1)
+local state = redis.call('HGET', m, 'state')
+if refs > 0 or (state ~= 'queued' and state ~= 'reserved') then return 0 end
+finish(prefix, id, 'cancelled', 'Завантаження скасовано', now, ttl)
+return 1
+"""
+
+
+class RedisBroker:
+    """The SQLiteBroker protocol on Redis (or anything speaking its protocol and Lua), for many hosts.
+
+    Every state change is a Lua script, so a reservation, its redelivery
+    and coalescing by key are atomic. Finished messages expire after
+    retention seconds. Deadlines use the callers' clocks, which must be
+    roughly in sync.
+    """
+
+    def __init__(self, url: str, visibility_timeout: float = BROKER_VISIBILITY_TIMEOUT,
+                 max_deliveries: int = BROKER_MAX_DELIVERIES, retention: float = BROKER_RETENTION,
+                 prefix: str = 'videodw:'):
+        try:
+            import redis
+        except ImportError:
+            raise BrokerError("A redis:// BROKER_URL needs the redis package (pip install redis)")
+        self.visibility_timeout = visibility_timeout
+        self.max_deliveries = max_deliveries
+        self.retention = int(retention)
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._enqueue = self._redis.register_script(_REDIS_ENQUEUE)
+        self._reserve = self._redis.register_script(_REDIS_RESERVE)
+        self._update_owned = self._redis.register_script(_REDIS_UPDATE_OWNED)
+        self._heartbeat = self._redis.register_script(_REDIS_HEARTBEAT)
+        self._cancel = self._redis.register_script(_REDIS_CANCEL)
+
+    @staticmethod
+    def _score(priority: int) -> float:
+        # Priority first, then arrival in milliseconds; stays exact in a double for priorities below 900
+        return priority * 1e13 + int(time.time() * 1000)
+
+    def enqueue(self, queue: str, payload: dict, priority: int = 0, key: str = None) -> str:
+        return self._enqueue(args=[
+            self.prefix, queue, key or '', uuid.uuid4().hex, json.dumps(payload),
+            self._score(priority), time.time()
+        ])
+
+    def reserve(self, queue: str, worker_id: str) -> Optional[Message]:
+        reply = self._reserve(args=[
+            self.prefix, queue, worker_id, time.time(), self.visibility_timeout,
+            self.max_deliveries, self.retention, EXPIRED_ERROR
+        ])
+        if not reply:
+            return None
+        message_id, payload, attempts = reply
+        return Message(message_id, queue, json.loads(payload), int(attempts))
+
+    def heartbeat(self, worker_id: str, message_ids: list) -> set:
+        now = time.time()
+        self._redis.zadd(self.prefix + 'workers', {worker_id: now})
+        if not message_ids:
+            return set()
+        return set(self._heartbeat(args=[self.prefix, worker_id, now + self.visibility_timeout, *message_ids]))
+
+    def remove_worker(self, worker_id: str):
+        self._redis.zrem(self.prefix + 'workers', worker_id)
+
+    def _owned(self, message_id: str, worker_id: str, field: str, value: str) -> bool:
+        return bool(self._update_owned(args=[
+            self.prefix, message_id, worker_id, time.time(), field, value, self.retention
+        ]))
+
+    def progress(self, message_id: str, worker_id: str, event: dict) -> bool:
+        return self._owned(message_id, worker_id, 'progress', json.dumps(event))
+
+    def complete(self, message_id: str, worker_id: str, result: dict) -> bool:
+        return self._owned(message_id, worker_id, 'result', json.dumps(result))
+
+    def fail(self, message_id: str, worker_id: str, error: str) -> bool:
+        return self._owned(message_id, worker_id, 'error', error)
+
+    def cancel(self, message_id: str) -> bool:
+        return bool(self._cancel(args=[self.prefix, message_id, time.time(), self.retention]))
+
+    def statuses(self, message_ids: list) -> dict:
+        pipe = self._redis.pipeline(transaction=False)
+        for message_id in message_ids:
+            pipe.hgetall(self.prefix + 'm:' + message_id)
+        records = {}
+        queued = []
+        for message_id, row in zip(message_ids, pipe.execute()):
+            if not row:
+                continue
+            records[message_id] = {
+                'id': message_id,
+                'state': row['state'],
+                'position': 0,
+                'progress': json.loads(row['progress']) if row.get('progress') else None,
+                'result': json.loads(row['result']) if row.get('result') else None,
+                'error': row.get('error'),
+                'attempts': int(row.get('attempts', 0)),
+                'owner': row.get('owner') or None,
+            }
+            if row['state'] == 'queued':
+                queued.append((message_id, row['queue']))
+        if queued:
+            pipe = self._redis.pipeline(transaction=False)
+            for message_id, queue in queued:
+                pipe.zrank(self.prefix + 'q:' + queue, message_id)
+            for (message_id, _), rank in zip(queued, pipe.execute()):
+                records[message_id]['position'] = 0 if rank is None else rank + 1
+        return records
+
+    def status(self, message_id: str) -> Optional[dict]:
+        return self.statuses([message_id]).get(message_id)
+
+    def counts(self, queue: str) -> dict:
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.zcard(self.prefix + 'q:' + queue)
+        pipe.zcard(self.prefix + 'r:' + queue)
+        queued, reserved = pipe.execute()
+        return {'queued': queued, 'reserved': reserved}
+
+    def workers(self, stale_after: float = BROKER_VISIBILITY_TIMEOUT) -> int:
+        return self._redis.zcount(self.prefix + 'workers', time.time() - stale_after, '+inf')
+
+    def purge(self, retention: float = BROKER_RETENTION) -> int:
+        """Finished messages expire by themselves; only silent workers are dropped"""
+        return self._redis.zremrangebyscore(self.prefix + 'workers', '-inf', time.time() - retention)
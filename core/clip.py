@@ -0,0 +1,79 @@
+import math
+import os
+from typing import NamedTuple, Optional
+
+MAX_CLIP_SECONDS = float(os.environ.get("MAX_CLIP_SECONDS", "600"))
+
+
+class InvalidClip(ValueError):
+    pass
+
+
+def parse_time(value) -> Optional[float]:
+    """Seconds from 90, "90", "1:30", "01:01:30.5"; None for an empty value"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        seconds = float(value)
+    else:
+        seconds = 0.0
+        try:
+            for part in str(value).strip().split(':'):
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            raise InvalidClip(f"Невірний час: {value}")
+    if seconds < 0 or math.isnan(seconds) or math.isinf(seconds):
+        raise InvalidClip(f"Невірний час: {value}")
+    return seconds
+
+
+class Clip(NamedTuple):
+    """A time range of a video; end is None for "until the end" """
+    start: float
+    end: Optional[float]
+
+    @classmethod
+    def parse(cls, start=None, end=None) -> Optional['Clip']:
+        """Clip from user input, None when neither bound is given"""
+        start, end = parse_time(start), parse_time(end)
+        if start is None and end is None:
+            return None
+        clip = cls(start or 0.0, end)
+        if clip.end is not None and clip.end <= clip.start:
+            raise InvalidClip("Кінець фрагмента має бути пізніше за початок")
+        if clip.end is not None and clip.end - clip.start > MAX_CLIP_SECONDS:
+            raise InvalidClip(f"Фрагмент задовгий, максимум {int(MAX_CLIP_SECONDS)} с")
+        return clip
+
+    @property
+    def label(self) -> str:
+        """Stable text form, used in cache and job keys"""
+        end = 'end' if self.end is None else f'{self.end:.3f}'
+        return f'clip-{self.start:.3f}-{end}'
+
+    def bounded(self, duration: Optional[float]) -> 'Clip':
+        """The clip cut to a video's duration; raises InvalidClip if nothing is left or it is too long"""
+        end = self.end
+        if duration:
+            if self.start >= duration:
+                raise InvalidClip("Початок фрагмента за межами відео")
+            end = duration if end is None else min(end, duration)
+        if end is not None and end - self.start > MAX_CLIP_SECONDS:
+            raise InvalidClip(f"Фрагмент задовгий, максимум {int(MAX_CLIP_SECONDS)} с")
+        return Clip(self.start, end)
+
+    def ydl_options(self) -> dict:
+        """yt-dlp options that fetch only this range and cut it at exact frames.
+
+        yt-dlp hands section downloads to ffmpeg, which seeks on the stream
+        URLs before reading, so only the fragments around the range are
+        transferred; force_keyframes_at_cuts re-encodes so the cut points do
+        not snap to the surrounding keyframes.
+        """
+        from yt_dlp.utils import download_range_func
+
+        end = math.inf if self.end is None else self.end
+        return {
+            'download_ranges': download_range_func(None, [(self.start, end)]),
+            'force_keyframes_at_cuts': True,
+        }
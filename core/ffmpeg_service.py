@@ -0,0 +1,214 @@
+import asyncio
+import concurrent.futures
+import inspect
+import logging
+import os
+import shutil
+import threading
+from typing import Optional
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_TIMEOUT = int(os.environ.get("FFMPEG_TIMEOUT", "1800"))
+FFMPEG_MAX_PROCESSES = int(os.environ.get("FFMPEG_MAX_PROCESSES", str(max(1, (os.cpu_count() or 1) // 2))))
+FFMPEG_CPU_SECONDS = int(os.environ.get("FFMPEG_CPU_SECONDS", "0"))
+FFMPEG_MAX_MEMORY_MB = int(os.environ.get("FFMPEG_MAX_MEMORY_MB", "0"))
+FFMPEG_NICE = int(os.environ.get("FFMPEG_NICE", "10"))
+
+FFMPEG_RUNS_TOTAL = metrics.registry.counter('videodw_ffmpeg_runs_total', 'FFmpeg invocations by outcome', ('outcome',))
+
+
+class FFmpegError(Exception):
+    pass
+
+
+def limit_prefix() -> list:
+    """prlimit/nice wrappers for the ffmpeg command line.
+
+    The limits are applied by exec'ing these tools rather than in a
+    preexec_fn, which can deadlock the child of a multithreaded process.
+    """
+    prefix = []
+    if FFMPEG_CPU_SECONDS or FFMPEG_MAX_MEMORY_MB:
+        prlimit = shutil.which('prlimit')
+        if prlimit:
+            prefix.append(prlimit)
+            if FFMPEG_CPU_SECONDS:
+                prefix.append(f'--cpu={FFMPEG_CPU_SECONDS}')
+            if FFMPEG_MAX_MEMORY_MB:
+                prefix.append(f'--as={FFMPEG_MAX_MEMORY_MB * 1024 * 1024}')
+            prefix.append('--')
+        else:
+            logger.warning("prlimit not found: FFmpeg CPU and memory limits are not applied")
+    if FFMPEG_NICE:
+        nice = shutil.which('nice')
+        if nice:
+            prefix += [nice, '-n', str(FFMPEG_NICE)]
+        else:
+            logger.warning("nice not found: FFmpeg runs at normal priority")
+    return prefix
+
+
+class FFmpegService:
+    """Runs ffmpeg without a shell, with a process cap, limits and parsed -progress output.
+
+    The cap is process-wide: run() and stream() are for coroutines, run_sync()
+    for worker threads, and all draw from the same pool of FFMPEG_MAX_PROCESSES slots.
+    on_progress(fraction, stats) receives the share of duration encoded so far
+    (None when duration is unknown) and may be a coroutine function; if it
+    raises, ffmpeg is killed and the error propagates.
+    """
+
+    def __init__(self, max_processes: int = FFMPEG_MAX_PROCESSES, timeout: float = FFMPEG_TIMEOUT):
+        self.max_processes = max_processes
+        self.timeout = timeout
+        self.running = 0
+        self.prefix = limit_prefix() if os.name == 'posix' else []
+        self._slots = threading.BoundedSemaphore(max_processes)
+        # Coroutines wait for a slot here, never on the default executor that asyncio.to_thread shares
+        self._waiters = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_processes,
+            thread_name_prefix='ffmpeg-slot'
+        )
+        self._lock = threading.Lock()
+
+    async def _acquire(self):
+        loop = asyncio.get_running_loop()
+        waiter = loop.run_in_executor(self._waiters, self._slots.acquire)
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # The slot may still be granted to the abandoned waiter; hand it straight back
+            waiter.add_done_callback(lambda _: self._slots.release())
+            raise
+
+    async def _read_progress(self, stream, duration: Optional[float], on_progress):
+        stats = {}
+        while True:
+            line = await stream.readline()
+            if not line:
+                return
+            key, _, value = line.decode('utf-8', 'replace').strip().partition('=')
+            stats[key] = value
+            if key != 'progress' or on_progress is None:
+                continue
+            fraction = None
+            try:
+                out_time = int(stats.get('out_time_us') or stats.get('out_time_ms') or 0) / 1_000_000
+            except ValueError:
+                out_time = 0
+            if duration:
+                fraction = min(1.0, max(0.0, out_time / duration))
+            if value == 'end':
+                fraction = 1.0
+            result = on_progress(fraction, dict(stats))
+            if inspect.isawaitable(result):
+                await result
+
+    async def _execute(self, args: list, duration: Optional[float], on_progress, timeout: Optional[float]):
+        command = [*self.prefix, 'ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', '-nostats', '-progress', 'pipe:1', *args]
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stderr = asyncio.create_task(process.stderr.read())
+        with self._lock:
+            self.running += 1
+
+        async def finish():
+            await self._read_progress(process.stdout, duration, on_progress)
+            return await process.wait()
+
+        try:
+            returncode = await asyncio.wait_for(finish(), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            FFMPEG_RUNS_TOTAL.inc(outcome='timeout')
+            raise FFmpegError(f"FFmpeg перевищив ліміт часу ({timeout or self.timeout} с)")
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            FFMPEG_RUNS_TOTAL.inc(outcome='aborted')
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+            errors = (await stderr).decode('utf-8', 'replace').strip()
+
+        if returncode != 0:
+            FFMPEG_RUNS_TOTAL.inc(outcome='failed')
+            logger.error(f"FFmpeg exited with {returncode}: {errors[-2000:]}")
+            raise FFmpegError(f"FFmpeg завершився з кодом {returncode}: {errors[-300:]}")
+        FFMPEG_RUNS_TOTAL.inc(outcome='done')
+
+    async def run(self, args: list, duration: Optional[float] = None, on_progress=None,
+                  timeout: Optional[float] = None):
+        """Run `ffmpeg <args>` from a coroutine"""
+        await self._acquire()
+        try:
+            await self._execute(args, duration, on_progress, timeout)
+        finally:
+            self._slots.release()
+
+    async def stream(self, args: list, chunk_size: int = 64 * 1024):
+        """Run `ffmpeg <args>` that writes to pipe:1 and yield its output as it arrives.
+
+        The slot is held for as long as the caller reads; closing the generator kills ffmpeg.
+        """
+        await self._acquire()
+        try:
+            command = [*self.prefix, 'ffmpeg', '-hide_banner', '-nostdin', '-v', 'error', '-nostats', *args]
+            process = await asyncio.create_subprocess_exec(
+                *command,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stderr = asyncio.create_task(process.stderr.read())
+            with self._lock:
+                self.running += 1
+            try:
+                while True:
+                    chunk = await process.stdout.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+                returncode = await process.wait()
+            except BaseException:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                stderr.cancel()
+                FFMPEG_RUNS_TOTAL.inc(outcome='aborted')
+                raise
+            finally:
+                with self._lock:
+                    self.running -= 1
+        finally:
+            self._slots.release()
+
+        errors = (await stderr).decode('utf-8', 'replace').strip()
+        if returncode != 0:
+            FFMPEG_RUNS_TOTAL.inc(outcome='failed')
+            logger.error(f"FFmpeg stream exited with {returncode}: {errors[-2000:]}")
+            return
+        FFMPEG_RUNS_TOTAL.inc(outcome='done')
+
+    def run_sync(self, args: list, duration: Optional[float] = None, on_progress=None,
+                 timeout: Optional[float] = None):
+        """Run `ffmpeg <args>` from a thread that has no event loop of its own"""
+        self._slots.acquire()
+        try:
+            asyncio.run(self._execute(args, duration, on_progress, timeout))
+        finally:
+            self._slots.release()
+
+
+ffmpeg_service = FFmpegService()
+metrics.registry.gauge('videodw_ffmpeg_running', 'FFmpeg processes running').set_function(
+    lambda: ffmpeg_service.running
+)
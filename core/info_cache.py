@@ -0,0 +1,144 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class InfoCache:
+    """TTL cache of yt-dlp info dicts, in memory with an optional on-disk layer.
+
+    Cached dicts are replayed with YoutubeDL.process_ie_result, which
+    re-selects formats for the current options, so a single extraction
+    serves every format and quality of the same URL.
+    """
+
+    def __init__(self, root: Optional[str] = None, ttl: float = 1800, max_items: int = 512,
+                 max_files: int = 4096, prune_interval: float = 60):
+        self.root = root
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_files = max_files
+        self.prune_interval = prune_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._pruned_at = 0.0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        if self.root:
+            os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, default_root: Optional[str]) -> 'InfoCache':
+        return cls(
+            os.environ.get("INFO_CACHE_DIR", default_root),
+            ttl=float(os.environ.get("INFO_CACHE_TTL", 1800)),
+            max_items=int(os.environ.get("INFO_CACHE_MAX_ITEMS", 512)),
+            max_files=int(os.environ.get("INFO_CACHE_MAX_FILES", 4096)),
+        )
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, url: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(url)
+            if entry and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(url)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+
+        if self.root:
+            path = self._path(url)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                if now - entry['cached_at'] <= self.ttl:
+                    self._remember(url, entry['cached_at'], entry['info'])
+                    with self._lock:
+                        self.hits += 1
+                    return entry['info']
+                self._remove(path)
+            except (OSError, ValueError, KeyError):
+                pass
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, url: str, info: dict):
+        cached_at = time.time()
+        self._remember(url, cached_at, info)
+        if not self.root:
+            return
+        tmp_path = self._path(url) + f".{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'cached_at': cached_at, 'info': info}, f)
+            os.replace(tmp_path, self._path(url))
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Info cache write error: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if cached_at - self._pruned_at >= self.prune_interval:
+            self._pruned_at = cached_at
+            self.prune()
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            self.evictions += 1
+
+    def prune(self) -> int:
+        """Delete expired files, then the oldest ones until at most max_files are left"""
+        if not self.root:
+            return 0
+        now = time.time()
+        removed = 0
+        alive = []
+        for entry in os.scandir(self.root):
+            try:
+                modified = entry.stat().st_mtime
+            except OSError:
+                continue
+            # Files are written once, so the mtime is when they were cached; leftover .tmp files go too
+            if now - modified > self.ttl:
+                self._remove(entry.path)
+                removed += 1
+            elif entry.name.endswith('.json'):
+                alive.append((modified, entry.path))
+        for _, path in sorted(alive)[:max(0, len(alive) - self.max_files)]:
+            self._remove(path)
+            removed += 1
+        return removed
+
+    def _remember(self, url: str, cached_at: float, info: dict):
+        with self._lock:
+            self._memory[url] = (cached_at, copy.deepcopy(info))
+            self._memory.move_to_end(url)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+
+    def extract(self, ydl, url: str) -> dict:
+        """Cached equivalent of ydl.extract_info(url, download=False)"""
+        info = self.get(url)
+        if info is None:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+            self.put(url, info)
+        return info
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'items': len(self._memory), 'evictions': self.evictions}
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Optional
+
+try:
+    import fcntl
+except ImportError:
+    # Leases are flock()s; without them (Windows) eviction ignores them
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+META_FILE = 'meta.json'
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Both frontends default to this root; keys carry the format selection so their files never mix
+DEFAULT_ROOT = os.path.join(REPO_DIR, "media_cache")
+
+
+def link_or_copy(src: str, folder: str) -> str:
+    """Place src into folder as a hardlink, falling back to a copy across filesystems"""
+    os.makedirs(folder, exist_ok=True)
+    dst = os.path.join(folder, os.path.basename(src))
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+class Lease:
+    """A shared lock on a cache entry: eviction leaves the entry alone until release().
+
+    The lock belongs to an open file, so it also ends when its process dies.
+    """
+
+    def __init__(self, path: str, handle=None):
+        self.path = path
+        self._handle = handle
+
+    def release(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+    def __enter__(self) -> 'Lease':
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class MediaCache:
+    """Disk-backed store of finished media files keyed by (platform, video id, format, quality, selector).
+
+    Every entry is a directory holding the media file and a meta.json; entries
+    are published with a single rename so readers never see partial files.
+    The meta.json mtime doubles as the last-access time for LRU eviction.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 5 * 1024 ** 3, max_age: float = 24 * 3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, default_root: str = DEFAULT_ROOT) -> 'MediaCache':
+        return cls(
+            os.environ.get("MEDIA_CACHE_DIR", default_root),
+            max_bytes=int(os.environ.get("MEDIA_CACHE_MAX_BYTES", 5 * 1024 ** 3)),
+            max_age=float(os.environ.get("MEDIA_CACHE_MAX_AGE", 24 * 3600)),
+        )
+
+    @staticmethod
+    def make_key(platform: str, video_id: str, format: str, quality: str = 'best', selector: str = '') -> str:
+        """selector is the yt-dlp format selection (or encode target) that produced the file"""
+        raw = '|'.join(str(part) for part in (platform, video_id, format, quality, selector))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _read_meta(self, entry: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(entry, META_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entry_dir(key)
+        meta = self._read_meta(entry)
+        path = os.path.join(entry, meta['filename']) if meta else None
+        expired = meta is not None and time.time() - meta.get('created', 0) > self.max_age
+
+        if not path or expired or not os.path.isfile(path):
+            with self._lock:
+                self.misses += 1
+            if expired:
+                self._remove_unleased(entry)
+            return None
+
+        try:
+            os.utime(os.path.join(entry, META_FILE))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def lease(self, key: str) -> Optional[Lease]:
+        """get() that also keeps the file from being evicted until the lease is released"""
+        path = self.get(key)
+        if path is None:
+            return None
+        if fcntl is None:
+            return Lease(path)
+        try:
+            handle = open(os.path.join(self._entry_dir(key), META_FILE), 'rb')
+        except OSError:
+            return None
+        try:
+            fcntl.flock(handle, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return None
+        # Evicted between get() and the lock: the entry was renamed away
+        if not os.path.isfile(path):
+            handle.close()
+            return None
+        return Lease(path, handle)
+
+    def put(self, key: str, path: str, **meta) -> str:
+        """Publish a finished file into the cache and return the cached path"""
+        entry = self._entry_dir(key)
+        filename = os.path.basename(path)
+        tmp_dir = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_dir)
+        try:
+            link_or_copy(path, tmp_dir)
+            meta.update({
+                'filename': filename,
+                'size': os.path.getsize(path),
+                'created': time.time(),
+            })
+            with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            if os.path.exists(entry):
+                self._remove(entry)
+            os.rename(tmp_dir, entry)
+        except OSError as e:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if self._read_meta(entry) is None:
+                raise
+            logger.info(f"Cache entry {key[:12]} was published concurrently: {e}")
+        with self._lock:
+            self.stores += 1
+        self.evict()
+        meta = self._read_meta(entry)
+        if meta is None:
+            return path
+        return os.path.join(entry, meta['filename'])
+
+    def _remove(self, entry: str):
+        trash = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        try:
+            os.rename(entry, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def _remove_unleased(self, entry: str) -> bool:
+        """Remove an entry unless someone holds a lease on it"""
+        if fcntl is None:
+            self._remove(entry)
+            return True
+        try:
+            handle = open(os.path.join(entry, META_FILE), 'rb')
+        except OSError:
+            return False
+        with handle:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return False
+            self._remove(entry)
+        return True
+
+    def _entries(self):
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name.startswith('.'):
+                continue
+            for entry in os.scandir(shard.path):
+                meta = self._read_meta(entry.path)
+                if meta is None:
+                    continue
+                try:
+                    accessed = os.path.getmtime(os.path.join(entry.path, META_FILE))
+                except OSError:
+                    continue
+                yield entry.path, meta, accessed
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until under max_bytes; leased ones stay"""
+        with self._lock:
+            now = time.time()
+            freed = 0
+            alive = []
+            for entry, meta, accessed in self._entries():
+                if now - meta.get('created', 0) > self.max_age and self._remove_unleased(entry):
+                    freed += meta.get('size', 0)
+                    self.evictions += 1
+                else:
+                    alive.append((accessed, entry, meta.get('size', 0)))
+
+            total = sum(size for _, _, size in alive)
+            for _, entry, size in sorted(alive):
+                if total <= self.max_bytes:
+                    break
+                if not self._remove_unleased(entry):
+                    continue
+                total -= size
+                freed += size
+                self.evictions += 1
+            return freed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'evictions': self.evictions,
+            }
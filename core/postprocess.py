@@ -0,0 +1,163 @@
+import json
+import logging
+import os
+import struct
+import subprocess
+from typing import Optional
+
+from core.ffmpeg_service import ffmpeg_service
+
+logger = logging.getLogger(__name__)
+
+MP4_FORMAT_NAMES = {'mov', 'mp4', 'm4a', '3gp', '3g2', 'mj2'}
+COMPATIBLE_VIDEO_CODECS = {'h264'}
+COMPATIBLE_AUDIO_CODECS = {'aac', 'mp3'}
+
+# Audio output format -> codec that can be stream-copied into it, and the encoder used otherwise
+AUDIO_CODECS = {'mp3': 'mp3', 'm4a': 'aac', 'opus': 'opus'}
+AUDIO_ENCODERS = {
+    'mp3': ['-c:a', 'libmp3lame', '-b:a', '320k'],
+    'm4a': ['-c:a', 'aac', '-b:a', '192k'],
+    'opus': ['-c:a', 'libopus', '-b:a', '160k'],
+}
+
+
+def probe(path: str) -> dict:
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+        capture_output=True, check=True, timeout=60
+    )
+    return json.loads(result.stdout)
+
+
+def _stream_codec(info: dict, codec_type: str) -> Optional[str]:
+    for stream in info.get('streams', []):
+        if stream.get('codec_type') == codec_type:
+            return stream.get('codec_name')
+    return None
+
+
+def is_faststart(path: str) -> bool:
+    """True when the moov atom comes before mdat, so playback can start before the file ends"""
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return False
+            size, box_type = struct.unpack('>I4s', header)
+            if box_type == b'moov':
+                return True
+            if box_type == b'mdat':
+                return False
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0]
+                f.seek(size - 16, os.SEEK_CUR)
+            elif size == 0:
+                return False
+            else:
+                f.seek(size - 8, os.SEEK_CUR)
+
+
+def plan_mp4(info: dict, path: str) -> str:
+    """Decide what it takes to make a probed file a streamable H.264/AAC MP4.
+
+    'copy' - nothing to do, 'remux' - stream copy into MP4 with faststart,
+    'transcode' - at least one stream has to be re-encoded.
+    """
+    vcodec = _stream_codec(info, 'video')
+    acodec = _stream_codec(info, 'audio')
+    if vcodec not in COMPATIBLE_VIDEO_CODECS or (acodec and acodec not in COMPATIBLE_AUDIO_CODECS):
+        return 'transcode'
+    format_names = set(info.get('format', {}).get('format_name', '').split(','))
+    if format_names & MP4_FORMAT_NAMES and path.lower().endswith('.mp4') and is_faststart(path):
+        return 'copy'
+    return 'remux'
+
+
+def duration_of(info: dict) -> Optional[float]:
+    try:
+        return float(info.get('format', {}).get('duration')) or None
+    except (TypeError, ValueError):
+        return None
+
+
+def ensure_mp4(path: str, on_progress=None) -> tuple[str, str]:
+    """Turn a downloaded video into a compatible MP4, re-encoding only what needs it.
+
+    Returns (mp4 path, action) where action is one of plan_mp4's values.
+    Must be called from a worker thread; on_progress goes to ffmpeg_service.
+    """
+    info = probe(path)
+    action = plan_mp4(info, path)
+    if action == 'copy':
+        return path, action
+
+    output_path = os.path.splitext(path)[0] + '.mp4'
+    tmp_path = os.path.splitext(path)[0] + '.tmp.mp4'
+    args = ['-y', '-i', path, '-map', '0:v:0', '-map', '0:a:0?']
+    if action == 'remux':
+        args += ['-c', 'copy']
+    else:
+        vcodec = _stream_codec(info, 'video')
+        acodec = _stream_codec(info, 'audio')
+        args += ['-c:v', 'copy'] if vcodec in COMPATIBLE_VIDEO_CODECS else [
+            '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'
+        ]
+        args += ['-c:a', 'copy'] if acodec in COMPATIBLE_AUDIO_CODECS else ['-c:a', 'aac', '-b:a', '192k']
+    args += ['-movflags', '+faststart', tmp_path]
+
+    try:
+        ffmpeg_service.run_sync(args, duration=duration_of(info), on_progress=on_progress)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+    if output_path != path:
+        os.remove(path)
+    logger.info(f"{os.path.basename(output_path)}: {action}")
+    return output_path, action
+
+
+def plan_audio(info: dict, path: str, format: str) -> str:
+    """Like plan_mp4 for an audio-only output: 'copy', 'remux' (stream copy) or 'transcode'"""
+    acodec = _stream_codec(info, 'audio')
+    if acodec is None:
+        raise ValueError("No audio stream in the downloaded file")
+    if acodec != AUDIO_CODECS[format]:
+        return 'transcode'
+    if _stream_codec(info, 'video') is None and path.lower().endswith(f'.{format}'):
+        return 'copy'
+    return 'remux'
+
+
+def ensure_audio(path: str, format: str, on_progress=None) -> tuple[str, str]:
+    """Turn a downloaded file into an audio-only mp3/m4a/opus file, re-encoding only if the codec differs.
+
+    Returns (audio path, action) where action is one of plan_audio's values.
+    Must be called from a worker thread; on_progress goes to ffmpeg_service.
+    """
+    info = probe(path)
+    action = plan_audio(info, path, format)
+    if action == 'copy':
+        return path, action
+
+    output_path = f"{os.path.splitext(path)[0]}.{format}"
+    tmp_path = f"{os.path.splitext(path)[0]}.tmp.{format}"
+    args = ['-y', '-i', path, '-map', '0:a:0', '-vn', '-sn', '-dn']
+    args += ['-c:a', 'copy'] if action == 'remux' else AUDIO_ENCODERS[format]
+    if format == 'm4a':
+        args += ['-movflags', '+faststart']
+    args.append(tmp_path)
+
+    try:
+        ffmpeg_service.run_sync(args, duration=duration_of(info), on_progress=on_progress)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+    if output_path != path:
+        os.remove(path)
+    logger.info(f"{os.path.basename(output_path)}: {action}")
+    return output_path, action
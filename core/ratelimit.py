@@ -0,0 +1,278 @@
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "videodw-ratelimit.sqlite3"))
+RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", "4"))
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "30"))
+RATE_LIMIT_WAIT = float(os.environ.get("RATE_LIMIT_WAIT", "30"))
+BREAKER_WINDOW = float(os.environ.get("BREAKER_WINDOW", "60"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATIO = float(os.environ.get("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", "60"))
+
+# Checked in this order: platforms answer throttling with 429 and often with 403
+THROTTLED_MARKERS = ('http error 429', 'too many requests', 'rate-limit', 'rate limit', 'ratelimit', 'http error 403')
+TRANSIENT_MARKERS = ('http error 5', 'service unavailable', 'timed out', 'connection reset', 'temporarily')
+PERMANENT_MARKERS = (
+    'unsupported url', 'private', 'not available', 'video unavailable', 'removed', 'deleted',
+    'login required', 'log in', 'sign in', 'copyright', '404', 'not found', 'no video formats',
+    'requested format', 'cancel', 'скасовано',
+)
+# Matched by class name so core needs neither yt-dlp nor the backend's job engine
+CANCELLED_ERRORS = ('DownloadCancelled', 'JobCancelled')
+
+RETRIES_TOTAL = metrics.registry.counter(
+    'videodw_retries_total', 'Retried platform calls by failure kind', ('platform', 'kind')
+)
+CIRCUIT_OPEN_TOTAL = metrics.registry.counter(
+    'videodw_circuit_open_total', 'Times a platform circuit breaker opened', ('platform',)
+)
+
+
+def parse_rates(value: str) -> dict:
+    """Parse "instagram=0.5/5,tiktok=1/10" into {'instagram': (0.5, 5.0), ...} (tokens per second / burst)"""
+    rates = {}
+    for item in value.split(','):
+        if '=' not in item:
+            continue
+        name, spec = item.split('=', 1)
+        rate, _, burst = spec.partition('/')
+        rates[name.strip()] = (float(rate), float(burst or rate))
+    return rates
+
+PLATFORM_RATES = parse_rates(os.environ.get("PLATFORM_RATE_LIMITS", "instagram=0.5/5,tiktok=1/10,youtube=2/20"))
+
+
+class RateLimited(Exception):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def classify(error: Exception) -> str:
+    """'throttled', 'permanent' or 'transient' for an extraction/download error"""
+    message = str(error).lower()
+    if getattr(error, 'code', None) in (403, 429) or any(marker in message for marker in THROTTLED_MARKERS):
+        return 'throttled'
+    if isinstance(error, (RateLimited, CircuitOpen)):
+        return 'permanent'
+    if any(marker in message for marker in TRANSIENT_MARKERS):
+        return 'transient'
+    if any(marker in message for marker in PERMANENT_MARKERS):
+        return 'permanent'
+    return 'transient'
+
+
+def is_cancellation(error: Exception, cancelled=None) -> bool:
+    """True when the call was stopped by its user rather than failed by the platform"""
+    if any(cls.__name__ in CANCELLED_ERRORS for cls in type(error).__mro__):
+        return True
+    return bool(cancelled and cancelled())
+
+
+class TokenBucket:
+    """Token buckets in SQLite, shared by every process on the host (web workers and the bot)"""
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "name TEXT PRIMARY KEY, "
+            "tokens REAL NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+
+    def _take(self, name: str, rate: float, burst: float) -> float:
+        """Take a token if there is one; otherwise return the seconds until there will be"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                now = time.time()
+                tokens = burst if row is None else min(burst, row[0] + max(0.0, now - row[1]) * rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / rate
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (name, tokens, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def acquire(self, name: str, rate: float, burst: float, timeout: float = RATE_LIMIT_WAIT) -> float:
+        """Block until a token is available; returns the time spent waiting"""
+        started = time.monotonic()
+        while True:
+            wait = self._take(name, rate, burst)
+            if wait == 0:
+                return time.monotonic() - started
+            if time.monotonic() - started + wait > timeout:
+                raise RateLimited("Забагато запитів до платформи, спробуйте пізніше")
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Opens when the failure ratio over the last window is too high.
+
+    While open every call is refused; after cooldown a single trial call is
+    let through (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, window: float = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_ratio: float = BREAKER_FAILURE_RATIO, cooldown: float = BREAKER_COOLDOWN):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self._calls = deque()
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == 'open' and time.monotonic() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half-open'
+                self._trial = False
+            if self.state == 'half-open' and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def release(self):
+        """Give back a half-open trial that ended without an answer from the platform"""
+        with self._lock:
+            if self.state == 'half-open':
+                self._trial = False
+
+    def record(self, success: bool) -> bool:
+        """Record an outcome; True when this call opened the breaker"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == 'half-open':
+                self._calls.clear()
+                if success:
+                    self.state = 'closed'
+                    return False
+                self.state, self.opened_at = 'open', now
+                return True
+            self._calls.append((now, success))
+            self._trim(now)
+            failures = sum(1 for _, ok in self._calls if not ok)
+            if (self.state == 'closed' and len(self._calls) >= self.min_calls
+                    and failures / len(self._calls) >= self.failure_ratio):
+                self.state, self.opened_at = 'open', now
+                self._calls.clear()
+                return True
+            return False
+
+
+class PlatformGuard:
+    """Rate limiting, circuit breaking and classified retries around platform calls"""
+
+    def __init__(self, bucket: TokenBucket = None, rates: dict = None, attempts: int = RETRY_ATTEMPTS,
+                 base_delay: float = RETRY_BASE_DELAY, max_delay: float = RETRY_MAX_DELAY):
+        self.bucket = bucket
+        self.rates = PLATFORM_RATES if rates is None else rates
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, platform: str) -> CircuitBreaker:
+        with self._lock:
+            if platform not in self._breakers:
+                self._breakers[platform] = CircuitBreaker()
+            return self._breakers[platform]
+
+    def is_open(self, platform: str) -> bool:
+        return self.breaker(platform).is_open
+
+    def _limit(self, platform: str):
+        if platform not in self.rates:
+            return
+        if self.bucket is None:
+            self.bucket = TokenBucket()
+        rate, burst = self.rates[platform]
+        self.bucket.acquire(platform, rate, burst)
+
+    def backoff(self, attempt: int, kind: str) -> float:
+        """Full-jitter exponential backoff; throttling backs off harder"""
+        ceiling = self.base_delay * (2 ** attempt) * (4 if kind == 'throttled' else 1)
+        return random.uniform(0, min(self.max_delay, ceiling))
+
+    def call(self, platform: str, func, *args, cancelled=None, **kwargs):
+        """func(*args, **kwargs) with rate limiting, circuit breaking and retries of non-permanent errors"""
+        breaker = self.breaker(platform)
+        for attempt in range(self.attempts):
+            if not breaker.allow():
+                raise CircuitOpen("Платформа тимчасово недоступна, спробуйте пізніше")
+            try:
+                self._limit(platform)
+            except BaseException:
+                # Never reached the platform: a half-open trial must stay available
+                breaker.release()
+                raise
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if is_cancellation(e, cancelled):
+                    # Says nothing about the platform: neither a success nor a failure
+                    breaker.release()
+                    raise
+                kind = classify(e)
+                # A permanent error is still an answer from the platform, not a sign of trouble
+                if breaker.record(kind == 'permanent'):
+                    CIRCUIT_OPEN_TOTAL.inc(platform=platform)
+                    logger.warning(f"Circuit opened for {platform}: {str(e)}")
+                if kind == 'permanent' or attempt == self.attempts - 1 or (cancelled and cancelled()):
+                    raise
+                delay = self.backoff(attempt, kind)
+                RETRIES_TOTAL.inc(platform=platform, kind=kind)
+                logger.warning(f"{platform} call failed ({kind}), retry {attempt + 1} in {delay:.1f}s: {str(e)}")
+                time.sleep(delay)
+            except BaseException:
+                breaker.release()
+                raise
+            else:
+                breaker.record(True)
+                return result
+
+
+guard = PlatformGuard()
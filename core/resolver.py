@@ -0,0 +1,197 @@
+import http.client
+import logging
+import re
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+
+# Links that already carry the video id
+DIRECT_PATTERNS = [
+    ('youtube', re.compile(
+        r'^(?:https?://)?(?:(?:www|m|music)\.)?youtube\.com/watch\?(?:.*&)?v=(?P<id>[\w-]{11})', re.I)),
+    ('youtube', re.compile(
+        r'^(?:https?://)?(?:(?:www|m|music)\.)?youtube\.com/(?:shorts|embed|live|v)/(?P<id>[\w-]{11})', re.I)),
+    ('youtube', re.compile(r'^(?:https?://)?youtu\.be/(?P<id>[\w-]{11})', re.I)),
+    ('instagram', re.compile(
+        r'^(?:https?://)?(?:www\.)?instagram\.com/(?:(?!share/)[\w.]+/)?(?:p|reels?|tv)/(?P<id>[\w-]+)', re.I)),
+    ('tiktok', re.compile(
+        r'^(?:https?://)?(?:www\.|m\.)?tiktok\.com/(?:@[\w.-]*/video|embed(?:/v2)?|v)/(?P<id>\d+)', re.I)),
+]
+
+# Links that have to be expanded by following redirects first
+SHORT_LINK_PATTERNS = [
+    ('tiktok', re.compile(r'^(?:https?://)?(?:vm|vt)\.tiktok\.com/[\w-]+', re.I)),
+    ('tiktok', re.compile(r'^(?:https?://)?(?:www\.|m\.)?tiktok\.com/t/[\w-]+', re.I)),
+    ('instagram', re.compile(r'^(?:https?://)?(?:www\.)?instagram\.com/share/(?:reels?/|p/)?[\w-]+', re.I)),
+]
+
+# Playlist pages; batches expand them into their videos
+PLAYLIST_PATTERNS = [
+    ('youtube', re.compile(
+        r'^(?:https?://)?(?:(?:www|m|music)\.)?youtube\.com/playlist\?(?:.*&)?list=(?P<id>[\w-]+)', re.I)),
+]
+
+CANONICAL_URLS = {
+    'youtube': 'https://www.youtube.com/watch?v={id}',
+    'instagram': 'https://www.instagram.com/p/{id}/',
+    'tiktok': 'https://www.tiktok.com/@_/video/{id}',
+}
+
+
+class UnsupportedURL(ValueError):
+    pass
+
+
+class Resolved(NamedTuple):
+    platform: str
+    video_id: str
+    canonical_url: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.platform}:{self.video_id}"
+
+
+class ShortLinkExpander:
+    """Follows short-link redirects over pooled keep-alive connections and caches the result"""
+
+    def __init__(self, ttl: float = 24 * 3600, max_items: int = 4096, max_redirects: int = 5, timeout: float = 10):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_redirects = max_redirects
+        self.timeout = timeout
+        self._cache = OrderedDict()
+        self._pool = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme: str, host: str):
+        with self._lock:
+            idle = self._pool.get((scheme, host))
+            if idle:
+                return idle.pop()
+        cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return cls(host, timeout=self.timeout)
+
+    def _release(self, scheme: str, host: str, conn):
+        with self._lock:
+            idle = self._pool.setdefault((scheme, host), [])
+            if len(idle) < 4:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def _location(self, url: str) -> Optional[str]:
+        parts = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        conn = self._connection(parts.scheme, parts.netloc)
+        try:
+            conn.request('HEAD', path, headers={'User-Agent': USER_AGENT})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+        location = response.getheader('Location')
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(parts.scheme, parts.netloc, conn)
+        if response.status in (301, 302, 303, 307, 308) and location:
+            return urllib.parse.urljoin(url, location)
+        return None
+
+    def expand(self, url: str) -> str:
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(url)
+            if cached and now - cached[0] <= self.ttl:
+                self._cache.move_to_end(url)
+                return cached[1]
+
+        target = url if '://' in url else f"https://{url}"
+        for _ in range(self.max_redirects):
+            location = self._location(target)
+            if not location:
+                break
+            target = location
+            if any(pattern.match(target) for _, pattern in DIRECT_PATTERNS):
+                break
+
+        with self._lock:
+            self._cache[url] = (now, target)
+            while len(self._cache) > self.max_items:
+                self._cache.popitem(last=False)
+        return target
+
+
+class StaticExpander:
+    """Offline stand-in for ShortLinkExpander backed by a fixed mapping"""
+
+    def __init__(self, mapping: Optional[dict] = None):
+        self.mapping = dict(mapping or {})
+
+    def expand(self, url: str) -> str:
+        return self.mapping.get(url, url)
+
+
+class Resolver:
+    """Turns any supported link into (platform, video_id, canonical_url)"""
+
+    def __init__(self, expander=None):
+        self.expander = expander or ShortLinkExpander()
+        self.direct_patterns = list(DIRECT_PATTERNS)
+        self.canonical_urls = dict(CANONICAL_URLS)
+
+    def register(self, platform: str, pattern, canonical_url: str):
+        """Accept direct links matching pattern (with an `id` group) as platform, e.g. a benchmark origin"""
+        self.direct_patterns.append((platform, re.compile(pattern) if isinstance(pattern, str) else pattern))
+        self.canonical_urls[platform] = canonical_url
+
+    def _parse(self, url: str) -> Optional[Resolved]:
+        for platform, pattern in self.direct_patterns:
+            match = pattern.match(url)
+            if match:
+                video_id = match.group('id')
+                return Resolved(platform, video_id, self.canonical_urls[platform].format(id=video_id))
+        return None
+
+    def match(self, url: str) -> Optional[str]:
+        """Platform of a supported link, without any network access"""
+        url = url.strip()
+        for platform, pattern in self.direct_patterns + SHORT_LINK_PATTERNS:
+            if pattern.match(url):
+                return platform
+        return None
+
+    def match_playlist(self, url: str) -> Optional[str]:
+        """Platform of a playlist link, without any network access"""
+        url = url.strip()
+        for platform, pattern in PLAYLIST_PATTERNS:
+            if pattern.match(url):
+                return platform
+        return None
+
+    def resolve(self, url: str) -> Resolved:
+        """May block on network I/O for short links"""
+        url = url.strip()
+        resolved = self._parse(url)
+        if resolved:
+            return resolved
+        if any(pattern.match(url) for _, pattern in SHORT_LINK_PATTERNS):
+            try:
+                resolved = self._parse(self.expander.expand(url))
+            except (OSError, http.client.HTTPException) as e:
+                logger.error(f"Short link expansion failed for {url}: {str(e)}")
+                raise UnsupportedURL(f"Не вдалося розгорнути коротке посилання: {url}")
+            if resolved:
+                return resolved
+        raise UnsupportedURL(f"Непідтримуване посилання: {url}")
+
+
+resolver = Resolver()
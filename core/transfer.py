@@ -0,0 +1,188 @@
+import concurrent.futures
+import contextlib
+import copy
+import json
+import logging
+import os
+import threading
+from typing import Optional
+
+from core import metrics
+from core.ffmpeg_service import ffmpeg_service
+
+logger = logging.getLogger(__name__)
+
+CONCURRENT_FRAGMENTS = int(os.environ.get("CONCURRENT_FRAGMENTS", "8"))
+HTTP_CHUNK_SIZE = int(os.environ.get("HTTP_CHUNK_SIZE", 10 * 1024 * 1024))
+DOWNLOAD_BUFFER_SIZE = int(os.environ.get("DOWNLOAD_BUFFER_SIZE", 1024 * 1024))
+PARALLEL_STREAMS = os.environ.get("PARALLEL_STREAMS", "1") != "0"
+EXTRACTOR_POOL_SIZE = int(os.environ.get("EXTRACTOR_POOL_SIZE", "4"))
+
+MP4_EXTENSIONS = {'mp4', 'm4a', 'mov'}
+
+
+def expected_size(info: dict) -> Optional[int]:
+    """Total size of the selected format(s), None when any part is unknown"""
+    formats = info.get('requested_formats') or [info]
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in formats]
+    if not all(sizes):
+        return None
+    return int(sum(sizes))
+
+
+def transfer_options(size: Optional[int] = None) -> dict:
+    """yt-dlp options for fragment concurrency, buffering and HTTP chunking.
+
+    Plain HTTP formats are fetched in HTTP_CHUNK_SIZE range requests (which
+    also sidesteps per-connection throttling); files smaller than two chunks
+    go in a single request.
+    """
+    opts = {
+        'concurrent_fragment_downloads': CONCURRENT_FRAGMENTS,
+        'buffersize': DOWNLOAD_BUFFER_SIZE,
+        'retries': 10,
+        'fragment_retries': 10,
+    }
+    if HTTP_CHUNK_SIZE and not (size and size < HTTP_CHUNK_SIZE * 2):
+        opts['http_chunk_size'] = HTTP_CHUNK_SIZE
+    return opts
+
+
+class ExtractorPool:
+    """Reusable YoutubeDL instances for metadata extraction.
+
+    Extraction does several round trips to the platform (web page, API,
+    player); keeping instances per platform keeps their HTTP connections
+    and cookies warm across jobs. An instance is used by one thread at a
+    time and is discarded after a failed extraction.
+    """
+
+    def __init__(self, max_idle: int = EXTRACTOR_POOL_SIZE):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self, platform: str, params: dict):
+        import yt_dlp
+
+        key = (platform, json.dumps(params, sort_keys=True, default=str))
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            ydl = idle.pop() if idle else None
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(dict(params))
+
+        reusable = False
+        try:
+            yield ydl
+            reusable = True
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if reusable and len(idle) < self.max_idle:
+                    idle.append(ydl)
+                    ydl = None
+            if ydl is not None:
+                ydl.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._idle = list(self._idle.values()), {}
+        for idle in pools:
+            for ydl in idle:
+                ydl.close()
+
+
+def _merge(parts: list, formats: list, output_path: str):
+    args = ['-y']
+    for part in parts:
+        args += ['-i', part]
+    for index, fmt in enumerate(formats):
+        stream = 'a' if (fmt.get('vcodec') or 'none') == 'none' else 'v'
+        args += ['-map', f'{index}:{stream}:0']
+    args += ['-c', 'copy']
+    if os.path.splitext(output_path)[1].lstrip('.').lower() in MP4_EXTENSIONS:
+        args += ['-movflags', '+faststart']
+    tmp_path = f"{os.path.splitext(output_path)[0]}.merge{os.path.splitext(output_path)[1]}"
+    try:
+        ffmpeg_service.run_sync(args + [tmp_path])
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
+
+
+def _download_parallel(opts: dict, info: dict, selected: dict, platform: str) -> dict:
+    import yt_dlp
+
+    formats = selected['requested_formats']
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        output_path = ydl.prepare_filename(selected)
+    # The base name goes back into an output template, so % must be escaped
+    base = os.path.splitext(output_path)[0].replace('%', '%%')
+    failed = threading.Event()
+
+    def abort_hook(d):
+        if failed.is_set():
+            raise yt_dlp.utils.DownloadCancelled("Паралельне завантаження перервано")
+
+    def fetch(fmt):
+        part_opts = dict(
+            opts,
+            format=fmt['format_id'],
+            outtmpl=f"{base}.f{fmt['format_id']}.%(ext)s",
+            postprocessors=[],
+            progress_hooks=list(opts.get('progress_hooks', [])) + [abort_hook],
+        )
+        try:
+            with yt_dlp.YoutubeDL(part_opts) as ydl:
+                result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+            return result['requested_downloads'][0]['filepath']
+        except Exception:
+            failed.set()
+            raise
+
+    parts = []
+    try:
+        with concurrent.futures.ThreadPoolExecutor(len(formats), thread_name_prefix='stream') as pool:
+            futures = [pool.submit(fetch, fmt) for fmt in formats]
+            parts = [future.result() for future in futures]
+        with metrics.stage('merge', platform) as merge:
+            _merge(parts, formats, output_path)
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+    # Callers timing the whole download subtract this; the merge is its own stage
+    return dict(
+        selected, filepath=output_path, requested_downloads=[dict(selected, filepath=output_path)],
+        merge_seconds=merge.elapsed
+    )
+
+
+def download(ydl_opts: dict, info: dict, platform: str = '') -> dict:
+    """Tuned equivalent of YoutubeDL(ydl_opts).process_ie_result(info, download=True).
+
+    When the format selection needs separate video and audio streams and no
+    yt-dlp postprocessors are configured, both streams are fetched at the
+    same time and stream-copied together with ffmpeg.
+    """
+    import yt_dlp
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        selected = ydl.process_ie_result(copy.deepcopy(info), download=False)
+    opts = dict(ydl_opts, **transfer_options(expected_size(selected)))
+
+    formats = selected.get('requested_formats') or []
+    # Section downloads (clips) already go through one ffmpeg process that reads every stream
+    if PARALLEL_STREAMS and len(formats) > 1 and not opts.get('postprocessors') and not opts.get('download_ranges'):
+        return _download_parallel(opts, info, selected, platform)
+
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.process_ie_result(copy.deepcopy(info), download=True)
+
+
+extractor_pool = ExtractorPool()
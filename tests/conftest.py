@@ -0,0 +1,7 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+# Backend modules import each other as top-level modules (from jobs import ...)
+sys.path.insert(0, os.path.join(REPO_DIR, 'WebSite', 'backend'))
@@ -0,0 +1,28 @@
+import io
+import zipfile
+
+from core.batch import ZipStream, archive_name, split_urls
+
+
+def test_zip_stream_builds_a_valid_archive(tmp_path):
+    media = tmp_path / 'video.mp4'
+    media.write_bytes(bytes(range(256)) * 40)
+    archive = ZipStream(chunk_size=1000)
+
+    chunks = list(archive.add_file(archive_name(1, 'video.mp4'), str(media)))
+    chunks.append(archive.add_bytes('errors.txt', 'посилання: помилка'.encode('utf-8')))
+    chunks.append(archive.close())
+
+    # Read as it is produced: more than one piece, none larger than a chunk plus headers
+    assert len(chunks) > 5
+    assert max(len(chunk) for chunk in chunks) < 2000
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as result:
+        assert result.namelist() == ['001 - video.mp4', 'errors.txt']
+        assert result.read('001 - video.mp4') == media.read_bytes()
+        assert result.getinfo('001 - video.mp4').compress_type == zipfile.ZIP_STORED
+        assert result.read('errors.txt').decode('utf-8') == 'посилання: помилка'
+        assert result.testzip() is None
+
+
+def test_split_urls():
+    assert split_urls(' https://a/1, https://a/2\nhttps://a/3 ') == ['https://a/1', 'https://a/2', 'https://a/3']
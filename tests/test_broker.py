@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+
+from core.broker import DOWNLOAD_QUEUE, SQLiteBroker
+from core.media_cache import MediaCache
+
+
+def make_broker(tmp_path, **kwargs) -> SQLiteBroker:
+    return SQLiteBroker(str(tmp_path / 'broker.sqlite3'), **kwargs)
+
+
+def test_each_message_is_claimed_once(tmp_path):
+    enqueuer = make_broker(tmp_path)
+    ids = {enqueuer.enqueue(DOWNLOAD_QUEUE, {'n': n}) for n in range(40)}
+    claimed = []
+
+    def work(worker_id):
+        # Separate connections, like separate worker processes
+        broker = make_broker(tmp_path)
+        while True:
+            message = broker.reserve(DOWNLOAD_QUEUE, worker_id)
+            if message is None:
+                return
+            claimed.append(message.id)
+
+    threads = [threading.Thread(target=work, args=(f'worker-{n}',)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(ids)
+
+
+def test_priority_then_arrival(tmp_path):
+    broker = make_broker(tmp_path)
+    late = broker.enqueue(DOWNLOAD_QUEUE, {}, priority=5)
+    first = broker.enqueue(DOWNLOAD_QUEUE, {})
+    second = broker.enqueue(DOWNLOAD_QUEUE, {})
+    assert broker.status(second)['position'] == 2
+    assert [broker.reserve(DOWNLOAD_QUEUE, 'w').id for _ in range(3)] == [first, second, late]
+
+
+def test_expired_reservation_is_redelivered(tmp_path):
+    broker = make_broker(tmp_path, visibility_timeout=0.05)
+    message_id = broker.enqueue(DOWNLOAD_QUEUE, {'task': 'download_media'})
+    assert broker.reserve(DOWNLOAD_QUEUE, 'dead').attempts == 1
+    assert broker.reserve(DOWNLOAD_QUEUE, 'alive') is None
+
+    time.sleep(0.1)
+    message = broker.reserve(DOWNLOAD_QUEUE, 'alive')
+    assert (message.id, message.attempts) == (message_id, 2)
+    # The first worker lost it and can no longer report on it
+    assert broker.heartbeat('dead', [message_id]) == {message_id}
+    assert not broker.complete(message_id, 'dead', {'filename': 'a.mp4'})
+    assert broker.complete(message_id, 'alive', {'filename': 'b.mp4'})
+    assert broker.status(message_id)['result'] == {'filename': 'b.mp4'}
+
+
+def test_heartbeat_keeps_the_reservation(tmp_path):
+    broker = make_broker(tmp_path, visibility_timeout=0.2)
+    message_id = broker.enqueue(DOWNLOAD_QUEUE, {})
+    broker.reserve(DOWNLOAD_QUEUE, 'worker')
+    for _ in range(3):
+        time.sleep(0.1)
+        assert broker.heartbeat('worker', [message_id]) == set()
+    assert broker.reserve(DOWNLOAD_QUEUE, 'other') is None
+
+
+def test_fails_after_max_deliveries(tmp_path):
+    broker = make_broker(tmp_path, visibility_timeout=0, max_deliveries=2)
+    message_id = broker.enqueue(DOWNLOAD_QUEUE, {})
+    assert broker.reserve(DOWNLOAD_QUEUE, 'a') is not None
+    assert broker.reserve(DOWNLOAD_QUEUE, 'b') is not None
+    assert broker.reserve(DOWNLOAD_QUEUE, 'c') is None
+    assert broker.status(message_id)['state'] == 'failed'
+
+
+def test_coalesced_message_needs_every_cancel(tmp_path):
+    broker = make_broker(tmp_path)
+    first = broker.enqueue(DOWNLOAD_QUEUE, {}, key='k')
+    assert broker.enqueue(DOWNLOAD_QUEUE, {}, key='k') == first
+    assert not broker.cancel(first)
+    assert broker.cancel(first)
+    assert broker.status(first)['state'] == 'cancelled'
+    assert broker.enqueue(DOWNLOAD_QUEUE, {}, key='k') != first
+
+
+def test_finished_messages_are_purged(tmp_path):
+    broker = make_broker(tmp_path)
+    done = broker.enqueue(DOWNLOAD_QUEUE, {})
+    queued = broker.enqueue(DOWNLOAD_QUEUE, {})
+    broker.reserve(DOWNLOAD_QUEUE, 'worker')
+    broker.complete(done, 'worker', {'filename': 'a.mp4'})
+    assert broker.purge(retention=60) == 0
+    assert broker.purge(retention=0) == 1
+    assert broker.status(done) is None
+    assert broker.status(queued)['state'] == 'queued'
+
+
+def stored_result(tmp_path, max_age=3600) -> MediaCache:
+    results = MediaCache(str(tmp_path / 'results'), max_age=max_age)
+    source = tmp_path / 'video.mp4'
+    source.write_bytes(b'data')
+    results.put('message', str(source))
+    return results
+
+
+def test_results_expire(tmp_path):
+    results = stored_result(tmp_path, max_age=0)
+    time.sleep(0.01)
+    assert results.get('message') is None
+
+
+def test_leased_result_outlives_its_ttl(tmp_path):
+    results = stored_result(tmp_path)
+    lease = results.lease('message')
+    results.max_age = 0
+    time.sleep(0.01)
+    assert results.evict() == 0
+    assert os.path.isfile(lease.path)
+
+    lease.release()
+    assert results.evict() > 0
+    assert not os.path.exists(lease.path)
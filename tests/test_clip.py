@@ -0,0 +1,46 @@
+import pytest
+
+from core.clip import MAX_CLIP_SECONDS, Clip, InvalidClip, parse_time
+
+
+@pytest.mark.parametrize('value, seconds', [
+    (90, 90.0),
+    ('90', 90.0),
+    ('1:30', 90.0),
+    ('01:01:30.5', 3690.5),
+    ('', None),
+    (None, None),
+])
+def test_parse_time(value, seconds):
+    assert parse_time(value) == seconds
+
+
+@pytest.mark.parametrize('value', ['abc', '1:xx', -1, 'nan', 'inf'])
+def test_parse_time_rejects(value):
+    with pytest.raises(InvalidClip):
+        parse_time(value)
+
+
+def test_parse():
+    assert Clip.parse() is None
+    assert Clip.parse(end='0:30') == Clip(0.0, 30.0)
+    assert Clip.parse(start='1:00') == Clip(60.0, None)
+    with pytest.raises(InvalidClip):
+        Clip.parse('0:30', '0:10')
+    with pytest.raises(InvalidClip):
+        Clip.parse(0, MAX_CLIP_SECONDS + 1)
+
+
+def test_label_is_stable():
+    assert Clip.parse('1:30', '2:00').label == Clip(90, 120).label == 'clip-90.000-120.000'
+    assert Clip(5, None).label == 'clip-5.000-end'
+
+
+def test_bounded():
+    assert Clip(10, None).bounded(60) == Clip(10, 60)
+    assert Clip(10, 90).bounded(60) == Clip(10, 60)
+    assert Clip(10, None).bounded(None) == Clip(10, None)
+    with pytest.raises(InvalidClip):
+        Clip(60, None).bounded(60)
+    with pytest.raises(InvalidClip):
+        Clip(0, None).bounded(MAX_CLIP_SECONDS + 1)
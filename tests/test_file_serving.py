@@ -0,0 +1,91 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip('starlette')
+pytest.importorskip('anyio')
+
+from file_serving import LeaseManager, parse_range
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=900-5000', (900, 999)),
+    ('bytes=1000-', None),
+    ('bytes=-0', None),
+    ('bytes=50-10', None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize('header', ['bytes=0-1,5-9', 'items=0-1', 'bytes=a-b'])
+def test_parse_range_rejects(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 1000)
+
+
+def make_download(tmp_path) -> str:
+    folder = tmp_path / 'download'
+    folder.mkdir()
+    (folder / 'video.mp4').write_bytes(b'data')
+    return str(folder)
+
+
+async def settle(seconds: float):
+    await asyncio.sleep(seconds)
+    # rmtree runs in the default executor
+    await asyncio.sleep(0.05)
+
+
+def test_removed_after_grace_once_fully_read(tmp_path):
+    async def scenario():
+        folder = make_download(tmp_path)
+        leases = LeaseManager(ttl=60, grace=0.05)
+        leases.acquire('id', folder)
+        leases.release('id', False)
+        await settle(0.1)
+        assert os.path.isdir(folder)
+
+        leases.acquire('id', folder)
+        leases.release('id', True)
+        assert os.path.isdir(folder)
+        await settle(0.1)
+        assert not os.path.exists(folder)
+        assert not leases.is_active('id')
+
+    asyncio.run(scenario())
+
+
+def test_ttl_waits_for_active_readers(tmp_path):
+    async def scenario():
+        folder = make_download(tmp_path)
+        leases = LeaseManager(ttl=0.05, grace=60)
+        leases.acquire('id', folder)
+        await settle(0.1)
+        assert os.path.isdir(folder)
+        assert leases.in_use() == {'id'}
+
+        leases.release('id', False)
+        await settle(0)
+        assert not os.path.exists(folder)
+
+    asyncio.run(scenario())
+
+
+def test_new_reader_cancels_pending_removal(tmp_path):
+    async def scenario():
+        folder = make_download(tmp_path)
+        leases = LeaseManager(ttl=60, grace=0.05)
+        leases.acquire('id', folder)
+        leases.release('id', True)
+        leases.acquire('id', folder)
+        await settle(0.1)
+        assert os.path.isdir(folder)
+        leases.forget('id')
+
+    asyncio.run(scenario())
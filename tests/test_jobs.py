@@ -0,0 +1,92 @@
+import asyncio
+import threading
+
+import pytest
+
+from jobs import DownloadEngine, JobCancelled
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+class Download:
+    """Job function that blocks until released and counts its runs"""
+
+    def __init__(self):
+        self.calls = 0
+        self.gate = threading.Event()
+
+    def __call__(self, name, progress=None):
+        self.calls += 1
+        self.gate.wait(5)
+        return name
+
+
+def test_same_key_jobs_are_coalesced():
+    async def scenario():
+        engine = DownloadEngine(max_workers=2)
+        await engine.start()
+        download = Download()
+        first = engine.submit(download, 'a', platform='youtube', key='k')
+        second = engine.submit(download, 'a', platform='youtube', key='k')
+        assert first is second and first.refs == 2
+        download.gate.set()
+        assert await first.future == 'a'
+        engine.release(first)
+        engine.release(second)
+        await engine.stop()
+        return download.calls
+
+    assert run(scenario()) == 1
+
+
+def test_last_release_cancels_a_queued_job():
+    async def scenario():
+        engine = DownloadEngine(max_workers=1)
+        await engine.start()
+        busy, queued = Download(), Download()
+        finalized = []
+        running = engine.submit(busy, 'a', platform='youtube')
+        job = engine.submit(queued, 'b', platform='youtube', key='k', on_finalize=lambda: finalized.append(1))
+        job.refs += 1
+        await asyncio.sleep(0)
+        assert engine.position(job) == 1
+
+        engine.release(job)
+        assert not job.cancelled
+        engine.release(job)
+        assert job.cancelled and job.state == 'cancelled'
+        with pytest.raises(JobCancelled):
+            await job.future
+        assert finalized == [1]
+        # The key is free again for a fresh job
+        assert engine.submit(queued, 'b', platform='youtube', key='k') is not job
+
+        busy.gate.set()
+        queued.gate.set()
+        engine.release(running)
+        await engine.stop()
+        return queued.calls
+
+    assert run(scenario()) == 1
+
+
+def test_running_job_finalizes_after_its_last_client():
+    async def scenario():
+        engine = DownloadEngine(max_workers=1)
+        await engine.start()
+        download = Download()
+        finalized = []
+        job = engine.submit(download, 'a', platform='youtube', on_finalize=lambda: finalized.append(1))
+        while job.state != 'running':
+            await asyncio.sleep(0.01)
+        download.gate.set()
+        await job.future
+        await asyncio.sleep(0)
+        assert finalized == []
+        engine.release(job)
+        assert finalized == [1]
+        await engine.stop()
+
+    run(scenario())
@@ -0,0 +1,19 @@
+from core.media_cache import MediaCache
+
+
+def test_format_selection_is_part_of_the_key():
+    web = MediaCache.make_key('instagram', 'C1a2B3c4D5e', 'mp4', 'best', 'best[ext=mp4]')
+    bot = MediaCache.make_key('instagram', 'C1a2B3c4D5e', 'mp4', 'best', '(mp4)[width>=0][height>=0]')
+    assert web != bot
+
+
+def test_put_and_get(tmp_path):
+    cache = MediaCache(str(tmp_path / 'cache'))
+    source = tmp_path / 'video.mp4'
+    source.write_bytes(b'data')
+    key = MediaCache.make_key('tiktok', '123', 'mp4')
+    assert cache.get(key) is None
+    cached = cache.put(key, str(source), url='https://www.tiktok.com/@u/video/123')
+    assert cache.get(key) == cached
+    assert open(cached, 'rb').read() == b'data'
+    assert cache.stats()['hits'] == 1
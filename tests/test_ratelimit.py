@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+from core.ratelimit import CircuitBreaker, CircuitOpen, PlatformGuard, RateLimited
+
+
+class RefusingBucket:
+    def acquire(self, name, rate, burst):
+        raise RateLimited("no tokens")
+
+
+def half_open_guard(bucket=None) -> PlatformGuard:
+    guard = PlatformGuard(bucket=bucket, rates={'tiktok': (1.0, 1.0)}, attempts=1)
+    breaker = CircuitBreaker(cooldown=0)
+    breaker.state, breaker.opened_at = 'open', time.monotonic()
+    guard._breakers['tiktok'] = breaker
+    return guard
+
+
+def test_rate_limited_trial_is_released():
+    guard = half_open_guard(RefusingBucket())
+    with pytest.raises(RateLimited):
+        guard.call('tiktok', lambda: 'ok')
+
+    guard.bucket = None
+    guard.rates = {}
+    assert guard.call('tiktok', lambda: 'ok') == 'ok'
+    assert guard.breaker('tiktok').state == 'closed'
+
+
+def test_interrupted_trial_is_released():
+    guard = half_open_guard()
+    guard.rates = {}
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        guard.call('tiktok', interrupted)
+    assert guard.call('tiktok', lambda: 'ok') == 'ok'
+
+
+def test_failed_trial_reopens():
+    guard = half_open_guard()
+    guard.rates = {}
+    guard.breaker('tiktok').cooldown = 60
+    guard.breaker('tiktok').opened_at -= 60
+
+    def reset():
+        raise OSError("connection reset")
+
+    with pytest.raises(OSError):
+        guard.call('tiktok', reset)
+    with pytest.raises(CircuitOpen):
+        guard.call('tiktok', lambda: 'ok')
+
+
+class DownloadCancelled(Exception):
+    pass
+
+
+def test_cancelled_trial_is_not_recorded():
+    guard = half_open_guard()
+    guard.rates = {}
+
+    def cancelled():
+        raise DownloadCancelled("Завантаження скасовано")
+
+    with pytest.raises(DownloadCancelled):
+        guard.call('tiktok', cancelled)
+    breaker = guard.breaker('tiktok')
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
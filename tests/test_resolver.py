@@ -0,0 +1,49 @@
+import pytest
+
+from core.resolver import Resolver, UnsupportedURL
+
+
+class FakeExpander:
+    def __init__(self, target: str):
+        self.target = target
+        self.expanded = []
+
+    def expand(self, url: str) -> str:
+        self.expanded.append(url)
+        return self.target
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.instagram.com/p/C1a2B3c4D5e/',
+    'https://www.instagram.com/reel/C1a2B3c4D5e/?igsh=abc',
+    'https://instagram.com/some.user/reel/C1a2B3c4D5e/',
+])
+def test_instagram_direct_links(url):
+    resolved = Resolver(expander=FakeExpander('')).resolve(url)
+    assert resolved.platform == 'instagram'
+    assert resolved.video_id == 'C1a2B3c4D5e'
+
+
+@pytest.mark.parametrize('url', [
+    'https://www.instagram.com/share/p/BAxyzToken1/',
+    'https://www.instagram.com/share/reel/BAxyzToken1/',
+])
+def test_instagram_share_links_are_expanded(url):
+    expander = FakeExpander('https://www.instagram.com/reel/C1a2B3c4D5e/')
+    resolved = Resolver(expander=expander).resolve(url)
+    assert expander.expanded == [url]
+    assert resolved.video_id == 'C1a2B3c4D5e'
+    assert resolved.canonical_url == 'https://www.instagram.com/p/C1a2B3c4D5e/'
+
+
+def test_unsupported_link():
+    with pytest.raises(UnsupportedURL):
+        Resolver(expander=FakeExpander('')).resolve('https://example.com/video')
+
+
+def test_registered_pattern():
+    resolver = Resolver(expander=FakeExpander(''))
+    resolver.register('origin', r'^http://127\.0\.0\.1:8090/(?P<id>video/\w+\.mp4)', 'http://127.0.0.1:8090/{id}')
+    resolved = resolver.resolve('http://127.0.0.1:8090/video/abc.mp4')
+    assert resolved == ('origin', 'video/abc.mp4', 'http://127.0.0.1:8090/video/abc.mp4')
+    assert Resolver(expander=FakeExpander('')).match('http://127.0.0.1:8090/video/abc.mp4') is None